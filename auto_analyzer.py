@@ -5,7 +5,8 @@ from datetime import datetime, timedelta
 import subprocess
 import json
 import logging
-from notification_utils import NotificationSender
+import threading
+import metrics
 
 class AutoStockAnalyzer:
     """自动股票分析器，用于定时运行股票分析任务"""
@@ -21,6 +22,7 @@ class AutoStockAnalyzer:
         self.logger = self._setup_logger()
         
         # 通知发送器
+        from notification_utils import NotificationSender
         self.notification_sender = NotificationSender("notification_config.json")
         
         # 获取当前目录
@@ -29,11 +31,35 @@ class AutoStockAnalyzer:
         # 配置文件路径
         self.config_file = os.path.join(self.current_dir, "auto_run_config.json")
         
-        # 加载配置
+        # 加载配置，命令行参数覆盖的设置在重新加载配置后保留
+        self.config_overrides = {}
         self.config = self._load_config()
+        self._config_mtime = self._get_config_mtime()
         
         # 分析脚本路径
         self.analysis_script = os.path.join(self.current_dir, "stock_analysis.py")
+        
+        # 进程内模式下常驻的StockAnalyzer实例，首次运行时创建
+        self._analyzer = None
+        
+        # 最近一次进程内运行的结构化结果
+        self.last_report = None
+        
+        # 定时模式下多个任务同时到期时依次运行
+        self._job_lock = threading.Lock()
+        
+        # 通知发件箱：通知先持久化，再由后台线程发送和重试，发送失败不会触发重新分析
+        self.outbox = None
+        outbox_config = dict(self.config.get("outbox") or {})
+        if outbox_config.pop("enabled", True):
+            from notification_outbox import NotificationOutbox
+            try:
+                self.outbox = NotificationOutbox(self.notification_sender, outbox_config).start()
+            except Exception as e:
+                self.logger.error(f"初始化通知发件箱失败，将直接发送通知: {e}")
+        
+        # 本地结果服务，定时和盘中监控模式下启动
+        self.result_service = None
     
     def _setup_logger(self):
         """设置日志配置"""
@@ -53,10 +79,23 @@ class AutoStockAnalyzer:
     def _load_config(self):
         """加载配置文件"""
         default_config = {
-            "schedule_time": "09:45",  # 默认每天上午9:45执行
+            "schedule_time": "09:45",  # 默认每天上午9:45执行（未配置jobs时使用）
+            "jobs": None,  # 定时任务：任务名 -> {"cron": "45 9 * * 1-5", "analysis_types": [...], "grace": 秒}
+            "schedule_grace": 900,  # 错过的定时任务在该时间（秒）内补跑，超过则跳过
+            "baseline_time": "15:30",  # 收盘后把全市场快照滚入成交量基线的时间，None表示不自动更新
             "analysis_types": ["industry_flow", "abnormal_volume", "us_stock"],  # 默认分析类型
             "notification_methods": None,  # 默认使用notification_config.json中的所有配置
-            "timeout": 300  # 默认超时时间（秒）
+            "timeout": 300,  # 默认超时时间（秒）
+            "workers": None,  # 并发运行分析的线程数，默认每个分析一个线程
+            "run_mode": "inprocess",  # 运行方式：inprocess（常驻进程内运行）或subprocess（子进程隔离运行）
+            "export_csv": False,  # 是否同时导出按天的CSV文件
+            "hedge_delay": 5.0,  # 行业资金流向首选数据来源超过该秒数未返回时并行请求备用来源，0表示同时请求
+            "industry_flow_mode": "industry",  # 行业资金流向优先使用行业接口(industry)或由个股资金流向汇总(stocks)
+            "drill_down": 0,  # 对净流入和净流出最多的各N个行业列出主要贡献个股，0表示不下钻
+            "monitor": {},  # 盘中监控设置，见intraday_monitor.DEFAULT_MONITOR_CONFIG
+            "outbox": {"enabled": True},  # 通知发件箱设置，见notification_outbox.DEFAULT_OUTBOX_CONFIG
+            "result_service": {"enabled": False},  # 本地结果查询和推送服务，见result_service.DEFAULT_SERVICE_CONFIG
+            "data_provider": {"mode": "live"}  # 数据源：live直接获取，record录制，replay离线回放（recordings_dir、latency）
         }
         
         if os.path.exists(self.config_file):
@@ -96,8 +135,72 @@ class AutoStockAnalyzer:
         if analysis_types is None:
             analysis_types = self.config.get("analysis_types", [])
         
-        # 构建命令参数
-        cmd_args = [sys.executable, self.analysis_script]
+        run_mode = self.config.get("run_mode", "inprocess")
+        with metrics.span('run', run_mode) as span:
+            if run_mode == "subprocess":
+                message = self._run_analysis_subprocess(analysis_types)
+            else:
+                report = self.run_analysis_report(analysis_types)
+                message = report['message'] if report else None
+            if message is None:
+                span.status = 'error'
+        # 进程内和子进程运行的结果都已写入历史数据存储，通知结果服务立即加载
+        if self.result_service:
+            self.result_service.notify()
+        return message
+    
+    def _get_analyzer(self):
+        """获取常驻的StockAnalyzer实例，akshare/pandas/matplotlib只在首次调用时导入"""
+        if self._analyzer is None:
+            from stock_analysis import StockAnalyzer
+            from data_provider import DataProvider
+            self._analyzer = StockAnalyzer(
+                workers=self.config.get("workers"),
+                export_csv=self.config.get("export_csv", False),
+                provider=DataProvider(**self.config.get("data_provider", {})),
+                hedge_delay=self.config.get("hedge_delay", 5.0),
+                flow_mode=self.config.get("industry_flow_mode", "industry"),
+                drill_down=self.config.get("drill_down", 0)
+            )
+            self.logger.info("已创建进程内StockAnalyzer实例")
+        return self._analyzer
+    
+    def run_analysis_report(self, analysis_types=None):
+        """在当前进程内运行分析，返回结构化结果
+        
+        Returns:
+            dict: StockAnalyzer.run_analysis_report的返回值（title、message、results），运行异常时返回None
+        """
+        if analysis_types is None:
+            analysis_types = self.config.get("analysis_types", [])
+        
+        start_time = time.time()
+        try:
+            analyzer = self._get_analyzer()
+            # 通知由自动分析器统一发送，避免重复推送
+            report = analyzer.run_analysis_report(
+                analysis_types or None,
+                workers=self.config.get("workers"),
+                timeout=self.config.get("timeout", 300),
+                notify=False
+            )
+        except Exception as e:
+            self.logger.error(f"进程内运行股票分析时发生异常: {e}")
+            return None
+        
+        self.last_report = report
+        self.logger.info(f"进程内股票分析完成，耗时{time.time() - start_time:.2f}秒")
+        for name, result in report['results'].items():
+            self.logger.info(f"{name}: {'成功' if result.get('message') else '失败'}，输出文件: {result.get('files')}")
+        
+        if not report['message']:
+            self.logger.error("股票分析未生成任何报告")
+        return report
+    
+    def _run_analysis_subprocess(self, analysis_types):
+        """在独立子进程中运行stock_analysis.py，并从标准输出提取报告"""
+        # 构建命令参数，通知由自动分析器统一发送
+        cmd_args = [sys.executable, self.analysis_script, "--no-notify"]
         
         # 根据分析类型添加命令行参数
         if analysis_types:
@@ -111,6 +214,24 @@ class AutoStockAnalyzer:
             # 如果没有指定分析类型，添加--all参数
             cmd_args.append("--all")
         
+        # 并发线程数
+        if self.config.get("workers"):
+            cmd_args.extend(["--workers", str(self.config["workers"])])
+        
+        if self.config.get("export_csv"):
+            cmd_args.append("--csv")
+        
+        if self.config.get("hedge_delay") is not None:
+            cmd_args.extend(["--hedge-delay", str(self.config["hedge_delay"])])
+        if self.config.get("industry_flow_mode"):
+            cmd_args.extend(["--flow-mode", self.config["industry_flow_mode"]])
+        if self.config.get("drill_down"):
+            cmd_args.extend(["--drill-down", str(self.config["drill_down"])])
+        
+        # 数据源模式（录制或回放）
+        from data_provider import provider_arguments
+        cmd_args.extend(provider_arguments(self.config.get("data_provider", {})))
+        
         self.logger.info(f"运行命令: {' '.join(cmd_args)}")
         
         try:
@@ -188,24 +309,35 @@ class AutoStockAnalyzer:
         # 如果没有找到有价值的信息，返回完整输出的前一部分
         return output[:1000] if len(output) > 1000 else output
     
+    @property
+    def notifier(self):
+        """发送通知使用的对象，启用发件箱时为发件箱，否则为通知发送器"""
+        return self.outbox or self.notification_sender
+    
     def send_notification(self, message):
         """发送通知"""
         if not message:
             self.logger.error("没有可发送的消息内容")
             return False
         
+        # 录制和回放的报告不推送给订阅者，与StockAnalyzer一致
+        mode = self.config.get("data_provider", {}).get("mode", "live")
+        if mode != "live":
+            self.logger.info(f"{mode}模式不发送通知，报告内容:\n{message}")
+            return True
+        
         try:
             title = f"📊 股票市场分析报告 ({datetime.now().strftime('%Y-%m-%d')})"
             methods = self.config.get("notification_methods")
             
-            # 发送通知
-            results = self.notification_sender.send_notification(title, message, methods)
+            # 发送通知，启用发件箱时只需写入发件箱即可返回
+            results = self.notifier.send_notification(title, message, methods)
             
             # 检查是否有至少一种通知方式发送成功
             success = any(result for result in results.values())
             
             if success:
-                self.logger.info("通知发送成功")
+                self.logger.info("通知已加入发件箱" if self.outbox else "通知发送成功")
             else:
                 self.logger.error("所有通知方式均发送失败")
             
@@ -228,65 +360,131 @@ class AutoStockAnalyzer:
         else:
             self.logger.error("无法获取推送消息，通知发送失败")
         
+        # 退出前等待发件箱发送完毕，未发出的消息下次启动后继续发送
+        if self.outbox:
+            self.outbox.flush()
+            self.outbox.stop()
+        
+        # 进程内运行时等待后台的图表渲染和个股行业映射刷新完成，否则进程退出后它们被中断
+        if self._analyzer is not None:
+            self._analyzer.charts.wait()
+            self._analyzer.wait_industry_index()
+        
+        metrics.recorder.write_textfile()
         self.logger.info("===== 自动运行结束 =====")
     
+    def apply_overrides(self, overrides):
+        """应用命令行参数覆盖的设置"""
+        self.config_overrides.update(overrides)
+        self.config.update(overrides)
+    
+    def _get_config_mtime(self):
+        """返回配置文件的修改时间，文件不存在时返回None"""
+        try:
+            return os.path.getmtime(self.config_file)
+        except OSError:
+            return None
+    
+    def _build_jobs(self):
+        """根据配置生成定时任务列表，没有配置jobs时按schedule_time每天运行一次
+        
+        配置了baseline_time且没有action为volume_baseline的任务时，另外添加一个收盘后更新成交量基线的任务，
+        否则只在盘中运行的分析永远不会把完整的收盘快照滚入基线。
+        """
+        from scheduler import Job
+        jobs_config = dict(self.config.get("jobs") or {"daily": {"cron": self.config.get("schedule_time", "09:45")}})
+        baseline_time = self.config.get("baseline_time")
+        if baseline_time and not any(isinstance(spec, dict) and spec.get("action") == "volume_baseline"
+                                     for spec in jobs_config.values()):
+            jobs_config.setdefault("volume_baseline", {"cron": baseline_time, "action": "volume_baseline"})
+        jobs = []
+        for name, spec in jobs_config.items():
+            if not isinstance(spec, dict):
+                spec = {"cron": spec}
+            try:
+                jobs.append(Job(name, spec["cron"], self._run_job,
+                                grace=spec.get("grace", self.config.get("schedule_grace", 900)), options=spec))
+            except (KeyError, ValueError) as e:
+                self.logger.error(f"定时任务 {name} 配置无效，已忽略: {e}")
+        return jobs
+    
+    def _reload_jobs(self):
+        """配置文件修改后重新加载配置，返回新的任务列表；未修改时返回None"""
+        mtime = self._get_config_mtime()
+        if mtime == self._config_mtime:
+            return None
+        self._config_mtime = mtime
+        self.config = self._load_config()
+        self.config.update(self.config_overrides)
+        return self._build_jobs()
+    
+    def _run_job(self, job):
+        """运行一个定时任务：执行分析并发送通知，休市日跳过"""
+        from data_cache import market_now
+        from trading_calendar import get_calendar
+        market = job.options.get("market", "CN")
+        if job.options.get("trading_days_only", True):
+            today = market_now(market).date()
+            if not get_calendar(market).is_session(today):
+                # 休市日的数据与上一个交易日相同，不再重复获取和推送
+                self.logger.info(f"{today} {market}市场休市，跳过定时任务 {job.name}")
+                return
+        
+        # 避免共用的分析器同时执行多次分析
+        with self._job_lock:
+            if job.options.get("action") == "volume_baseline":
+                # 只更新成交量基线，不做分析和推送
+                self._get_analyzer().update_volume_baseline()
+                return
+            push_message = self.run_analysis(job.options.get("analysis_types"))
+            if push_message:
+                self.logger.info("准备发送通知")
+                self.send_notification(push_message)
+            else:
+                self.logger.error("无法获取推送消息，通知发送失败")
+            metrics.recorder.write_textfile()
+    
+    def start_result_service(self):
+        """按配置启动本地结果查询和推送服务，未启用或启动失败时返回None"""
+        service_config = dict(self.config.get("result_service") or {})
+        if not service_config.get("enabled") or self.result_service:
+            return self.result_service
+        from result_service import ResultService
+        try:
+            self.result_service = ResultService(service_config).start()
+        except Exception as e:
+            self.logger.error(f"启动结果服务失败: {e}")
+        return self.result_service
+    
     def run_scheduled(self):
-        """启动定时任务模式"""
+        """启动定时任务模式，按配置的各定时任务的运行时间等待并执行，配置文件修改后无需重启"""
+        from scheduler import Scheduler
         self.logger.info("===== 自动运行股票分析程序 - 定时模式 =====")
-        self.logger.info(f"每天预定执行时间: {self.config.get('schedule_time', '09:45')}")
+        self.start_result_service()
         
-        while True:
-            try:
-                # 获取当前时间
-                now = datetime.now()
-                current_time = now.strftime("%H:%M")
-                
-                # 获取预定执行时间
-                schedule_time = self.config.get("schedule_time", "09:45")
-                
-                # 检查是否到达执行时间
-                if current_time == schedule_time:
-                    # 检查今天是否已经执行过
-                    last_run_file = os.path.join(self.log_dir, "last_run.txt")
-                    today = now.strftime("%Y-%m-%d")
-                    
-                    if os.path.exists(last_run_file):
-                        with open(last_run_file, 'r') as f:
-                            last_run_date = f.read().strip()
-                    else:
-                        last_run_date = ""
-                    
-                    if last_run_date != today:
-                        self.logger.info(f"到达预定执行时间: {schedule_time}，开始执行分析")
-                        
-                        # 运行分析
-                        push_message = self.run_analysis()
-                        
-                        if push_message:
-                            self.logger.info("准备发送通知")
-                            # 发送通知
-                            self.send_notification(push_message)
-                        else:
-                            self.logger.error("无法获取推送消息，通知发送失败")
-                        
-                        # 记录今天已执行
-                        with open(last_run_file, 'w') as f:
-                            f.write(today)
-                        
-                        self.logger.info(f"今日分析任务已完成，下次执行时间: 明天{schedule_time}")
-                    else:
-                        self.logger.info(f"今天({today})已经执行过分析任务，跳过本次执行")
-                
-                # 每分钟检查一次
-                time.sleep(60)
-                
-            except KeyboardInterrupt:
-                self.logger.info("定时任务已被用户中断")
-                break
-            except Exception as e:
-                self.logger.error(f"定时任务执行过程中发生异常: {e}")
-                # 发生异常后，等待一段时间再继续，避免频繁出错
-                time.sleep(300)  # 等待5分钟
+        scheduler = Scheduler(os.path.join(self.log_dir, "scheduler_state.json"), reload=self._reload_jobs)
+        scheduler.set_jobs(self._build_jobs())
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            self.logger.info("定时任务已被用户中断")
+        finally:
+            scheduler.stop(timeout=0)
+            if self.result_service:
+                self.result_service.stop()
+    
+    def run_monitor(self):
+        """启动盘中监控模式，交易时段内轮询行情和行业资金流向并推送异动提醒"""
+        from intraday_monitor import IntradayMonitor
+        self.start_result_service()
+        monitor = IntradayMonitor(self._get_analyzer(), self.notifier, self.config.get("monitor"))
+        try:
+            monitor.run()
+        except KeyboardInterrupt:
+            self.logger.info("盘中监控已被用户中断")
+        finally:
+            if self.result_service:
+                self.result_service.stop()
     
     def update_config(self, new_config):
         """更新配置"""
@@ -307,27 +505,48 @@ class AutoStockAnalyzer:
 # 主函数
 def main():
     """主函数"""
-    # 创建自动分析器实例
-    auto_analyzer = AutoStockAnalyzer()
-    
     # 解析命令行参数
     import argparse
     parser = argparse.ArgumentParser(description='自动运行股票分析程序并推送结果')
     parser.add_argument('--once', action='store_true', help='仅运行一次并退出')
     parser.add_argument('--schedule', action='store_true', help='启动定时任务模式')
+    parser.add_argument('--monitor', action='store_true', help='启动盘中监控模式，交易时段内轮询并推送异动提醒')
     
     # 分析类型参数
     parser.add_argument('--industry', action='store_true', help='仅运行行业资金流向分析')
     parser.add_argument('--volume', action='store_true', help='仅运行个股异常成交量分析')
     parser.add_argument('--us', action='store_true', help='仅运行美股行业分析')
     parser.add_argument('--all', action='store_true', help='运行所有分析')
+    parser.add_argument('--subprocess', action='store_true', help='在独立子进程中运行分析（默认在当前进程内运行）')
+    parser.add_argument('--serve', action='store_true', help='定时和盘中监控模式下同时启动本地结果服务（result_service.py）')
+    parser.add_argument('--startup-profile', action='store_true', help='统计启动及各按需导入模块的导入耗时后退出')
+    from data_provider import add_provider_arguments, provider_config
+    add_provider_arguments(parser)
     
     args = parser.parse_args()
     
+    if args.startup_profile:
+        from startup_profile import print_startup_profile, LAZY_MODULES
+        print_startup_profile("auto_analyzer", ["notification_utils", "stock_analysis"] + LAZY_MODULES)
+        return
+    
+    # 创建自动分析器实例（解析参数之后，--help时无需初始化）
+    auto_analyzer = AutoStockAnalyzer()
+    
+    overrides = {"data_provider": provider_config(args, auto_analyzer.config.get("data_provider"))}
+    if args.subprocess:
+        overrides["run_mode"] = "subprocess"
+    if args.serve:
+        overrides["result_service"] = dict(auto_analyzer.config.get("result_service") or {}, enabled=True)
+    auto_analyzer.apply_overrides(overrides)
+    
     # 根据参数执行不同的逻辑
     if args.once:
         # 仅运行一次
         auto_analyzer.run_once()
+    elif args.monitor:
+        # 启动盘中监控模式
+        auto_analyzer.run_monitor()
     elif args.schedule:
         # 启动定时任务模式
         try:
@@ -339,6 +558,7 @@ def main():
         print("使用方法:")
         print("  python auto_analyzer.py --once       # 仅运行一次并退出")
         print("  python auto_analyzer.py --schedule   # 启动定时任务模式")
+        print("  python auto_analyzer.py --monitor    # 启动盘中监控模式")
         print("\n分析类型选项（可与--once一起使用）:")
         print("  --industry   # 仅运行行业资金流向分析")
         print("  --volume     # 仅运行个股异常成交量分析")
@@ -352,4 +572,4 @@ def main():
         auto_analyzer.run_once()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,441 @@
+import os
+import time
+import sqlite3
+import logging
+import contextlib
+from datetime import date, datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from history_store import BACKFILL_SOURCE, HistoryStore, normalize_frame
+from data_provider import DataProvider
+from trading_calendar import get_calendar
+from volume_anomaly import normalize_codes
+
+# 同花顺行业名称 -> 东方财富行业板块名称，只列出名称不同的行业；回填前与东方财富的行业列表核对，
+# 找不到对应板块的行业记录日志后跳过
+EASTMONEY_INDUSTRY_NAMES = {
+    '煤炭开采加工': '煤炭行业',
+    '石油加工贸易': '石油行业',
+    '钢铁': '钢铁行业',
+    '电力': '电力行业',
+    '环保': '环保行业',
+    '物流': '物流行业',
+    '港口航运': '航运港口',
+    '公路铁路运输': '铁路公路',
+    '旅游及酒店': '旅游酒店',
+    '白酒': '酿酒行业',
+    '化学纤维': '化纤行业',
+    '贸易': '贸易行业',
+    '零售': '商业百货',
+    '元件': '电子元件',
+    'IT服务': '互联网服务',
+    '造纸': '造纸印刷',
+    '综合': '综合行业',
+}
+
+# 美股行业以SPDR行业ETF的日线代表：ETF代码 -> 行业名称
+US_SECTOR_ETFS = {
+    'XLK': '信息技术',
+    'XLF': '金融',
+    'XLV': '医疗保健',
+    'XLE': '能源',
+    'XLI': '工业',
+    'XLY': '可选消费',
+    'XLP': '必需消费',
+    'XLU': '公用事业',
+    'XLB': '原材料',
+    'XLRE': '房地产',
+    'XLC': '通信服务',
+}
+
+# 可回填的数据集 -> (akshare接口, 合并时判断重复行的列)
+BACKFILL_DATASETS = {
+    'industry_flow': ('stock_sector_fund_flow_hist', '行业名称'),
+    'daily_bars': ('stock_zh_a_hist', '代码'),
+    'us_sectors': ('stock_us_daily', '名称'),
+}
+
+# 个股日线每次请求的最长日期跨度（天），更长的区间分段请求，中断后以段为单位续传；
+# 行业资金流向和美股ETF的接口一次返回全部历史，不分段
+CHUNK_DAYS = 366
+
+# 每完成该数量的任务记录一次进度
+PROGRESS_EVERY = 100
+
+# 工作进程内的数据源，由_init_worker创建
+_provider = None
+
+def _init_worker(provider_config):
+    """工作进程初始化：每个进程使用自己的数据源，限流状态通过upstream_guard的共享文件协调"""
+    global _provider
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    _provider = DataProvider(**provider_config)
+
+def _numeric(values):
+    return pd.to_numeric(values, errors='coerce')
+
+def _fetch_industry_flow(name, start, end):
+    """获取一个同花顺行业对应的东方财富行业历史资金流向，金额换算为亿元
+    
+    东方财富只提供主力净流入，与同花顺的净额（流入资金-流出资金）口径不同，写入单独的主力净额列，净额留空。
+    """
+    df = _provider.call('stock_sector_fund_flow_hist', symbol=EASTMONEY_INDUSTRY_NAMES.get(name, name))
+    dates = pd.to_datetime(df['日期'])
+    keep = ((dates >= pd.Timestamp(start)) & (dates <= pd.Timestamp(end))).to_numpy()
+    df = df[keep]
+    frame = pd.DataFrame({'date': dates[keep].to_numpy(), '行业名称': name,
+                          '主力净额': _numeric(df['主力净流入-净额']).to_numpy() / 1e8})
+    for size in ('超大单', '大单', '中单', '小单'):
+        frame[f'{size}净额'] = _numeric(df[f'{size}净流入-净额']).to_numpy() / 1e8
+    frame['数据来源'] = BACKFILL_SOURCE
+    return frame
+
+def _fetch_daily_bars(code, start, end):
+    """获取一只股票的日线（不复权）"""
+    df = _provider.call('stock_zh_a_hist', symbol=code, period='daily', start_date=start.strftime('%Y%m%d'),
+                        end_date=end.strftime('%Y%m%d'), adjust='')
+    df = df.rename(columns={'日期': 'date'})
+    df['date'] = pd.to_datetime(df['date'])
+    df['代码'] = code
+    return df
+
+def _fetch_us_sector(symbol, start, end):
+    """获取一只美股行业ETF的日线，按收盘价计算涨跌额和涨跌幅"""
+    df = _provider.call('stock_us_daily', symbol=symbol, adjust='')
+    dates = pd.to_datetime(df['date'])
+    close = _numeric(df['close'])
+    change = close.diff()
+    frame = pd.DataFrame({'date': dates, '名称': US_SECTOR_ETFS.get(symbol, symbol), '最新价': close,
+                          '涨跌额': change, '涨跌幅': change / close.shift() * 100})
+    return frame[(dates >= pd.Timestamp(start)) & (dates <= pd.Timestamp(end))]
+
+FETCHERS = {
+    'industry_flow': _fetch_industry_flow,
+    'daily_bars': _fetch_daily_bars,
+    'us_sectors': _fetch_us_sector,
+}
+
+def _run_unit(unit, staging_dir):
+    """在工作进程中获取一个任务的数据，转换为统一字段后写入暂存文件
+    
+    Args:
+        unit (tuple): (数据集, 起始日期, 结束日期, 代码或名称)
+        staging_dir (str): 暂存目录
+    
+    Returns:
+        tuple: (unit, 行数, 暂存文件路径, 错误信息)
+    """
+    dataset, start, end, symbol = unit
+    try:
+        raw = FETCHERS[dataset](symbol, start, end)
+        frame = normalize_frame(raw, dataset)
+        frame.insert(0, 'date', pd.to_datetime(raw['date']).to_numpy())
+        frame = frame.dropna(subset=['date'])
+        
+        path = os.path.join(staging_dir, dataset, f"{start:%Y%m%d}-{symbol}.parquet")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        frame.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        return unit, len(frame), path, None
+    except Exception as e:
+        return unit, 0, None, f"{type(e).__name__}: {e}"
+
+class BackfillCheckpoint:
+    """回填任务的断点记录
+    
+    每个任务以(数据集, 日期, 代码)为键记录状态：staged为数据已写入暂存文件，merged为已合并进历史数据存储，
+    failed为获取失败（下次运行时重试）。只由主进程写入。
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS units (dataset TEXT, date TEXT, symbol TEXT, status TEXT, "
+                       "rows INTEGER, file TEXT, error TEXT, updated TEXT, PRIMARY KEY (dataset, date, symbol))")
+    
+    @contextlib.contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+    
+    def mark(self, unit, status, rows=0, file=None, error=None):
+        """记录一个任务的状态"""
+        dataset, start, _, symbol = unit
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       (dataset, start.isoformat(), symbol, status, rows, file, error,
+                        datetime.now().isoformat(timespec='seconds')))
+    
+    def finished(self, dataset):
+        """返回数据集已完成（已暂存或已合并）的任务键集合：{(日期, 代码), ...}"""
+        with self._connect() as db:
+            rows = db.execute("SELECT date, symbol FROM units WHERE dataset = ? AND status IN ('staged', 'merged')",
+                              (dataset,)).fetchall()
+        return set(rows)
+    
+    def staged(self, dataset):
+        """返回数据集已暂存、尚未合并的任务：[(日期, 代码, 暂存文件), ...]"""
+        with self._connect() as db:
+            return db.execute("SELECT date, symbol, file FROM units WHERE dataset = ? AND status = 'staged'",
+                              (dataset,)).fetchall()
+    
+    def mark_merged(self, dataset, keys):
+        """把数据集的一批任务标记为已合并"""
+        with self._connect() as db:
+            db.executemany("UPDATE units SET status = 'merged', file = NULL WHERE dataset = ? AND date = ? AND symbol = ?",
+                           [(dataset, day, symbol) for day, symbol in keys])
+    
+    def mark_failed(self, dataset, keys, error):
+        """把数据集的一批已暂存任务标记为失败，下次运行时重新获取"""
+        with self._connect() as db:
+            db.executemany("UPDATE units SET status = 'failed', file = NULL, error = ?, updated = ? "
+                           "WHERE dataset = ? AND date = ? AND symbol = ?",
+                           [(error, datetime.now().isoformat(timespec='seconds'), dataset, day, symbol)
+                            for day, symbol in keys])
+    
+    def summary(self):
+        """返回各数据集各状态的任务数：{数据集: {状态: 数量}}"""
+        with self._connect() as db:
+            rows = db.execute("SELECT dataset, status, COUNT(*) FROM units GROUP BY dataset, status").fetchall()
+        result = {}
+        for dataset, status, count in rows:
+            result.setdefault(dataset, {})[status] = count
+        return result
+    
+    def reset(self, datasets):
+        """清除数据集的断点记录，用于重新回填"""
+        with self._connect() as db:
+            db.executemany("DELETE FROM units WHERE dataset = ?", [(dataset,) for dataset in datasets])
+
+class Backfiller:
+    """历史数据回填工具
+    
+    按(数据集, 日期段, 代码)把回填拆分为独立任务，由进程池并发获取；所有akshare请求经过upstream_guard，
+    多个工作进程共享同一个按站点的限流额度。每个完成的任务先写入暂存文件并记录断点，
+    中断后重新运行只处理未完成的任务；全部任务完成后按交易日合并写入历史数据存储。
+    """
+    
+    def __init__(self, history_root="./history", workers=4, provider_config=None,
+                 industry_index_file="./cache/industry_index.npz"):
+        """初始化回填工具
+        
+        Args:
+            history_root (str): 历史数据存储目录
+            workers (int): 工作进程数
+            provider_config (dict): 数据源设置，见data_provider.provider_config
+            industry_index_file (str): 个股行业映射的索引文件，从中读取需要回填的行业，不存在时获取同花顺行业列表
+        """
+        self.history = HistoryStore(history_root)
+        self.workers = workers
+        self.provider_config = provider_config or {'mode': 'live'}
+        self.industry_index_file = industry_index_file
+        self.staging_dir = os.path.join(history_root, "_backfill")
+        self.checkpoint = BackfillCheckpoint(os.path.join(self.staging_dir, "checkpoint.db"))
+        self.logger = logging.getLogger("stock_analyzer")
+    
+    def symbols(self, dataset):
+        """返回数据集需要回填的代码或名称列表"""
+        if dataset == 'us_sectors':
+            return list(US_SECTOR_ETFS)
+        if dataset == 'industry_flow':
+            from industry_index import IndustryIndex
+            industries = IndustryIndex(self.industry_index_file).industries
+            if len(industries):
+                return industries['行业名称'].astype(str).tolist()
+            listing = DataProvider(**self.provider_config).call('stock_board_industry_name_ths')
+            return listing['name'].astype(str).tolist()
+        spot = DataProvider(**self.provider_config).call('stock_zh_a_spot')
+        return sorted(set(normalize_codes(spot['代码'])))
+    
+    def _match_eastmoney_industries(self, names):
+        """按EASTMONEY_INDUSTRY_NAMES把同花顺行业对应到东方财富行业板块，返回能对应上的同花顺行业名称
+        
+        对应不上的行业记录日志后跳过，不作为失败的任务反复重试；获取东方财富行业列表失败时不做核对。
+        """
+        try:
+            listing = DataProvider(**self.provider_config).call('stock_board_industry_name_em')
+            boards = set(listing['板块名称'].astype(str))
+        except Exception as e:
+            self.logger.warning(f"获取东方财富行业列表失败，不核对行业名称: {e}")
+            return names
+        matched = [name for name in names if EASTMONEY_INDUSTRY_NAMES.get(name, name) in boards]
+        unmatched = [name for name in names if EASTMONEY_INDUSTRY_NAMES.get(name, name) not in boards]
+        if unmatched:
+            self.logger.info(f"{len(unmatched)}个同花顺行业在东方财富找不到对应的行业板块，不回填: {', '.join(unmatched)}")
+        return matched
+    
+    def plan(self, datasets, start, end, symbols=None):
+        """把回填拆分为任务列表，跳过断点中已完成的任务
+        
+        Args:
+            datasets (list): 数据集列表，见BACKFILL_DATASETS
+            start (date): 起始日期（含）
+            end (date): 结束日期（含）
+            symbols (dict): 数据集 -> 代码或名称列表，未指定的数据集回填全部
+        
+        Returns:
+            list: [(数据集, 起始日期, 结束日期, 代码或名称), ...]
+        """
+        units = []
+        for dataset in datasets:
+            chunks = [(start, end)]
+            if dataset == 'daily_bars':
+                chunks = []
+                chunk_start = start
+                while chunk_start <= end:
+                    chunk_end = min(end, chunk_start + timedelta(days=CHUNK_DAYS - 1))
+                    chunks.append((chunk_start, chunk_end))
+                    chunk_start = chunk_end + timedelta(days=1)
+            
+            finished = self.checkpoint.finished(dataset)
+            names = (symbols or {}).get(dataset) or self.symbols(dataset)
+            if dataset == 'industry_flow':
+                names = self._match_eastmoney_industries(names)
+            pending = [(dataset, chunk_start, chunk_end, symbol) for chunk_start, chunk_end in chunks for symbol in names
+                       if (chunk_start.isoformat(), symbol) not in finished]
+            skipped = len(chunks) * len(names) - len(pending)
+            self.logger.info(f"{dataset}: {len(names)}个代码 x {len(chunks)}段，待回填{len(pending)}个任务"
+                             + (f"，{skipped}个已完成" if skipped else ""))
+            units.extend(pending)
+        return units
+    
+    def run(self, datasets, start, end, symbols=None):
+        """回填datasets在start到end之间的数据，返回各状态的任务数"""
+        if not self.history.available:
+            raise RuntimeError("未安装pyarrow，无法写入历史数据存储")
+        units = self.plan(datasets, start, end, symbols)
+        counts = {'staged': 0, 'failed': 0}
+        
+        if units:
+            started = time.time()
+            executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                           initargs=(self.provider_config,))
+            try:
+                futures = [executor.submit(_run_unit, unit, self.staging_dir) for unit in units]
+                for done, future in enumerate(as_completed(futures), 1):
+                    unit, rows, path, error = future.result()
+                    if error is None:
+                        self.checkpoint.mark(unit, 'staged', rows, path)
+                        counts['staged'] += 1
+                    else:
+                        self.checkpoint.mark(unit, 'failed', error=error)
+                        counts['failed'] += 1
+                        self.logger.warning(f"回填{unit[0]} {unit[3]} {unit[1]}~{unit[2]}失败: {error}")
+                    if done % PROGRESS_EVERY == 0 or done == len(units):
+                        elapsed = time.time() - started
+                        remaining = elapsed / done * (len(units) - done)
+                        self.logger.info(f"回填进度 {done}/{len(units)}，失败{counts['failed']}个，"
+                                         f"已用{elapsed:.0f}秒，预计还需{remaining:.0f}秒")
+            except KeyboardInterrupt:
+                self.logger.warning("回填已中断，已完成的任务保留在断点中，重新运行时从断点继续")
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+            executor.shutdown()
+        
+        for dataset in datasets:
+            self.merge(dataset)
+        return counts
+    
+    def merge(self, dataset):
+        """把数据集已暂存的任务按交易日合并写入历史数据存储，返回写入的交易日数
+        
+        同一交易日已有的数据保留，只补充其中没有的行业、股票或ETF；合并可重复执行，中途失败时下次重新合并。
+        暂存文件丢失或无法读取的任务标记为失败，下次运行时重新获取，不会当作已合并。
+        """
+        staged = self.checkpoint.staged(dataset)
+        if not staged:
+            return 0
+        frames, loaded, missing = [], [], []
+        for day, symbol, path in staged:
+            try:
+                frames.append(pd.read_parquet(path))
+                loaded.append((day, symbol, path))
+            except Exception as e:
+                missing.append((day, symbol))
+                self.logger.warning(f"读取{dataset} {symbol} {day}的暂存文件{path}失败，下次运行时重新获取: {e}")
+        if missing:
+            self.checkpoint.mark_failed(dataset, missing, "暂存文件丢失或无法读取")
+        if not loaded:
+            return 0
+        data = pd.concat(frames, ignore_index=True)
+        key = BACKFILL_DATASETS[dataset][1]
+        existing_dates = set(self.history.list_dates(dataset))
+        
+        written = 0
+        for day, part in (data.groupby(data['date'].dt.date) if len(data) else []):
+            part = part.drop(columns='date')
+            if day in existing_dates:
+                existing = self.history.read(dataset, start=day, end=day).drop(columns='date')
+                part = pd.concat([existing, part], ignore_index=True)
+            part = part.drop_duplicates(subset=[key], keep='first')
+            if self.history.append(dataset, part, day, replace=True):
+                written += 1
+        
+        self.checkpoint.mark_merged(dataset, [(day, symbol) for day, symbol, _ in loaded])
+        for _, _, path in loaded:
+            if os.path.exists(path):
+                os.remove(path)
+        self.logger.info(f"{dataset}: 已合并{len(loaded)}个任务，写入{written}个交易日"
+                         + (f"，{len(missing)}个任务的暂存文件丢失，下次运行时重新获取" if missing else ""))
+        return written
+
+def session_range(days, end=None):
+    """返回截至end（默认为上一个交易日）的最近days个A股交易日的起止日期"""
+    calendar = get_calendar('CN')
+    end = end or calendar.previous_session(date.today(), inclusive=False)
+    sessions = calendar.sessions_between(end - timedelta(days=days * 2 + 14), end)[-days:]
+    return sessions[0], end
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+    from data_provider import add_provider_arguments, provider_config
+    
+    parser = argparse.ArgumentParser(description='历史数据回填工具')
+    parser.add_argument('--datasets', nargs='+', choices=list(BACKFILL_DATASETS), default=list(BACKFILL_DATASETS),
+                        help='要回填的数据集（默认全部）')
+    parser.add_argument('--days', type=int, default=250, help='回填最近的交易日数（默认250）')
+    parser.add_argument('--start', default=None, help='起始日期 YYYY-MM-DD，指定时忽略--days')
+    parser.add_argument('--end', default=None, help='结束日期 YYYY-MM-DD，默认为上一个交易日')
+    parser.add_argument('--symbols', nargs='+', default=None, help='只回填指定的股票代码（仅对daily_bars有效）')
+    parser.add_argument('--workers', type=int, default=4, help='工作进程数（默认4），请求速率另受upstream_guard限流')
+    parser.add_argument('--history', default='./history', help='历史数据存储目录')
+    parser.add_argument('--industry-index', default='./cache/industry_index.npz',
+                        help='个股行业映射的索引文件，从中读取需要回填的行业（默认./cache/industry_index.npz）')
+    parser.add_argument('--restart', action='store_true', help='清除断点记录，重新回填')
+    parser.add_argument('--status', action='store_true', help='查看断点记录中各数据集的任务状态后退出')
+    add_provider_arguments(parser)
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    backfiller = Backfiller(args.history, args.workers, provider_config(args), args.industry_index)
+    if args.status:
+        summary = backfiller.checkpoint.summary()
+        if not summary:
+            print("还没有回填记录")
+        for dataset, counts in sorted(summary.items()):
+            print(f"{dataset}: " + "，".join(f"{status} {count}" for status, count in sorted(counts.items())))
+        sys.exit(0)
+    
+    end = datetime.strptime(args.end, '%Y-%m-%d').date() if args.end else None
+    if args.start:
+        start = datetime.strptime(args.start, '%Y-%m-%d').date()
+        end = end or get_calendar('CN').previous_session(date.today(), inclusive=False)
+    else:
+        start, end = session_range(args.days, end)
+    if args.restart:
+        backfiller.checkpoint.reset(args.datasets)
+    
+    print(f"回填 {', '.join(args.datasets)}: {start} ~ {end}")
+    counts = backfiller.run(args.datasets, start, end, {'daily_bars': args.symbols} if args.symbols else None)
+    print(f"完成: 成功{counts['staged']}个任务，失败{counts['failed']}个（失败的任务在下次运行时重试）")
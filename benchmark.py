@@ -0,0 +1,311 @@
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import logging
+import tempfile
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# 基准结果文件和默认的回归阈值
+DEFAULT_BASELINE = "./benchmark_baseline.json"
+DEFAULT_THRESHOLD = 0.25
+
+# 耗时增加不足该值（毫秒）时视为测量噪声，不判定为回归
+MIN_REGRESSION_MS = 5.0
+
+# 个股5日资金流向排行的列（与akshare_data_structure.txt中记录的5240x15数据一致）
+FUND_FLOW_5D_COLUMNS = [
+    '序号', '代码', '名称', '最新价', '5日涨跌幅',
+    '5日主力净流入-净额', '5日主力净流入-净占比', '5日超大单净流入-净额', '5日超大单净流入-净占比',
+    '5日大单净流入-净额', '5日大单净流入-净占比', '5日中单净流入-净额', '5日中单净流入-净占比',
+    '5日小单净流入-净额', '5日小单净流入-净占比',
+]
+
+def _stock_codes(n):
+    """生成沪深两市交替的股票代码"""
+    return [f"sh{600000 + i:06d}" if i % 2 else f"sz{i:06d}" for i in range(n)]
+
+def make_fund_flow_5d(rows=5240, seed=0):
+    """生成与个股5日资金流向排行形状一致的数据（5240x15）"""
+    rng = np.random.default_rng(seed)
+    data = {
+        '序号': np.arange(1, rows + 1),
+        '代码': [code[2:] for code in _stock_codes(rows)],
+        '名称': [f"股票{i}" for i in range(rows)],
+        '最新价': rng.uniform(2, 300, rows).round(2),
+        '5日涨跌幅': rng.normal(0, 6, rows).round(2),
+    }
+    for column in FUND_FLOW_5D_COLUMNS[5:]:
+        if column.endswith('净额'):
+            data[column] = rng.normal(0, 3e8, rows).round()
+        else:
+            data[column] = rng.normal(0, 3, rows).round(2)
+    return pd.DataFrame(data, columns=FUND_FLOW_5D_COLUMNS)
+
+def make_spot_snapshot(rows=5000, seed=0, scale=None):
+    """生成与stock_zh_a_spot形状一致的全市场行情快照
+    
+    Args:
+        scale (ndarray): 各股票的成交量水平，用于生成同一批股票的多日快照
+    """
+    rng = np.random.default_rng(seed)
+    scale = np.exp(rng.normal(16, 1, rows)) if scale is None else scale
+    price = rng.uniform(2, 100, rows).round(2)
+    pct = rng.normal(0, 2, rows).round(3)
+    volume = (scale * rng.lognormal(0, 0.3, rows)).round()
+    prev_close = (price / (1 + pct / 100)).round(2)
+    return pd.DataFrame({
+        '代码': _stock_codes(rows),
+        '名称': [f"股票{i}" for i in range(rows)],
+        '最新价': price,
+        '涨跌额': (price - prev_close).round(2),
+        '涨跌幅': pct,
+        '买入': price,
+        '卖出': price,
+        '昨收': prev_close,
+        '今开': prev_close,
+        '最高': price,
+        '最低': price,
+        '成交量': volume,
+        '成交额': (volume * price).round(),
+        '时间戳': '15:00:00',
+    })
+
+def make_spot_history(days=20, rows=5000, seed=0):
+    """生成同一批股票连续多个交易日的全市场快照，用于初始化成交量基线"""
+    rng = np.random.default_rng(seed)
+    scale = np.exp(rng.normal(16, 1, rows))
+    dates = pd.bdate_range(end='2025-09-12', periods=days)
+    frames = [make_spot_snapshot(rows, seed + i + 1, scale).assign(date=date) for i, date in enumerate(dates)]
+    return pd.concat(frames, ignore_index=True), scale
+
+def make_industry_index(codes, state_file, industries=90):
+    """生成把股票平均分配到各行业的个股行业映射，不访问网络"""
+    from industry_index import IndustryIndex
+    names = [f"行业{i}" for i in range(industries)]
+    boards = pd.DataFrame({'code': [f"881{i:03d}" for i in range(industries)], 'name': names})
+    
+    def fetch(func_name, symbol=None):
+        if symbol is None:
+            return boards
+        return pd.DataFrame({'代码': list(codes[names.index(symbol)::industries])})
+    
+    index = IndustryIndex(state_file)
+    index.refresh(fetch, workers=1)
+    return index
+
+def make_us_sectors(rows=11, seed=0):
+    """生成与stock_us_dji_spot形状一致的美股行业数据"""
+    rng = np.random.default_rng(seed)
+    price = rng.uniform(100, 900, rows).round(2)
+    pct = rng.normal(0, 1.5, rows).round(2)
+    return pd.DataFrame({
+        '名称': [f"行业指数{i}" for i in range(rows)],
+        '最新价': price,
+        '涨跌额': (price * pct / 100).round(2),
+        '涨跌幅': pct,
+    })
+
+def load_fixtures(output_dir="./output", seed=0):
+    """加载基准测试数据：output目录下最近的行业资金流向CSV，以及按生产数据形状生成的合成数据"""
+    csv_files = sorted(glob.glob(os.path.join(output_dir, "industry_money_flow_*.csv")))
+    if csv_files:
+        industry_flow = pd.read_csv(csv_files[-1], encoding='utf-8-sig')
+    else:
+        # 没有历史CSV时生成90个行业的数据
+        rng = np.random.default_rng(seed)
+        inflow = rng.uniform(10, 900, 90).round(2)
+        outflow = (inflow - rng.normal(0, 10, 90)).round(2)
+        industry_flow = pd.DataFrame({
+            '行业': [f"行业{i}" for i in range(90)],
+            '行业-涨跌幅': rng.normal(0, 2, 90).round(2),
+            '流入资金': inflow,
+            '流出资金': outflow,
+            '净额': (inflow - outflow).round(2),
+        })
+    
+    history, scale = make_spot_history(seed=seed)
+    # 当日快照在基线水平上放大部分股票的成交量，使异常检测有结果
+    spot = make_spot_snapshot(seed=seed + 100, scale=scale)
+    burst = np.random.default_rng(seed).choice(len(spot), 50, replace=False)
+    spot.loc[burst, '成交量'] *= 6
+    spot['成交额'] = (spot['成交量'] * spot['最新价']).round()
+    
+    return {
+        'industry_flow': industry_flow,
+        'fund_flow_5d': make_fund_flow_5d(seed=seed),
+        'spot': spot,
+        'spot_history': history,
+        'us_sectors': make_us_sectors(seed=seed),
+    }
+
+def measure(func, repeat=5, warmup=1):
+    """测量函数的中位耗时（毫秒）和峰值内存（MB）
+    
+    计时和内存统计分开进行，tracemalloc的开销不计入耗时。
+    """
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start_time) * 1000)
+    
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'ms': float(np.median(timings)), 'min_ms': float(min(timings)), 'peak_mb': peak / 1024 / 1024}
+
+def build_stages(analyzer, fixtures, work_dir):
+    """返回(阶段名, 无参函数)列表，每个函数对固定数据执行一次被测代码"""
+    from screener import Screener
+    from volume_anomaly import VolumeAnomalyEngine
+    from chart_renderer import ChartRenderer
+    from stock_flow import aggregate_by_industry
+    from schema import conform
+    
+    engine = VolumeAnomalyEngine(os.path.join(work_dir, "volume_baseline.npz"))
+    engine.bootstrap(fixtures['spot_history'])
+    # 分析代码拿到的行情快照已经过统一字段和紧凑类型的转换
+    spot = conform(fixtures['spot'], 'a_spot')
+    abnormal = engine.detect(spot)
+    # 个股5日资金流向按行业汇总，与_aggregate_stock_flow拿到的数据一样先经过统一字段的转换
+    stock_flow = conform(fixtures['fund_flow_5d'], 'stock_flow')
+    index = make_industry_index(stock_flow['代码'].astype(str).unique(), os.path.join(work_dir, "industry_index.npz"))
+    us_sectors = fixtures['us_sectors']
+    current_date = datetime.now().strftime('%Y%m%d')
+    renderer = ChartRenderer(os.path.join(work_dir, "output"), index_file=os.path.join(work_dir, "charts.json"))
+    
+    def render(kind, data):
+        # 强制渲染，不因内容哈希相同而跳过
+        return renderer.submit(kind, data, f"{kind}.png", current_date, force=True).result()
+    
+    return [
+        ('schema.industry_flow', lambda: conform(fixtures['industry_flow'], 'industry_flow')),
+        ('schema.a_spot', lambda: conform(fixtures['spot'], 'a_spot')),
+        ('schema.stock_flow_5d', lambda: conform(fixtures['fund_flow_5d'], 'stock_flow')),
+        ('industry_flow.process', lambda: analyzer._process_industry_flow_data(fixtures['industry_flow'].copy())),
+        ('industry_flow.aggregate_5d', lambda: aggregate_by_industry(stock_flow, index)),
+        ('industry_flow.message', lambda: analyzer._generate_industry_flow_message(
+            analyzer._normalize_industry_flow_columns(fixtures['industry_flow'].copy()))),
+        ('abnormal_volume.bootstrap', lambda: engine.bootstrap(fixtures['spot_history'])),
+        ('abnormal_volume.detect', lambda: engine.detect(spot)),
+        ('abnormal_volume.top_k', lambda: Screener(spot).top_k('成交量', 20)),
+        ('abnormal_volume.message', lambda: analyzer._generate_abnormal_volume_message(abnormal)),
+        ('us_stock.message', lambda: analyzer._generate_us_stock_message(us_sectors)),
+        ('chart.abnormal_volume', lambda: render('abnormal_volume', abnormal)),
+        ('chart.us_sectors', lambda: render('us_sectors', us_sectors)),
+    ]
+
+def run_benchmarks(stages=None, repeat=5, output_dir=None):
+    """在临时目录中离线运行基准测试，不访问网络，也不写入项目的output、history和cache目录
+    
+    计时期间不写入指标文件、历史数据存储和CSV，各阶段的耗时和峰值内存只反映计算本身。
+    
+    Args:
+        stages (list): 只运行名称以其中任一项开头的阶段，为None时运行全部
+        repeat (int): 每个阶段的计时次数
+        output_dir (str): 行业资金流向CSV所在目录，默认为项目的output目录
+    
+    Returns:
+        dict: 阶段名 -> {'ms', 'min_ms', 'peak_mb'}
+    """
+    output_dir = output_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), "output")
+    fixtures = load_fixtures(os.path.abspath(output_dir))
+    work_dir = tempfile.mkdtemp(prefix="stock_benchmark_")
+    cwd = os.getcwd()
+    logger = logging.getLogger("stock_analyzer")
+    level = logger.level
+    import metrics
+    metrics_enabled = metrics.recorder.enabled
+    try:
+        # StockAnalyzer使用相对路径的output、logs、cache和history目录
+        os.chdir(work_dir)
+        from stock_analysis import StockAnalyzer
+        analyzer = StockAnalyzer()
+        logger.setLevel(logging.WARNING)
+        metrics.recorder.configure(enabled=False)
+        analyzer._save_dataset = lambda *args, **kwargs: []
+        
+        results = {}
+        for name, func in build_stages(analyzer, fixtures, work_dir):
+            if stages and not any(name.startswith(prefix) for prefix in stages):
+                continue
+            results[name] = measure(func, repeat=repeat)
+        return results
+    finally:
+        metrics.recorder.configure(enabled=metrics_enabled)
+        logger.setLevel(level)
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """与基准结果比较，返回耗时增加超过阈值的阶段列表[(阶段名, 当前ms, 基准ms)]"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result['ms'] > base['ms'] * (1 + threshold) and result['ms'] - base['ms'] >= MIN_REGRESSION_MS:
+            regressions.append((name, result['ms'], base['ms']))
+    return regressions
+
+def print_report(results, baseline=None):
+    """打印各阶段的耗时和峰值内存，有基准结果时显示变化比例"""
+    print(f"{'阶段':<28}{'中位耗时(ms)':>14}{'最短(ms)':>12}{'峰值内存(MB)':>14}{'基准(ms)':>12}{'变化':>10}")
+    for name, result in results.items():
+        base = (baseline or {}).get(name)
+        if base:
+            change = f"{(result['ms'] / base['ms'] - 1) * 100:+.1f}%" if base['ms'] else "-"
+            base_ms = f"{base['ms']:.2f}"
+        else:
+            change, base_ms = "-", "-"
+        print(f"{name:<28}{result['ms']:>14.2f}{result['min_ms']:>12.2f}{result['peak_mb']:>14.2f}{base_ms:>12}{change:>10}")
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='分析热点路径的离线基准测试')
+    parser.add_argument('--stage', action='append', help='只运行指定前缀的阶段，可重复，如 --stage chart')
+    parser.add_argument('--repeat', type=int, default=5, help='每个阶段的计时次数')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='基准结果文件')
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果保存为基准')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='耗时增加超过该比例时判定为回归')
+    args = parser.parse_args()
+    
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    
+    results = run_benchmarks(args.stage, args.repeat)
+    print_report(results, baseline)
+    
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'created': datetime.now().isoformat(timespec='seconds'), 'results': results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"\n已保存基准结果: {args.baseline}")
+        return 0
+    
+    if baseline:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n以下阶段耗时比基准增加超过{args.threshold * 100:.0f}%:")
+            for name, current_ms, base_ms in regressions:
+                print(f"  {name}: {base_ms:.2f}ms -> {current_ms:.2f}ms")
+            return 1
+        print(f"\n所有阶段均未超过基准的{args.threshold * 100:.0f}%")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+import os
+import json
+import hashlib
+import logging
+import warnings
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+
+import numpy as np
+import pandas as pd
+import metrics
+
+# 项目自带的中文字体
+BUNDLED_FONT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "util", "SourceHanSansSC-Bold.otf")
+
+# 未找到自带字体时使用的本机中文字体候选
+CHINESE_FONTS = ["SimHei", "WenQuanYi Micro Hei", "Heiti TC", "Source Han Sans SC"]
+
+# 图表尺寸和分辨率的限制，避免异常数据或标签把画布撑到无法渲染
+DEFAULT_FIGSIZE = (12, 8)
+MIN_FIGSIZE = (4, 3)
+MAX_FIGSIZE = (20, 16)
+DEFAULT_DPI = 150
+MAX_DPI = 200
+MAX_BARS = 30
+
+# 绘图代码变更时修改版本号，使已有图片的内容哈希失效
+RENDERER_VERSION = 1
+
+def _clamp(value, low, high):
+    return min(max(value, low), high)
+
+def _finite_values(df, column):
+    """返回列的浮点数组，无法转换或非有限的值置为0，避免坐标轴范围被撑大"""
+    values = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=float)
+    return np.where(np.isfinite(values), values, 0.0)
+
+def _label_column(df, candidates):
+    """返回第一个存在的名称列，都不存在时返回None"""
+    for column in candidates:
+        if column in df.columns:
+            return column
+    return None
+
+def draw_abnormal_volume(fig, font, data, current_date):
+    """绘制个股异常成交量排名的水平条形图"""
+    top_stocks = data.head(15)
+    # 有历史基线时展示量比，否则展示成交量
+    if '量比' in top_stocks.columns:
+        values = _finite_values(top_stocks, '量比')
+        title, xlabel = '个股量比排名', '量比（倍）'
+    else:
+        values = _finite_values(top_stocks, '成交量') / 1000000
+        title, xlabel = '个股成交量排名', '成交量（万手）'
+    
+    ax = fig.add_subplot()
+    bars = ax.barh(top_stocks['名称'].astype(str).to_numpy(), values)
+    for bar in bars:
+        width = bar.get_width()
+        ax.text(width, bar.get_y() + bar.get_height() / 2, f' {width:,.2f}',
+                ha='left', va='center', fontsize=10, fontproperties=font, clip_on=True)
+    # 留出数值标签的空间
+    if len(values):
+        ax.set_xlim(0, max(values.max(), 0) * 1.15 or 1)
+    
+    ax.set_title(f'{current_date} {title}（前15名）', fontsize=14, fontproperties=font)
+    ax.set_xlabel(xlabel, fontsize=12, fontproperties=font)
+    ax.set_ylabel('股票名称', fontsize=12, fontproperties=font)
+    for label in ax.get_yticklabels():
+        label.set_fontproperties(font)
+    ax.grid(axis='x', linestyle='--', alpha=0.7)
+
+def draw_us_sectors(fig, font, data, current_date):
+    """绘制美股行业涨跌幅条形图"""
+    sorted_sectors = data.sort_values(by='涨跌幅', ascending=False).head(MAX_BARS)
+    name_column = _label_column(sorted_sectors, ['名称', '指数名称'])
+    if name_column:
+        names = sorted_sectors[name_column].astype(str).to_numpy()
+    else:
+        names = [f"行业{i}" for i in range(len(sorted_sectors))]
+    values = _finite_values(sorted_sectors, '涨跌幅')
+    
+    ax = fig.add_subplot()
+    colors = ['green' if x > 0 else 'red' for x in values]
+    bars = ax.bar(names, values, color=colors)
+    for bar in bars:
+        height = bar.get_height()
+        ax.text(bar.get_x() + bar.get_width() / 2., height, f'{height:.2f}%',
+                ha='center', va='bottom' if height > 0 else 'top', fontsize=9, fontproperties=font, clip_on=True)
+    # 上下各留出数值标签的空间
+    if len(values):
+        span = max(np.abs(values).max(), 0.1)
+        ax.set_ylim(min(values.min(), 0) - span * 0.15, max(values.max(), 0) + span * 0.15)
+    
+    ax.set_title(f'{current_date} 美股行业涨跌幅表现', fontsize=14, fontproperties=font)
+    ax.set_xlabel('行业', fontsize=12, fontproperties=font)
+    ax.set_ylabel('涨跌幅 (%)', fontsize=12, fontproperties=font)
+    # 旋转x轴标签以避免重叠
+    for label in ax.get_xticklabels():
+        label.set_fontproperties(font)
+        label.set_rotation(45)
+        label.set_horizontalalignment('right')
+    ax.axhline(y=0, color='black', linestyle='-', alpha=0.3)
+    ax.grid(axis='y', linestyle='--', alpha=0.7)
+
+# 图表类型 -> (绘图函数, 必需的列)
+CHART_TYPES = {
+    'abnormal_volume': (draw_abnormal_volume, ['名称', '成交量']),
+    'us_sectors': (draw_us_sectors, ['涨跌幅']),
+}
+
+class ChartRenderer:
+    """后台图表渲染器
+    
+    在专用线程中使用Agg后端和Figure API绘图，不依赖pyplot的全局状态，分析线程提交后立即返回。
+    字体只加载一次；图表尺寸和分辨率有上限，保存时不使用bbox_inches='tight'，画布大小固定。
+    输入数据的内容哈希与已有图片一致时跳过重新渲染。
+    """
+    
+    def __init__(self, output_dir="./output", index_file="./cache/charts.json", dpi=DEFAULT_DPI):
+        """初始化图表渲染器
+        
+        Args:
+            output_dir (str): 图片输出目录
+            index_file (str): 记录各图片对应输入数据哈希的索引文件
+            dpi (int): 图片分辨率，不超过MAX_DPI
+        """
+        self.output_dir = output_dir
+        self.index_file = index_file
+        self.dpi = _clamp(dpi, 50, MAX_DPI)
+        self.logger = logging.getLogger("stock_analyzer")
+        self._executor = None
+        self._lock = threading.Lock()
+        self._font = None
+        self._index = self._load_index()
+    
+    def _load_index(self):
+        """加载图片内容哈希索引"""
+        if os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                self.logger.warning(f"加载图表索引失败，将重新渲染: {e}")
+        return {}
+    
+    def _save_index(self):
+        """保存图片内容哈希索引"""
+        index_dir = os.path.dirname(self.index_file)
+        if index_dir and not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.index_file)
+    
+    def _load_font(self):
+        """加载中文字体（只在渲染线程中首次绘图时执行一次）"""
+        if self._font is None:
+            from matplotlib import font_manager
+            if os.path.exists(BUNDLED_FONT):
+                self._font = font_manager.FontProperties(fname=BUNDLED_FONT)
+            else:
+                installed = {font.name for font in font_manager.fontManager.ttflist}
+                fonts = [name for name in CHINESE_FONTS if name in installed]
+                if not fonts:
+                    self.logger.warning(f"未找到自带字体{BUNDLED_FONT}或本机中文字体，图表中文可能无法显示")
+                self._font = font_manager.FontProperties(family=fonts or None)
+        return self._font
+    
+    @staticmethod
+    def content_hash(kind, data, current_date, figsize, dpi):
+        """计算图表输入数据和绘图参数的内容哈希"""
+        digest = hashlib.sha1(f"{RENDERER_VERSION}|{kind}|{current_date}|{figsize}|{dpi}".encode('utf-8'))
+        digest.update(",".join(map(str, data.columns)).encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(data.astype(str), index=False).to_numpy().tobytes())
+        return digest.hexdigest()
+    
+    def submit(self, kind, data, img_file, current_date, figsize=DEFAULT_FIGSIZE, force=False):
+        """提交渲染任务并立即返回
+        
+        Args:
+            kind (str): 图表类型，见CHART_TYPES
+            data (DataFrame): 绘图数据
+            img_file (str): 图片文件名（相对于输出目录）
+            current_date (str): 图表标题中的日期
+            figsize (tuple): 图表尺寸（英寸），会被限制在MIN_FIGSIZE与MAX_FIGSIZE之间
+            force (bool): 为True时即使内容哈希与已有图片一致也重新渲染
+        
+        Returns:
+            Future: 结果为图片路径，失败时为None
+        """
+        draw, required = CHART_TYPES[kind]
+        missing = [column for column in required if column not in data.columns]
+        if missing:
+            self.logger.error(f"数据缺少{missing}列，无法生成{kind}可视化图表")
+            return self._done(None)
+        
+        figsize = (_clamp(figsize[0], MIN_FIGSIZE[0], MAX_FIGSIZE[0]),
+                   _clamp(figsize[1], MIN_FIGSIZE[1], MAX_FIGSIZE[1]))
+        img_path = os.path.join(self.output_dir, img_file)
+        # 复制一份数据，分析线程之后修改DataFrame不影响渲染
+        data = data.copy()
+        digest = self.content_hash(kind, data, current_date, figsize, self.dpi)
+        with self._lock:
+            if not force and self._index.get(img_path) == digest and os.path.exists(img_path):
+                self.logger.info(f"图表数据未变化，跳过渲染: {img_path}")
+                return self._done(img_path)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chart")
+        return self._executor.submit(self._render, kind, draw, data, img_path, current_date, figsize, digest)
+    
+    @staticmethod
+    def _done(result):
+        """返回已完成的Future"""
+        future = Future()
+        future.set_result(result)
+        return future
+    
+    def _render(self, kind, draw, data, img_path, current_date, figsize, digest):
+        """在渲染线程中绘制并保存图表"""
+        try:
+            with metrics.span('chart', kind) as span:
+                from matplotlib.figure import Figure
+                from matplotlib.backends.backend_agg import FigureCanvasAgg
+                
+                span.rows = len(data)
+                font = self._load_font()
+                fig = Figure(figsize=figsize, dpi=self.dpi)
+                FigureCanvasAgg(fig)
+                # 缺少中文字体时已在加载字体时提示过，不再逐个字符输出缺字警告
+                with warnings.catch_warnings():
+                    warnings.filterwarnings('ignore', message='Glyph .* missing')
+                    draw(fig, font, data, current_date)
+                    fig.tight_layout()
+                    
+                    # 先写临时文件再替换，渲染失败时不会留下残缺的图片
+                    tmp_path = img_path + ".tmp.png"
+                    fig.savefig(tmp_path, dpi=self.dpi)
+                os.replace(tmp_path, img_path)
+            with self._lock:
+                self._index[img_path] = digest
+                self._save_index()
+            self.logger.info(f"已保存{kind}可视化图表: {img_path}")
+            return img_path
+        except Exception as e:
+            self.logger.error(f"生成{kind}可视化图表失败: {e}")
+            return None
+    
+    def wait(self):
+        """等待已提交的渲染任务全部完成"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -0,0 +1,361 @@
+import os
+import json
+import importlib.util
+import time
+import pickle
+import hashlib
+import logging
+import threading
+import contextlib
+from datetime import datetime
+
+import pandas as pd
+from trading_calendar import get_calendar
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python 3.8及以下
+    ZoneInfo = None
+
+try:
+    import fcntl
+except ImportError:
+    # Windows没有fcntl，索引只在进程内加锁
+    fcntl = None
+
+# 是否可以使用Parquet格式，只检查是否安装而不导入pyarrow
+PARQUET_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+# 各类数据的默认缓存有效期（秒）
+DEFAULT_TTLS = {
+    'intraday': 5 * 60,         # 盘中实时数据，开盘期间很快过期
+    'post_close': 24 * 3600,    # 收盘后的数据，直到下一个交易时段都不会变化
+    'static': 7 * 24 * 3600,    # 行业列表等静态数据
+}
+
+# 各市场的时区和交易时间（当地时间）
+MARKET_HOURS = {
+    'CN': {'timezone': 'Asia/Shanghai', 'open': '09:15', 'close': '15:00'},
+    'US': {'timezone': 'America/New_York', 'open': '09:30', 'close': '16:00'},
+}
+
+def market_now(market='CN'):
+    """返回指定市场当地时区的当前时间"""
+    tz_name = MARKET_HOURS[market]['timezone']
+    if ZoneInfo is None:
+        return datetime.now()
+    return datetime.now(ZoneInfo(tz_name)).replace(tzinfo=None)
+
+def current_session(market='CN', now=None):
+    """返回当前所属的交易时段
+    
+    Args:
+        market (str): 市场代码，'CN'或'US'
+        now (datetime): 市场当地时间，为None时取当前时间
+    
+    Returns:
+        tuple: (交易日 'YYYYMMDD', 是否处于交易时间内)。开盘前和非交易日归属于上一个交易日。
+    """
+    now = now or market_now(market)
+    hours = MARKET_HOURS[market]
+    open_time = datetime.strptime(hours['open'], '%H:%M').time()
+    close_time = datetime.strptime(hours['close'], '%H:%M').time()
+    
+    calendar = get_calendar(market)
+    session_day = now.date()
+    if not calendar.is_session(session_day) or now.time() < open_time:
+        # 休市日或开盘前，回退到上一个交易日
+        session_day = calendar.previous_session(session_day, inclusive=False)
+        is_open = False
+    else:
+        is_open = now.time() < close_time
+    
+    return session_day.strftime('%Y%m%d'), is_open
+
+def seconds_until_open(market='CN', now=None):
+    """返回距离下一个交易日开盘的秒数，处于交易时间内时返回0"""
+    now = now or market_now(market)
+    hours = MARKET_HOURS[market]
+    open_time = datetime.strptime(hours['open'], '%H:%M').time()
+    close_time = datetime.strptime(hours['close'], '%H:%M').time()
+    
+    calendar = get_calendar(market)
+    next_day = now.date()
+    if calendar.is_session(next_day) and open_time <= now.time() < close_time:
+        return 0
+    if not calendar.is_session(next_day) or now.time() >= close_time:
+        next_day = calendar.next_session(next_day)
+    return max(0.0, (datetime.combine(next_day, open_time) - now).total_seconds())
+
+class DataCache:
+    """akshare数据的本地磁盘缓存，按接口、参数和交易时段区分缓存项
+    
+    缓存项以Parquet格式（未安装pyarrow时使用pickle）保存在cache_dir下，
+    索引文件记录每项的过期时间、大小和最近访问时间，超过容量时按LRU淘汰。
+    命中时只在内存中更新最近访问时间，写入和淘汰时才写回索引；写回前在跨进程的文件锁内合并磁盘上的索引，
+    多个进程共用缓存目录时不会互相覆盖对方写入的缓存项，也不会漏掉需要淘汰的文件。
+    """
+    
+    def __init__(self, cache_dir="./cache", max_bytes=512 * 1024 * 1024, max_entries=256, ttls=None, enabled=True):
+        """初始化缓存
+        
+        Args:
+            cache_dir (str): 缓存目录
+            max_bytes (int): 缓存文件总大小上限（字节）
+            max_entries (int): 缓存项数量上限
+            ttls (dict): 覆盖DEFAULT_TTLS中的有效期设置
+            enabled (bool): 为False时跳过缓存，每次都直接获取数据
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.enabled = enabled
+        self.logger = logging.getLogger("stock_analyzer")
+        
+        self.index_file = os.path.join(cache_dir, "index.json")
+        self.lock_file = os.path.join(cache_dir, "index.lock")
+        self._lock = threading.RLock()
+        self._key_locks = {}
+        
+        # 命中统计
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        if self.enabled and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self._index = self._load_index() if self.enabled else {}
+    
+    def _load_index(self):
+        """加载缓存索引，丢弃文件已不存在的缓存项"""
+        if not os.path.exists(self.index_file):
+            return {}
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except Exception as e:
+            self.logger.warning(f"加载缓存索引失败，将重建缓存: {e}")
+            return {}
+        return {key: entry for key, entry in index.items()
+                if os.path.exists(os.path.join(self.cache_dir, entry['file']))}
+    
+    def _save_index(self):
+        """原子地写入缓存索引"""
+        tmp_file = self.index_file + f".tmp-{os.getpid()}"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f, ensure_ascii=False)
+        os.replace(tmp_file, self.index_file)
+    
+    @contextlib.contextmanager
+    def _file_lock(self):
+        """跨进程的索引锁，读取、合并和写回索引期间其他进程等待"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_file, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    
+    def _commit(self, entries=None, removed=()):
+        """合并磁盘上的索引，加入新写入的缓存项、删除指定的缓存项并按容量淘汰后写回（调用方需持有锁）
+        
+        其他进程写入的缓存项会合并进来，已被其他进程淘汰（文件已删除）的缓存项不会再写回；
+        同一缓存项的最近访问时间取各进程记录的最大值。
+        """
+        with self._file_lock():
+            merged = self._load_index()
+            for key, entry in merged.items():
+                local = self._index.get(key)
+                if local is not None and local['file'] == entry['file']:
+                    entry['last_access'] = max(entry['last_access'], local['last_access'])
+            for key, entry in (entries or {}).items():
+                # 格式变化时删除旧格式的文件
+                old = merged.get(key)
+                if old is not None and old['file'] != entry['file']:
+                    self._delete_file(old['file'])
+                merged[key] = entry
+            self._index = merged
+            for key in removed:
+                self._remove(key)
+            self._evict()
+            self._save_index()
+    
+    def make_key(self, func_name, args=(), kwargs=None, session=None):
+        """根据接口名、参数和交易时段生成缓存键"""
+        raw = json.dumps({
+            'func': func_name,
+            'args': list(args),
+            'kwargs': kwargs or {},
+            'session': session,
+        }, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20]
+    
+    def get(self, key):
+        """读取未过期的缓存数据，不存在或已过期时返回None"""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            if entry['expires_at'] < time.time():
+                # 淘汰过期项（包括这一项）
+                self._commit()
+                return None
+            path = os.path.join(self.cache_dir, entry['file'])
+        
+        if not os.path.exists(path):
+            # 已被其他进程淘汰
+            with self._lock:
+                self._index.pop(key, None)
+            return None
+        try:
+            if entry['file'].endswith('.parquet'):
+                data = pd.read_parquet(path)
+            else:
+                with open(path, 'rb') as f:
+                    data = pickle.load(f)
+        except Exception as e:
+            self.logger.warning(f"读取缓存文件{path}失败: {e}")
+            with self._lock:
+                self._commit(removed=[key])
+            return None
+        
+        with self._lock:
+            # 最近访问时间只记在内存中，下次写回索引时合并
+            if key in self._index:
+                self._index[key]['last_access'] = time.time()
+        return data
+    
+    def put(self, key, data, ttl, func_name=None):
+        """写入缓存数据并按容量淘汰最久未使用的缓存项"""
+        path = os.path.join(self.cache_dir, key)
+        # 先写临时文件再替换，其他进程不会读到写了一半的缓存文件
+        tmp_path = path + f".tmp-{os.getpid()}-{threading.get_ident()}"
+        file_name = None
+        if PARQUET_AVAILABLE and isinstance(data, pd.DataFrame):
+            try:
+                data.to_parquet(tmp_path, index=False)
+                file_name = key + ".parquet"
+            except Exception as e:
+                # 列类型混杂等情况无法写入Parquet时退回pickle
+                self.logger.debug(f"缓存数据无法保存为Parquet，改用pickle: {e}")
+        if file_name is None:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            file_name = key + ".pkl"
+        os.replace(tmp_path, os.path.join(self.cache_dir, file_name))
+        
+        now = time.time()
+        entry = {
+            'func': func_name,
+            'file': file_name,
+            'size': os.path.getsize(os.path.join(self.cache_dir, file_name)),
+            'created_at': now,
+            'expires_at': now + ttl,
+            'last_access': now,
+        }
+        with self._lock:
+            self._commit({key: entry})
+    
+    def _remove(self, key):
+        """删除缓存项及其文件（调用方需持有锁）"""
+        entry = self._index.pop(key, None)
+        if entry:
+            self._delete_file(entry['file'])
+    
+    def _delete_file(self, file_name):
+        """删除缓存文件，文件已不存在时忽略"""
+        try:
+            os.remove(os.path.join(self.cache_dir, file_name))
+        except OSError:
+            pass
+    
+    def _evict(self):
+        """先清理过期项，再按最近访问时间淘汰直到满足容量限制（调用方需持有锁）"""
+        now = time.time()
+        for key in [k for k, entry in self._index.items() if entry['expires_at'] < now]:
+            self._remove(key)
+            self.evictions += 1
+        
+        total_size = sum(entry['size'] for entry in self._index.values())
+        for key in sorted(self._index, key=lambda k: self._index[k]['last_access']):
+            if total_size <= self.max_bytes and len(self._index) <= self.max_entries:
+                break
+            total_size -= self._index[key]['size']
+            self._remove(key)
+            self.evictions += 1
+    
+    def ttl_for(self, kind, is_open, market='CN'):
+        """根据数据类型和是否处于交易时间确定缓存有效期"""
+        if kind == 'intraday' and not is_open:
+            # 收盘后盘中数据不再变化，按收盘数据缓存
+            kind = 'post_close'
+        if kind == 'post_close':
+            # 周末和节假日期间上一个交易日的数据都不会变化，至少缓存到下一个交易日开盘
+            return max(self.ttls[kind], seconds_until_open(market))
+        return self.ttls[kind]
+    
+    def get_or_fetch(self, func_name, fetch, kind='intraday', market='CN', args=(), kwargs=None):
+        """优先从缓存读取数据，未命中时调用fetch获取并写入缓存
+        
+        Args:
+            func_name (str): 接口名，用于生成缓存键
+            fetch (callable): 无参数的数据获取函数
+            kind (str): 数据类型，决定缓存有效期，可选'intraday'、'post_close'、'static'
+            market (str): 数据所属市场，用于确定交易时段
+            args (tuple): 接口位置参数，用于生成缓存键
+            kwargs (dict): 接口关键字参数，用于生成缓存键
+        """
+        if not self.enabled:
+            return fetch()
+        
+        session, is_open = current_session(market)
+        key = self.make_key(func_name, args, kwargs, session if kind != 'static' else None)
+        
+        # 同一缓存键的并发请求只访问一次网络
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        
+        with key_lock:
+            data = self.get(key)
+            if data is not None:
+                with self._lock:
+                    self.hits += 1
+                self.logger.info(f"缓存命中: {func_name}{kwargs or ''} (交易时段{session})")
+                return data
+            
+            with self._lock:
+                self.misses += 1
+            data = fetch()
+            if data is not None:
+                try:
+                    self.put(key, data, self.ttl_for(kind, is_open, market), func_name)
+                except Exception as e:
+                    self.logger.warning(f"写入缓存失败: {e}")
+            return data
+    
+    def stats(self):
+        """返回缓存命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._index),
+                'size_bytes': sum(entry['size'] for entry in self._index.values()),
+            }
+    
+    def clear(self):
+        """清空全部缓存"""
+        if not self.enabled:
+            return
+        with self._lock, self._file_lock():
+            self._index = self._load_index()
+            for key in list(self._index):
+                self._remove(key)
+            self._save_index()
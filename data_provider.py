@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import pickle
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+from upstream_guard import get_guard
+
+# 数据源模式：live直接调用akshare，record调用akshare并录制每次返回，replay只回放录制的数据
+PROVIDER_MODES = ('live', 'record', 'replay')
+
+class ReplayMissError(LookupError):
+    """回放模式下请求了没有录制过的接口或参数"""
+
+class DataProvider:
+    """akshare数据源，支持直接获取、录制和回放三种模式
+    
+    录制模式把每次调用的返回数据（或异常）连同时间戳和耗时保存到recordings_dir，
+    回放模式按调用顺序返回同一接口和参数的录制结果（超出录制次数后重复最后一次），
+    不需要网络和交易时段即可重现一次完整的分析。
+    """
+    
+    def __init__(self, mode='live', recordings_dir='./recordings', latency=None, guard=None):
+        """初始化数据源
+        
+        Args:
+            mode (str): 'live'、'record'或'replay'
+            recordings_dir (str): 录制数据目录
+            latency: 回放时模拟的网络延迟，None为不等待，'recorded'为按录制时的耗时等待，数值为固定等待秒数
+            guard (UpstreamGuard): 实际访问akshare时的限流和熔断，为None时使用进程共享的upstream_guard.get_guard()
+        """
+        if mode not in PROVIDER_MODES:
+            raise ValueError(f"不支持的数据源模式: {mode}，可选值为{PROVIDER_MODES}")
+        self.mode = mode
+        self.recordings_dir = recordings_dir
+        self.index_file = os.path.join(recordings_dir, "index.jsonl")
+        self.latency = latency
+        self.guard = guard
+        self.logger = logging.getLogger("stock_analyzer")
+        self._lock = threading.Lock()
+        # 录制模式下各请求已录制的次数，回放模式下各请求已回放的次数
+        self._counters = {}
+        self._recordings = {}
+        
+        if mode == 'record':
+            os.makedirs(os.path.join(recordings_dir, "data"), exist_ok=True)
+            self._counters = {key: len(entries) for key, entries in self._load_index().items()}
+        elif mode == 'replay':
+            self._recordings = self._load_index()
+            if not self._recordings:
+                self.logger.warning(f"回放目录{recordings_dir}中没有录制数据")
+    
+    @staticmethod
+    def make_key(func_name, kwargs=None):
+        """根据接口名和参数生成请求键"""
+        raw = json.dumps({'func': func_name, 'kwargs': kwargs or {}}, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+    
+    def _load_index(self):
+        """读取录制索引，返回请求键 -> 按录制顺序排列的记录列表"""
+        recordings = {}
+        if not os.path.exists(self.index_file):
+            return recordings
+        with open(self.index_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    recordings.setdefault(entry['key'], []).append(entry)
+        return recordings
+    
+    def call(self, func_name, **kwargs):
+        """调用akshare接口（或回放录制数据）
+        
+        Args:
+            func_name (str): akshare接口名
+            **kwargs: 传给接口的参数
+        """
+        if self.mode == 'replay':
+            return self._replay(func_name, kwargs)
+        if self.mode == 'record':
+            return self._record(func_name, kwargs)
+        return self._live(func_name, kwargs)
+    
+    def _live(self, func_name, kwargs):
+        """调用akshare接口，经过按站点的限流、熔断和重试"""
+        # 第一次实际获取数据时才导入akshare
+        import akshare as ak
+        fn = getattr(ak, func_name)
+        guard = self.guard
+        if guard is None:
+            try:
+                guard = self.guard = get_guard()
+            except Exception as e:
+                # 状态文件不可用时不限流，不影响获取数据
+                self.logger.warning(f"初始化上游请求限流失败，直接调用接口: {e}")
+                return fn(**kwargs)
+        return guard.call_function(func_name, fn, **kwargs)
+    
+    def _record(self, func_name, kwargs):
+        """调用akshare接口并录制返回数据或异常"""
+        key = self.make_key(func_name, kwargs)
+        start_time = time.time()
+        data, error = None, None
+        try:
+            data = self._live(func_name, kwargs)
+        except Exception as e:
+            error = e
+        elapsed = time.time() - start_time
+        
+        with self._lock:
+            seq = self._counters.get(key, 0)
+            self._counters[key] = seq + 1
+            entry = {
+                'key': key,
+                'seq': seq,
+                'func': func_name,
+                'kwargs': kwargs,
+                'recorded_at': datetime.now().isoformat(timespec='seconds'),
+                'elapsed': round(elapsed, 3),
+                'file': None,
+                'error': None if error is None else f"{type(error).__name__}: {error}",
+            }
+            if error is None:
+                entry['file'] = os.path.join("data", f"{key}-{seq}.pkl")
+                with open(os.path.join(self.recordings_dir, entry['file']), 'wb') as f:
+                    pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            with open(self.index_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+        self.logger.info(f"已录制 {func_name}{kwargs or ''} 第{seq + 1}次调用，耗时{elapsed:.2f}秒")
+        
+        if error is not None:
+            raise error
+        return data
+    
+    def _replay(self, func_name, kwargs):
+        """按调用顺序回放录制数据"""
+        key = self.make_key(func_name, kwargs)
+        entries = self._recordings.get(key)
+        if not entries:
+            raise ReplayMissError(f"回放数据中没有 {func_name}{kwargs or ''} 的录制结果")
+        
+        with self._lock:
+            seq = self._counters.get(key, 0)
+            self._counters[key] = seq + 1
+        entry = entries[min(seq, len(entries) - 1)]
+        
+        if self.latency == 'recorded':
+            time.sleep(entry.get('elapsed') or 0)
+        elif self.latency:
+            time.sleep(float(self.latency))
+        
+        if entry.get('error'):
+            raise RuntimeError(f"回放录制的异常: {entry['error']}")
+        with open(os.path.join(self.recordings_dir, entry['file']), 'rb') as f:
+            return pickle.load(f)
+    
+    def summary(self):
+        """返回录制数据的概况：接口调用 -> 录制次数"""
+        return {f"{entries[0]['func']}{entries[0]['kwargs'] or ''}": len(entries)
+                for entries in self._load_index().values()}
+
+def add_provider_arguments(parser):
+    """为命令行解析器添加数据源相关的参数"""
+    parser.add_argument('--provider', choices=PROVIDER_MODES, default=None,
+                        help='数据源模式：live直接获取，record获取并录制，replay离线回放录制数据')
+    parser.add_argument('--recordings', default=None, help='录制数据目录（默认./recordings）')
+    parser.add_argument('--replay-latency', default=None,
+                        help="回放时模拟的网络延迟：秒数，或recorded按录制时的耗时")
+
+def provider_config(args, config=None):
+    """合并配置文件中的data_provider设置和命令行参数，命令行参数优先
+    
+    Args:
+        args: 包含provider、recordings、replay_latency的命令行参数
+        config (dict): 配置文件中的data_provider设置
+    
+    Returns:
+        dict: 包含mode、recordings_dir、latency的设置
+    """
+    merged = {'mode': 'live', 'recordings_dir': './recordings', 'latency': None}
+    merged.update(config or {})
+    if args.provider:
+        merged['mode'] = args.provider
+    if args.recordings:
+        merged['recordings_dir'] = args.recordings
+    if args.replay_latency is not None:
+        merged['latency'] = args.replay_latency
+    if merged['latency'] not in (None, 'recorded'):
+        merged['latency'] = float(merged['latency'])
+    return merged
+
+def provider_arguments(config):
+    """把数据源设置转换为stock_analysis.py的命令行参数，用于子进程运行"""
+    arguments = []
+    if config.get('mode', 'live') != 'live':
+        arguments.extend(['--provider', config['mode']])
+    if config.get('recordings_dir'):
+        arguments.extend(['--recordings', config['recordings_dir']])
+    if config.get('latency') is not None:
+        arguments.extend(['--replay-latency', str(config['latency'])])
+    return arguments
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='录制数据查看工具')
+    parser.add_argument('--recordings', default='./recordings', help='录制数据目录')
+    args = parser.parse_args()
+    
+    summary = DataProvider('replay', args.recordings).summary()
+    for call, count in summary.items():
+        print(f"{call}: {count}次")
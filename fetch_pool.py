@@ -0,0 +1,129 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait as wait_futures
+
+# akshare接口 -> 数据来源站点，同一站点的请求共享并发限制
+FUNCTION_HOSTS = {
+    'stock_fund_flow_industry': 'ths',
+    'stock_board_industry_name_ths': 'ths',
+    'stock_board_industry_cons_ths': 'ths',
+    'stock_board_concept_name_ths': 'ths',
+    'stock_board_concept_cons_ths': 'ths',
+    'stock_individual_fund_flow_rank': 'eastmoney',
+    'stock_sector_fund_flow_hist': 'eastmoney',
+    'stock_board_industry_name_em': 'eastmoney',
+    'stock_zh_a_hist': 'eastmoney',
+    'stock_zh_a_spot': 'sina',
+    'stock_us_dji_spot': 'sina',
+    'tool_trade_date_hist_sina': 'sina',
+    'stock_us_daily': 'sina',
+}
+
+# 各站点的最大并发请求数，未列出的站点使用DEFAULT_HOST_LIMIT
+HOST_LIMITS = {
+    'ths': 3,
+    'eastmoney': 4,
+    'sina': 2,
+}
+DEFAULT_HOST_LIMIT = 2
+
+def function_host(func_name):
+    """返回akshare接口所属的数据来源站点，未知接口返回'other'"""
+    return FUNCTION_HOSTS.get(func_name, 'other')
+
+class BoundedPool:
+    """限制总并发数和每个站点并发数的线程池
+    
+    任务按站点排队，某个站点正在执行的任务达到上限时，该站点的后续任务留在队列中，
+    不占用工作线程，其他站点的任务照常执行。总耗时取决于最慢的一批请求，而不是所有请求耗时之和。
+    """
+    
+    def __init__(self, max_workers=8, host_limits=None, thread_name_prefix="fetch"):
+        """初始化线程池
+        
+        Args:
+            max_workers (int): 最大总并发数
+            host_limits (dict): 站点 -> 最大并发数，覆盖HOST_LIMITS
+            thread_name_prefix (str): 工作线程名前缀
+        """
+        self.host_limits = dict(HOST_LIMITS, **(host_limits or {}))
+        self.logger = logging.getLogger("stock_analyzer")
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._active = {}
+        self._closed = False
+    
+    def submit(self, host, fn, *args, **kwargs):
+        """提交一个访问host站点的任务，返回Future"""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("线程池已关闭")
+            self._queues.setdefault(host, deque()).append((future, fn, args, kwargs))
+        self._dispatch()
+        return future
+    
+    def submit_call(self, fetch, func_name, **kwargs):
+        """提交一次akshare接口调用fetch(func_name, **kwargs)，按接口所属站点限制并发"""
+        return self.submit(function_host(func_name), fetch, func_name, **kwargs)
+    
+    def _dispatch(self):
+        """把未达到并发上限的站点的排队任务交给工作线程"""
+        ready = []
+        with self._lock:
+            for host, queue in self._queues.items():
+                limit = self.host_limits.get(host, DEFAULT_HOST_LIMIT)
+                while queue and self._active.get(host, 0) < limit:
+                    ready.append((host, queue.popleft()))
+                    self._active[host] = self._active.get(host, 0) + 1
+        for host, (future, fn, args, kwargs) in ready:
+            try:
+                self._executor.submit(self._run, host, future, fn, args, kwargs)
+            except RuntimeError as e:
+                # 线程池已关闭且不等待排队的任务
+                with self._lock:
+                    self._active[host] -= 1
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(e)
+    
+    def _run(self, host, future, fn, args, kwargs):
+        """在工作线程中执行任务，结束后释放站点的并发名额"""
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            with self._lock:
+                self._active[host] -= 1
+            self._dispatch()
+    
+    def shutdown(self, wait=True, cancel_pending=False):
+        """关闭线程池
+        
+        Args:
+            wait (bool): 是否等待正在执行的任务结束
+            cancel_pending (bool): 是否取消仍在排队的任务
+        """
+        with self._lock:
+            self._closed = True
+            pending = [item[0] for queue in self._queues.values() for item in queue]
+            if cancel_pending:
+                for queue in self._queues.values():
+                    queue.clear()
+                for future in pending:
+                    future.cancel()
+        if wait and not cancel_pending:
+            # 排队的任务在前面的任务结束时才交给工作线程，先等它们完成
+            wait_futures(pending)
+        self._executor.shutdown(wait=wait)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown(wait=False, cancel_pending=True)
+        return False
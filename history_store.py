@@ -0,0 +1,379 @@
+import os
+import re
+import glob
+import uuid
+import shutil
+import logging
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+from schema import SOURCE_SCHEMAS, conform
+
+# pyarrow在首次读写历史数据时才导入
+pa = None
+ds = None
+pq = None
+
+# 各数据集的统一字段（列名 -> 类型）及不同数据源的列名别名
+DATASET_SCHEMAS = {
+    'industry_flow': {
+        'columns': {
+            '行业名称': 'string',
+            '行业指数': 'float64',
+            '涨跌幅': 'float64',
+            '流入资金': 'float64',
+            '流出资金': 'float64',
+            '净额': 'float64',
+            '主力净额': 'float64',
+            '公司家数': 'int64',
+            '领涨股': 'string',
+            '领涨股涨跌幅': 'float64',
+            '当前价': 'float64',
+            '超大单净额': 'float64',
+            '大单净额': 'float64',
+            '中单净额': 'float64',
+            '小单净额': 'float64',
+            '数据来源': 'string',
+        },
+        'aliases': {
+            '行业': '行业名称',
+            '板块名称': '行业名称',
+            '行业-涨跌幅': '涨跌幅',
+            '阶段涨跌幅': '涨跌幅',
+            '领涨股-涨跌幅': '领涨股涨跌幅',
+        },
+    },
+    'a_spot': {
+        'columns': {
+            '代码': 'string',
+            '名称': 'string',
+            '最新价': 'float64',
+            '涨跌额': 'float64',
+            '涨跌幅': 'float64',
+            '昨收': 'float64',
+            '今开': 'float64',
+            '最高': 'float64',
+            '最低': 'float64',
+            '成交量': 'float64',
+            '成交额': 'float64',
+        },
+        'aliases': {},
+    },
+    'daily_bars': {
+        'columns': {
+            '代码': 'string',
+            '开盘': 'float64',
+            '收盘': 'float64',
+            '最高': 'float64',
+            '最低': 'float64',
+            '成交量': 'float64',
+            '成交额': 'float64',
+            '振幅': 'float64',
+            '涨跌幅': 'float64',
+            '涨跌额': 'float64',
+            '换手率': 'float64',
+        },
+        'aliases': {},
+    },
+    'abnormal_volume': {
+        'columns': {
+            '代码': 'string',
+            '名称': 'string',
+            '最新价': 'float64',
+            '涨跌幅': 'float64',
+            '成交量': 'float64',
+            '成交额': 'float64',
+            '行业名称': 'string',
+        },
+        'aliases': {},
+    },
+    'us_sectors': {
+        'columns': {
+            '名称': 'string',
+            '最新价': 'float64',
+            '涨跌额': 'float64',
+            '涨跌幅': 'float64',
+        },
+        'aliases': {
+            '指数名称': '名称',
+        },
+    },
+}
+
+# backfill.py回填的数据在'数据来源'列中的标记
+BACKFILL_SOURCE = '历史回填'
+
+# 字段类型对应的pandas类型，整数列使用可空整数类型
+PANDAS_TYPES = {
+    'string': 'string',
+    'float64': 'float64',
+    'float32': 'float32',
+    'int64': 'Int64',
+    'int32': 'Int32',
+}
+
+# 旧版./output目录下按天保存的CSV文件与数据集的对应关系
+LEGACY_CSV_PATTERNS = {
+    'industry_flow': 'industry_money_flow_*.csv',
+    'abnormal_volume': 'abnormal_volume_stocks_*.csv',
+    'us_sectors': 'us_stock_sectors_*.csv',
+}
+
+def _load_arrow():
+    """导入pyarrow，未安装时返回False"""
+    global pa, ds, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.dataset
+            import pyarrow.parquet
+        except ImportError:
+            return False
+        ds = pyarrow.dataset
+        pq = pyarrow.parquet
+        pa = pyarrow
+    return True
+
+def normalize_frame(df, dataset):
+    """把数据源返回的DataFrame转换为数据集的统一字段和类型
+    
+    列名按别名映射，缺失的列补为空值，多余的列丢弃，'0.19%'形式的百分比字符串转换为数值。
+    """
+    schema = DATASET_SCHEMAS[dataset]
+    df = df.rename(columns=schema['aliases'])
+    # 别名映射后可能出现重复列，保留第一列
+    df = df.loc[:, ~df.columns.duplicated()]
+    
+    normalized = pd.DataFrame(index=range(len(df)))
+    for column, dtype in schema['columns'].items():
+        pandas_type = PANDAS_TYPES[dtype]
+        if column not in df.columns:
+            normalized[column] = pd.Series([None] * len(df), dtype=pandas_type)
+            continue
+        values = df[column].reset_index(drop=True)
+        if dtype != 'string':
+            if not pd.api.types.is_numeric_dtype(values):
+                values = values.astype(str).str.rstrip('%').str.replace(',', '')
+            values = pd.to_numeric(values, errors='coerce')
+            if dtype.startswith('int'):
+                values = values.round()
+        normalized[column] = values.astype(pandas_type)
+    return normalized
+
+class HistoryStore:
+    """按数据集和交易日分区的列式历史数据存储
+    
+    目录结构为 root/<dataset>/date=YYYY-MM-DD/part-*.parquet，每个数据集使用固定的统一字段，
+    读取时可按日期范围裁剪分区，并只读取需要的列和满足过滤条件的行。
+    """
+    
+    def __init__(self, root="./history"):
+        """初始化历史数据存储
+        
+        Args:
+            root (str): 存储根目录
+        """
+        self.root = root
+        self.logger = logging.getLogger("stock_analyzer")
+        self._lock = threading.Lock()
+        self._available = None
+    
+    @property
+    def available(self):
+        """是否可以使用历史数据存储，首次访问时导入pyarrow"""
+        if self._available is None:
+            self._available = _load_arrow()
+            if not self._available:
+                self.logger.warning("未安装pyarrow，历史数据存储不可用")
+            elif not os.path.exists(self.root):
+                os.makedirs(self.root, exist_ok=True)
+        return self._available
+    
+    def _arrow_schema(self, dataset):
+        """构造数据集的Arrow表结构，第一列为交易日期"""
+        fields = [pa.field('date', pa.date32())]
+        for column, dtype in DATASET_SCHEMAS[dataset]['columns'].items():
+            fields.append(pa.field(column, pa.type_for_alias(dtype)))
+        return pa.schema(fields)
+    
+    def _partition_dir(self, dataset, date):
+        """返回数据集某个交易日的分区目录"""
+        return os.path.join(self.root, dataset, f"date={date.strftime('%Y-%m-%d')}")
+    
+    @staticmethod
+    def _to_date(value):
+        """把'YYYYMMDD'、'YYYY-MM-DD'、datetime等形式的日期统一转换为date"""
+        if value is None:
+            return None
+        return pd.Timestamp(str(value) if isinstance(value, int) else value).date()
+    
+    def append(self, dataset, df, date, replace=True):
+        """写入数据集某个交易日的数据
+        
+        Args:
+            dataset (str): 数据集名称，见DATASET_SCHEMAS
+            df (DataFrame): 原始数据，会先转换为统一字段
+            date: 交易日期
+            replace (bool): 为True时覆盖该交易日已有的数据，为False时追加
+        
+        Returns:
+            str: 写入的文件路径，失败时返回None
+        """
+        if not self.available:
+            return None
+        if df is None or len(df) == 0:
+            return None
+        
+        date = self._to_date(date)
+        normalized = normalize_frame(df, dataset)
+        normalized.insert(0, 'date', date)
+        table = pa.Table.from_pandas(normalized, schema=self._arrow_schema(dataset), preserve_index=False)
+        
+        partition_dir = self._partition_dir(dataset, date)
+        with self._lock:
+            tmp_dir = partition_dir + f".tmp-{uuid.uuid4().hex[:8]}"
+            os.makedirs(tmp_dir)
+            file_name = f"part-{datetime.now().strftime('%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+            pq.write_table(table, os.path.join(tmp_dir, file_name), compression='zstd')
+            
+            if replace and os.path.exists(partition_dir):
+                # 先把原有分区改名移开再换入新分区，不会留下删除到一半的分区；换入失败时恢复原有分区
+                old_dir = partition_dir + f".old-{uuid.uuid4().hex[:8]}"
+                os.replace(partition_dir, old_dir)
+                try:
+                    os.replace(tmp_dir, partition_dir)
+                except OSError:
+                    os.replace(old_dir, partition_dir)
+                    raise
+                shutil.rmtree(old_dir, ignore_errors=True)
+            elif os.path.exists(partition_dir):
+                os.replace(os.path.join(tmp_dir, file_name), os.path.join(partition_dir, file_name))
+                os.rmdir(tmp_dir)
+            else:
+                os.replace(tmp_dir, partition_dir)
+        
+        path = os.path.join(partition_dir, file_name)
+        self.logger.info(f"已写入历史数据 {dataset} {date}: {len(normalized)}行 -> {path}")
+        return path
+    
+    def list_dates(self, dataset):
+        """返回数据集已有的交易日列表（升序）"""
+        dataset_dir = os.path.join(self.root, dataset)
+        if not os.path.exists(dataset_dir):
+            return []
+        dates = []
+        for name in os.listdir(dataset_dir):
+            match = re.fullmatch(r"date=(\d{4}-\d{2}-\d{2})", name)
+            if match:
+                dates.append(datetime.strptime(match.group(1), '%Y-%m-%d').date())
+        return sorted(dates)
+    
+    def _build_filter(self, filters):
+        """把[(列名, 运算符, 值), ...]形式的过滤条件转换为Arrow表达式"""
+        expression = None
+        for column, op, value in filters or []:
+            field = ds.field(column)
+            if op in ('=', '=='):
+                condition = field == value
+            elif op == '!=':
+                condition = field != value
+            elif op == '<':
+                condition = field < value
+            elif op == '<=':
+                condition = field <= value
+            elif op == '>':
+                condition = field > value
+            elif op == '>=':
+                condition = field >= value
+            elif op == 'in':
+                condition = field.isin(list(value))
+            elif op == 'not in':
+                condition = ~field.isin(list(value))
+            else:
+                raise ValueError(f"不支持的过滤运算符: {op}")
+            expression = condition if expression is None else expression & condition
+        return expression
+    
+    def read(self, dataset, start=None, end=None, columns=None, filters=None, last_n=None):
+        """读取数据集的历史数据
+        
+        Args:
+            dataset (str): 数据集名称
+            start: 起始交易日（含），为None时不限制
+            end: 结束交易日（含），为None时不限制
+            columns (list): 需要读取的列，为None时读取全部列；'date'列总是包含在内
+            filters (list): 行过滤条件，如[('代码', 'in', codes), ('成交量', '>', 0)]
+            last_n (int): 只读取最近的N个交易日
+        
+        Returns:
+            DataFrame: 按日期升序的数据，没有数据时返回空DataFrame
+        """
+        if not self.available:
+            return pd.DataFrame()
+        
+        start, end = self._to_date(start), self._to_date(end)
+        dates = [d for d in self.list_dates(dataset)
+                 if (start is None or d >= start) and (end is None or d <= end)]
+        if last_n:
+            dates = dates[-last_n:]
+        
+        # 按日期裁剪分区，只打开需要的文件
+        files = []
+        for date in dates:
+            files.extend(sorted(glob.glob(os.path.join(self._partition_dir(dataset, date), "*.parquet"))))
+        if not files:
+            return pd.DataFrame(columns=['date'] + list(columns or DATASET_SCHEMAS[dataset]['columns']))
+        
+        if columns is not None:
+            columns = ['date'] + [c for c in columns if c != 'date']
+        
+        dataset_obj = ds.dataset(files, format='parquet', schema=self._arrow_schema(dataset))
+        table = dataset_obj.to_table(columns=columns, filter=self._build_filter(filters))
+        return table.to_pandas(date_as_object=False)
+    
+    def import_legacy_csv(self, output_dir="./output"):
+        """把旧版按天保存的CSV文件导入历史数据存储
+        
+        有统一字段定义的数据集先经过与获取数据时相同的schema.conform()，修正旧文件中单位不一致的金额。
+        
+        Returns:
+            int: 导入的文件数量
+        """
+        imported = 0
+        for dataset, pattern in LEGACY_CSV_PATTERNS.items():
+            for csv_file in sorted(glob.glob(os.path.join(output_dir, pattern))):
+                match = re.search(r"(\d{8})\.csv$", csv_file)
+                if not match:
+                    continue
+                try:
+                    df = pd.read_csv(csv_file, encoding='utf-8-sig')
+                    if dataset in SOURCE_SCHEMAS:
+                        df = conform(df, dataset)
+                        if df is None:
+                            self.logger.error(f"导入{csv_file}失败: 缺少必需的字段")
+                            continue
+                    if self.append(dataset, df, match.group(1)):
+                        imported += 1
+                except Exception as e:
+                    self.logger.error(f"导入{csv_file}失败: {e}")
+        return imported
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='历史数据存储工具')
+    parser.add_argument('--root', default='./history', help='历史数据存储目录')
+    parser.add_argument('--import-csv', metavar='DIR', help='导入旧版按天保存的CSV文件所在目录')
+    parser.add_argument('--list', action='store_true', help='列出各数据集已有的交易日')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    store = HistoryStore(args.root)
+    if args.import_csv:
+        print(f"已导入{store.import_legacy_csv(args.import_csv)}个CSV文件")
+    if args.list:
+        for dataset in DATASET_SCHEMAS:
+            dates = store.list_dates(dataset)
+            if dates:
+                print(f"{dataset}: {len(dates)}个交易日 ({dates[0]} ~ {dates[-1]})")
@@ -0,0 +1,320 @@
+import os
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from volume_anomaly import normalize_codes
+from fetch_pool import BoundedPool, function_host
+
+# 板块类型 -> (板块列表接口, 成分股接口)
+BOARD_SOURCES = {
+    'industry': ('stock_board_industry_name_ths', 'stock_board_industry_cons_ths'),
+    'concept': ('stock_board_concept_name_ths', 'stock_board_concept_cons_ths'),
+}
+
+# 两次检查板块成分是否变化的最短间隔（小时）
+CHECK_INTERVAL_HOURS = 24
+
+# 刷新失败后至少等待该分钟数再重试，避免数据源故障时每次使用映射都重新请求
+RETRY_INTERVAL_MINUTES = 30
+
+# 成分股数量没有变化的板块，超过该天数也重新获取一次成分股
+MAX_BOARD_AGE_DAYS = 30
+
+BOARD_COLUMNS = ['板块代码', '板块名称', '类型', '成分股数', '更新日期']
+
+def _board_keys(kinds, codes):
+    """板块的唯一键'类型:板块代码'，行业和概念板块的代码可能重复"""
+    return [f"{kind}:{code}" for kind, code in zip(kinds, codes)]
+
+def _board_listing(df):
+    """把板块列表接口返回的数据统一为'板块代码'、'板块名称'两列"""
+    df = df.rename(columns={'code': '板块代码', 'name': '板块名称', '代码': '板块代码', '名称': '板块名称'})
+    return df[['板块代码', '板块名称']].astype(str).drop_duplicates('板块代码').reset_index(drop=True)
+
+class IndustryIndex:
+    """持久化的个股到行业（及概念板块）的映射索引
+    
+    以(股票代码, 板块编号)对的形式紧凑地保存各板块的成分股，加载后为每只股票预先算出所属行业的整数编号：
+    lookup()把一批股票代码一次转换为行业编号，join()把行业代码和名称向量化地并入行情快照，
+    industry_of()按哈希索引O(1)查询单只股票。refresh()只重新获取新增、成分股数量变化或超过
+    MAX_BOARD_AGE_DAYS天未更新的板块的成分股。
+    """
+    
+    def __init__(self, state_file="./cache/industry_index.npz"):
+        """初始化映射索引
+        
+        Args:
+            state_file (str): 索引文件路径
+        """
+        self.state_file = state_file
+        self.logger = logging.getLogger("stock_analyzer")
+        self._lock = threading.Lock()
+        # 最近一次刷新失败的时间，只在进程内有效
+        self.failed_at = None
+        self._reset()
+        self.load()
+    
+    def _reset(self):
+        """清空索引"""
+        self.boards = pd.DataFrame({column: pd.Series([], dtype=int if column == '成分股数' else str)
+                                    for column in BOARD_COLUMNS})
+        self.member_codes = np.array([], dtype='U6')
+        self.member_boards = np.array([], dtype=np.int32)
+        self.checked_at = None
+        self._rebuild()
+    
+    def _rebuild(self):
+        """根据成分股对重新计算每只股票的行业编号和概念板块列表"""
+        kinds = self.boards['类型'].to_numpy(dtype=str)
+        industry_boards = np.flatnonzero(kinds == 'industry')
+        self.industries = (self.boards.iloc[industry_boards][['板块代码', '板块名称']]
+                           .rename(columns={'板块代码': '行业代码', '板块名称': '行业名称'}).reset_index(drop=True))
+        board_industry = np.full(len(self.boards), -1, dtype=np.int32)
+        board_industry[industry_boards] = np.arange(len(industry_boards), dtype=np.int32)
+        
+        self.codes = pd.unique(self.member_codes).astype('U6')
+        self._code_index = pd.Index(self.codes)
+        rows = self._code_index.get_indexer(self.member_codes)
+        pair_industry = board_industry[self.member_boards] if len(self.member_boards) else self.member_boards
+        
+        # 一只股票属于多个行业板块时取第一个
+        self.industry_ids = np.full(len(self.codes), -1, dtype=np.int32)
+        is_industry = pair_industry >= 0
+        unique_rows, first = np.unique(rows[is_industry], return_index=True)
+        self.industry_ids[unique_rows] = pair_industry[is_industry][first]
+        
+        # 概念板块按股票行号排序，_concept_ptr[i]:_concept_ptr[i+1]为第i只股票的概念板块
+        concept_rows = rows[~is_industry]
+        order = np.argsort(concept_rows, kind='stable')
+        self._concept_boards = self.member_boards[~is_industry][order]
+        self._concept_ptr = np.searchsorted(concept_rows[order], np.arange(len(self.codes) + 1))
+    
+    def __len__(self):
+        return len(self.codes)
+    
+    @property
+    def industry_names(self):
+        """各行业的名称数组，下标为行业编号"""
+        return self.industries['行业名称'].to_numpy(dtype=object)
+    
+    def load(self):
+        """从索引文件加载映射"""
+        if not os.path.exists(self.state_file):
+            return False
+        try:
+            with np.load(self.state_file, allow_pickle=False) as state:
+                self.boards = pd.DataFrame({column: state[f'board_{i}'] for i, column in enumerate(BOARD_COLUMNS)})
+                self.boards['成分股数'] = self.boards['成分股数'].astype(int)
+                self.member_codes = state['member_codes']
+                self.member_boards = state['member_boards']
+                checked_at = str(state['checked_at'])
+                self.checked_at = datetime.fromisoformat(checked_at) if checked_at else None
+            self._rebuild()
+            return True
+        except Exception as e:
+            self.logger.error(f"加载个股行业映射失败: {e}")
+            self._reset()
+            return False
+    
+    def save(self):
+        """保存映射"""
+        state_dir = os.path.dirname(self.state_file)
+        if state_dir and not os.path.exists(state_dir):
+            os.makedirs(state_dir)
+        tmp_file = self.state_file + ".tmp.npz"
+        boards = {f'board_{i}': self.boards[column].to_numpy(dtype=int if column == '成分股数' else str)
+                  for i, column in enumerate(BOARD_COLUMNS)}
+        np.savez_compressed(
+            tmp_file,
+            member_codes=self.member_codes,
+            member_boards=self.member_boards,
+            checked_at=self.checked_at.isoformat(timespec='seconds') if self.checked_at else '',
+            **boards,
+        )
+        os.replace(tmp_file, self.state_file)
+    
+    def needs_refresh(self, now=None):
+        """距离上次检查超过CHECK_INTERVAL_HOURS小时或索引为空时返回True，刷新失败后RETRY_INTERVAL_MINUTES分钟内返回False"""
+        now = now or datetime.now()
+        if self.failed_at is not None and now - self.failed_at < timedelta(minutes=RETRY_INTERVAL_MINUTES):
+            return False
+        return (len(self.codes) == 0 or self.checked_at is None
+                or now - self.checked_at >= timedelta(hours=CHECK_INTERVAL_HOURS))
+    
+    def lookup(self, codes):
+        """返回一批股票所属的行业编号，不在映射中的股票为-1"""
+        if len(self.codes) == 0:
+            return np.full(len(codes), -1, dtype=np.int32)
+        rows = self._code_index.get_indexer(normalize_codes(codes))
+        return np.where(rows >= 0, self.industry_ids[np.maximum(rows, 0)], -1).astype(np.int32)
+    
+    def industry_of(self, code):
+        """返回单只股票所属的行业名称，不在映射中时返回None"""
+        try:
+            row = self._code_index.get_loc(normalize_codes([code])[0])
+        except KeyError:
+            return None
+        industry_id = self.industry_ids[row]
+        return self.industries['行业名称'].iat[industry_id] if industry_id >= 0 else None
+    
+    def concepts_of(self, code):
+        """返回单只股票所属的概念板块名称列表"""
+        try:
+            row = self._code_index.get_loc(normalize_codes([code])[0])
+        except KeyError:
+            return []
+        boards = self._concept_boards[self._concept_ptr[row]:self._concept_ptr[row + 1]]
+        return self.boards['板块名称'].to_numpy()[boards].tolist()
+    
+    def join(self, df, code_column='代码'):
+        """把行业代码和行业名称并入行情快照，返回新的DataFrame，不在映射中的股票为空值"""
+        ids = self.lookup(df[code_column])
+        # 行业编号为-1时取到末尾追加的空值
+        codes = np.append(self.industries['行业代码'].to_numpy(dtype=object), None)
+        names = np.append(self.industry_names, None)
+        return df.assign(行业代码=pd.Categorical(codes[ids]), 行业名称=pd.Categorical(names[ids]))
+    
+    def _stale_boards(self, kind, listing, expected_counts, now):
+        """返回需要重新获取成分股的板块代码：新增的、成分股数量与expected_counts不一致的和更新过久的"""
+        known = self.boards[self.boards['类型'] == kind].set_index('板块代码')
+        oldest = (now - timedelta(days=MAX_BOARD_AGE_DAYS)).date().isoformat()
+        stale = []
+        for board in listing.itertuples():
+            if board.板块代码 not in known.index:
+                stale.append(board.板块代码)
+                continue
+            entry = known.loc[board.板块代码]
+            expected = (expected_counts or {}).get(board.板块名称)
+            if entry['更新日期'] < oldest or (expected is not None and not pd.isna(expected)
+                                               and int(expected) != int(entry['成分股数'])):
+                stale.append(board.板块代码)
+        return stale
+    
+    def refresh(self, fetch, kinds=('industry',), expected_counts=None, workers=8, now=None):
+        """增量刷新映射，只重新获取成分股可能变化的板块
+        
+        Args:
+            fetch (callable): fetch(接口名, **参数)，返回akshare接口的数据
+            kinds (tuple): 要刷新的板块类型，见BOARD_SOURCES
+            expected_counts (dict): 板块名称 -> 当前成分股数量（如行业资金流向中的公司家数），数量不一致的板块重新获取
+            workers (int): 并发获取成分股的线程数，同一站点的并发数另受fetch_pool.HOST_LIMITS限制
+            now (datetime): 当前时间
+        
+        Returns:
+            int: 重新获取了成分股的板块数量
+        
+        Raises:
+            Exception: 获取板块列表失败时抛出，并记录失败时间，RETRY_INTERVAL_MINUTES分钟内needs_refresh()返回False
+        """
+        now = now or datetime.now()
+        try:
+            fetched = self._refresh(fetch, kinds, expected_counts, workers, now)
+        except Exception:
+            self.failed_at = now
+            raise
+        self.failed_at = None
+        self.logger.info(f"个股行业映射已更新: {len(self.codes)}只股票，{len(self.industries)}个行业，"
+                         f"{len(self.boards) - len(self.industries)}个概念板块")
+        return fetched
+    
+    def _refresh(self, fetch, kinds, expected_counts, workers, now):
+        """refresh()的实现，返回重新获取了成分股的板块数量"""
+        today = now.date().isoformat()
+        with self._lock:
+            boards = self.boards.copy()
+            listings = {}
+            for kind in kinds:
+                listings[kind] = _board_listing(fetch(BOARD_SOURCES[kind][0]))
+            
+            pending = []
+            for kind, listing in listings.items():
+                names = dict(zip(listing['板块代码'], listing['板块名称']))
+                for code in self._stale_boards(kind, listing, expected_counts if kind == 'industry' else None, now):
+                    pending.append((kind, code, names[code]))
+            
+            def fetch_members(board):
+                kind, _, name = board
+                members = fetch(BOARD_SOURCES[kind][1], symbol=name)
+                return pd.unique(normalize_codes(members['代码']))
+            
+            # 类型:板块代码 -> 新获取的成分股代码
+            fetched = {}
+            if pending:
+                self.logger.info(f"重新获取{len(pending)}个板块的成分股")
+                with BoundedPool(max_workers=workers, thread_name_prefix="industry-index") as pool:
+                    futures = [pool.submit(function_host(BOARD_SOURCES[board[0]][1]), self._safe(fetch_members), board)
+                               for board in pending]
+                    for board, future in zip(pending, futures):
+                        members = future.result()
+                        if members is not None:
+                            fetched[f"{board[0]}:{board[1]}"] = members
+            
+            # 新的板块表：列表中的板块保留，未刷新的板块沿用原有的成分股，未列出的板块删除
+            rows = []
+            for kind, listing in listings.items():
+                known = boards[boards['类型'] == kind].set_index('板块代码')
+                for board in listing.itertuples():
+                    key = f"{kind}:{board.板块代码}"
+                    if key in fetched:
+                        rows.append((board.板块代码, board.板块名称, kind, len(fetched[key]), today))
+                    elif board.板块代码 in known.index:
+                        entry = known.loc[board.板块代码]
+                        rows.append((board.板块代码, board.板块名称, kind, int(entry['成分股数']), entry['更新日期']))
+            untouched = boards[~boards['类型'].isin(list(listings))]
+            new_boards = pd.concat([untouched, pd.DataFrame(rows, columns=BOARD_COLUMNS)], ignore_index=True)
+            
+            # 原有的成分股对按新的板块编号重新编号，刷新过的板块替换为新获取的成分股
+            new_keys = pd.Index(_board_keys(new_boards['类型'], new_boards['板块代码']))
+            remap = new_keys.get_indexer(_board_keys(boards['类型'], boards['板块代码']))
+            # 多出的一位对应已删除板块的编号-1
+            refreshed = np.zeros(len(new_boards) + 1, dtype=bool)
+            refreshed[new_keys.get_indexer(list(fetched))] = True
+            new_ids = remap[self.member_boards] if len(self.member_boards) else self.member_boards
+            keep = (new_ids >= 0) & ~refreshed[new_ids]
+            codes = [self.member_codes[keep]] + [members for members in fetched.values()]
+            board_ids = [new_ids[keep]] + [np.full(len(members), new_keys.get_loc(key))
+                                           for key, members in fetched.items()]
+            
+            self.boards = new_boards
+            self.member_codes = np.concatenate(codes).astype('U6')
+            self.member_boards = np.concatenate(board_ids).astype(np.int32)
+            self.checked_at = now
+            self._rebuild()
+            self.save()
+        return len(fetched)
+    
+    def _safe(self, func):
+        """包装获取函数，出错时记录日志并返回None，该板块沿用原有的成分股"""
+        def wrapper(board):
+            try:
+                return func(board)
+            except Exception as e:
+                self.logger.warning(f"获取板块{board[2]}的成分股失败: {e}")
+                return None
+        return wrapper
+
+if __name__ == "__main__":
+    import argparse
+    from data_provider import DataProvider
+    parser = argparse.ArgumentParser(description='个股行业映射工具')
+    parser.add_argument('--file', default='./cache/industry_index.npz', help='索引文件')
+    parser.add_argument('--refresh', action='store_true', help='增量刷新映射')
+    parser.add_argument('--concepts', action='store_true', help='刷新时同时获取概念板块的成分股')
+    parser.add_argument('--lookup', nargs='*', metavar='CODE', help='查询股票所属的行业和概念板块')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    index = IndustryIndex(args.file)
+    if args.refresh:
+        index.refresh(DataProvider().call, kinds=('industry', 'concept') if args.concepts else ('industry',))
+    for code in args.lookup or []:
+        concepts = index.concepts_of(code)
+        print(f"{code}: {index.industry_of(code) or '未知行业'}" + (f" 概念: {'、'.join(concepts)}" if concepts else ""))
+    if not args.lookup:
+        checked = f"{index.checked_at:%Y-%m-%d %H:%M}" if index.checked_at else "从未"
+        print(f"{len(index)}只股票，{len(index.industries)}个行业，{len(index.boards) - len(index.industries)}个概念板块，"
+              f"最近检查: {checked}")
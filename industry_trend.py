@@ -0,0 +1,245 @@
+import os
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+# 累计净流入的短期和长期窗口（交易日）
+SHORT_WINDOW = 5
+LONG_WINDOW = 20
+
+class IndustryTrendEngine:
+    """行业资金流向的多日趋势和轮动分析
+    
+    为每个行业维护最近window个交易日的每日净额环形缓冲区（行业 x 交易日矩阵），
+    每个交易日收盘后调用update()把当日数据滚入矩阵（只更新一列，不重新读取全部历史），
+    compute()对整个矩阵一次向量化计算滚动累计净额、相对自身历史的Z值、排名变化和排名动量。
+    """
+    
+    def __init__(self, state_file="./cache/industry_trend.npz", window=250, min_periods=5):
+        """初始化趋势分析引擎
+        
+        Args:
+            state_file (str): 趋势状态文件路径
+            window (int): 保留的交易日数
+            min_periods (int): 计算Z值所需的最少历史交易日数
+        """
+        self.state_file = state_file
+        self.window = window
+        self.min_periods = min_periods
+        self.logger = logging.getLogger("stock_analyzer")
+        self._lock = threading.Lock()
+        self._reset()
+        self.load()
+    
+    def _reset(self):
+        """清空趋势状态"""
+        self.names = np.array([], dtype='U32')
+        self.flows = np.full((0, self.window), np.nan)
+        self.pos = 0
+        self.sessions = []
+        self._name_index = pd.Index(self.names)
+    
+    @property
+    def last_session(self):
+        """最近一次滚入矩阵的交易日"""
+        return self.sessions[-1] if self.sessions else None
+    
+    def load(self):
+        """从状态文件加载趋势矩阵，窗口长度不一致时丢弃旧状态"""
+        if not os.path.exists(self.state_file):
+            return False
+        try:
+            with np.load(self.state_file, allow_pickle=False) as state:
+                if state['flows'].shape[1] != self.window:
+                    self.logger.warning("行业趋势窗口长度已变化，丢弃旧的趋势状态")
+                    return False
+                self.names = state['names']
+                self.flows = state['flows']
+                self.pos = int(state['pos'])
+                self.sessions = [str(s) for s in state['sessions']]
+            self._name_index = pd.Index(self.names)
+            return True
+        except Exception as e:
+            self.logger.error(f"加载行业趋势状态失败: {e}")
+            self._reset()
+            return False
+    
+    def save(self):
+        """保存趋势状态"""
+        state_dir = os.path.dirname(self.state_file)
+        if state_dir and not os.path.exists(state_dir):
+            os.makedirs(state_dir)
+        tmp_file = self.state_file + ".tmp.npz"
+        np.savez_compressed(
+            tmp_file,
+            names=self.names,
+            flows=self.flows,
+            pos=self.pos,
+            sessions=np.array(self.sessions, dtype='U8'),
+        )
+        os.replace(tmp_file, self.state_file)
+    
+    @staticmethod
+    def _daily_flows(df):
+        """取出每个行业的名称和净额，去掉名称为空的行"""
+        names = df['行业名称'].astype('string')
+        valid = names.notna().to_numpy()
+        flows = pd.to_numeric(df['净额'], errors='coerce').to_numpy(dtype=float)[valid]
+        return names[valid].to_numpy(dtype='U32'), flows
+    
+    def _align(self, names):
+        """返回行业在矩阵中的行号，新出现的行业追加到矩阵末尾"""
+        indexer = self._name_index.get_indexer(names)
+        new_names = pd.unique(names[indexer < 0])
+        if len(new_names):
+            self.names = np.concatenate([self.names, new_names.astype('U32')])
+            self.flows = np.vstack([self.flows, np.full((len(new_names), self.window), np.nan)])
+            self._name_index = pd.Index(self.names)
+            indexer = self._name_index.get_indexer(names)
+        return indexer
+    
+    def update(self, df, session):
+        """把一个交易日收盘后的行业资金流向滚入趋势矩阵
+        
+        同一交易日重复调用时替换该日的数据，而不是重复计入。
+        
+        Args:
+            df (DataFrame): 包含'行业名称'、'净额'列的当日行业资金流向（亿元）
+            session (str): 交易日 'YYYYMMDD'
+        """
+        session = str(session)
+        with self._lock:
+            if self.sessions and session < self.sessions[-1]:
+                self.logger.warning(f"交易日{session}早于行业趋势中最近的交易日{self.sessions[-1]}，跳过更新")
+                return False
+            
+            names, flows = self._daily_flows(df)
+            rows = self._align(names)
+            if self.sessions and session == self.sessions[-1]:
+                slot = (self.pos - 1) % self.window
+            else:
+                slot = self.pos
+                self.pos = (self.pos + 1) % self.window
+                self.sessions = (self.sessions + [session])[-self.window:]
+            self.flows[:, slot] = np.nan
+            self.flows[rows, slot] = flows
+        
+        self.logger.debug(f"行业趋势已更新至{session}，共{len(self.names)}个行业")
+        return True
+    
+    def bootstrap(self, history):
+        """用历史行业资金流向一次性初始化趋势矩阵
+        
+        Args:
+            history (DataFrame): 包含'date'、'行业名称'、'净额'列的多日数据
+        """
+        with self._lock:
+            self._reset()
+            if history is None or len(history) == 0:
+                return 0
+            history = history.dropna(subset=['行业名称'])
+            sessions = pd.to_datetime(history['date']).dt.strftime('%Y%m%d')
+            # 行业 x 交易日的透视表，同一交易日同一行业有多行时取最后一行
+            matrix = pd.DataFrame({'行业名称': history['行业名称'].astype(str).to_numpy(),
+                                   'session': sessions.to_numpy(),
+                                   '净额': pd.to_numeric(history['净额'], errors='coerce').to_numpy()})
+            matrix = matrix.pivot_table(index='行业名称', columns='session', values='净额', aggfunc='last')
+            matrix = matrix.iloc[:, -self.window:]
+            
+            days = matrix.shape[1]
+            self.names = matrix.index.to_numpy(dtype='U32')
+            self._name_index = pd.Index(self.names)
+            self.flows = np.full((len(self.names), self.window), np.nan)
+            self.flows[:, :days] = matrix.to_numpy(dtype=float)
+            self.pos = days % self.window
+            self.sessions = [str(s) for s in matrix.columns]
+        return days
+    
+    def _ordered(self, df=None, session=None):
+        """返回按交易日从早到晚排列的净额矩阵和交易日列表
+        
+        指定df和session时把该日数据作为临时的最后一列（不写入状态），用于盘中分析。
+        """
+        with self._lock:
+            days = len(self.sessions)
+            order = (self.pos - days + np.arange(days)) % self.window
+            names = self.names
+            flows = self.flows[:, order]
+            sessions = list(self.sessions)
+        
+        if df is not None:
+            today_names, today_flows = self._daily_flows(df)
+            rows = pd.Index(names).get_indexer(today_names)
+            new_names = pd.unique(today_names[rows < 0])
+            if len(new_names):
+                names = np.concatenate([names, new_names.astype('U32')])
+                flows = np.vstack([flows, np.full((len(new_names), flows.shape[1]), np.nan)])
+                rows = pd.Index(names).get_indexer(today_names)
+            column = np.full(len(names), np.nan)
+            column[rows] = today_flows
+            if sessions and str(session) == sessions[-1]:
+                flows[:, -1] = column
+            else:
+                flows = np.hstack([flows, column[:, None]])[:, -self.window:]
+                sessions = (sessions + [str(session)])[-self.window:]
+        return names, flows, sessions
+    
+    def compute(self, df=None, session=None):
+        """计算各行业最近一个交易日的趋势和轮动指标
+        
+        Args:
+            df (DataFrame): 当日（盘中）的行业资金流向，为None时只使用已滚入的交易日
+            session (str): df所属的交易日 'YYYYMMDD'
+        
+        Returns:
+            DataFrame: 每个行业一行，包括'净额'、'5日累计'、'20日累计'、'净额Z值'、'排名'、'排名变化'
+                （较上一交易日上升的名次）、'5日累计排名'、'排名动量'（5日累计排名较5个交易日前上升的名次）
+                和'历史天数'，按5日累计降序；没有数据时返回None
+        """
+        names, flows, sessions = self._ordered(df, session)
+        days = len(sessions)
+        if days == 0 or len(names) == 0:
+            return None
+        
+        valid = ~np.isnan(flows)
+        filled = np.where(valid, flows, 0.0)
+        # 在前面补一列0的累计和，任意窗口的滚动累计都是两列相减
+        cumulative = np.hstack([np.zeros((len(names), 1)), np.cumsum(filled, axis=1)])
+        ends = np.arange(1, days + 1)
+        short_sum = cumulative[:, ends] - cumulative[:, np.maximum(ends - SHORT_WINDOW, 0)]
+        short_sum[~valid] = np.nan
+        long_sum = cumulative[:, -1] - cumulative[:, max(days - LONG_WINDOW, 0)]
+        
+        # 最近一天相对各行业自身此前历史的Z值
+        history_counts = valid[:, :-1].sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = filled[:, :-1].sum(axis=1) / history_counts
+            variance = (filled[:, :-1] ** 2).sum(axis=1) / history_counts - mean ** 2
+            std = np.sqrt(np.maximum(variance, 0))
+            zscore = (flows[:, -1] - mean) / std
+        zscore[(history_counts < self.min_periods) | ~(std > 0)] = np.nan
+        
+        # 每个交易日按净额和5日累计在各行业中的排名（1为流入最多），NaN不参与排名
+        daily_rank = pd.DataFrame(flows).rank(axis=0, ascending=False, method='min').to_numpy()
+        short_rank = pd.DataFrame(short_sum).rank(axis=0, ascending=False, method='min').to_numpy()
+        rank_change = daily_rank[:, -2] - daily_rank[:, -1] if days > 1 else np.full(len(names), np.nan)
+        momentum = (short_rank[:, -1 - SHORT_WINDOW] - short_rank[:, -1]
+                    if days > SHORT_WINDOW else np.full(len(names), np.nan))
+        
+        result = pd.DataFrame({
+            '行业名称': names,
+            '净额': flows[:, -1],
+            f'{SHORT_WINDOW}日累计': short_sum[:, -1],
+            f'{LONG_WINDOW}日累计': np.where(valid[:, -1], long_sum, np.nan),
+            '净额Z值': zscore,
+            '排名': daily_rank[:, -1],
+            '排名变化': rank_change,
+            f'{SHORT_WINDOW}日累计排名': short_rank[:, -1],
+            '排名动量': momentum,
+            '历史天数': valid.sum(axis=1),
+        })
+        # 最近一天没有数据的行业不参与分析
+        result = result[valid[:, -1]]
+        return result.sort_values(f'{SHORT_WINDOW}日累计', ascending=False).reset_index(drop=True)
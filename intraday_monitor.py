@@ -0,0 +1,235 @@
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import metrics
+from data_cache import market_now
+from trading_calendar import get_calendar
+from volume_anomaly import TRADING_PERIODS, TRADING_MINUTES, trading_fraction, normalize_codes
+
+# 盘中监控的默认配置
+DEFAULT_MONITOR_CONFIG = {
+    "interval": 60,                # 初始轮询间隔（秒）
+    "min_interval": 20,            # 市场活跃时的最短轮询间隔（秒）
+    "max_interval": 300,           # 市场平静时的最长轮询间隔（秒）
+    "spot_function": "stock_zh_a_spot",  # 全市场行情接口
+    "volume_burst_ratio": 5.0,     # 本轮成交速度达到当日平均速度的倍数时视为放量
+    "min_burst_amount": 50000000,  # 放量提醒要求本轮新增成交额不低于该值（元）
+    "price_move": 3.0,             # 本轮涨跌幅变化超过该百分点时提醒
+    "min_flow_flip": 1.0,          # 行业资金由流入转为流出（或相反）时，净额绝对值不低于该值（亿元）才提醒
+    "alert_cooldown": 1800,        # 同一股票或行业两次提醒的最短间隔（秒）
+    "max_alerts_per_poll": 10,     # 每轮最多推送的提醒条数
+}
+
+def is_trading_time(now=None):
+    """判断当前是否处于A股连续竞价时段"""
+    now = now or market_now('CN')
+    if not get_calendar('CN').is_session(now.date()):
+        return False
+    return any(start <= now.time() < end for start, end in TRADING_PERIODS)
+
+class IntradayMonitor:
+    """盘中监控：按间隔轮询全市场行情和行业资金流向，与上一轮快照对比，超过阈值时推送提醒
+    
+    只保留上一轮快照对齐后的数组和有限长度的提醒记录，整个交易日内存占用保持稳定。
+    轮询间隔根据本轮提醒数量自适应调整：有异动时缩短，平静时逐步放长。
+    """
+    
+    def __init__(self, analyzer, notification_sender, config=None):
+        """初始化盘中监控
+        
+        Args:
+            analyzer (StockAnalyzer): 用于获取数据的分析器实例
+            notification_sender: 提醒发送器，NotificationSender或NotificationOutbox
+            config (dict): 覆盖DEFAULT_MONITOR_CONFIG中的设置
+        """
+        self.analyzer = analyzer
+        self.notification_sender = notification_sender
+        self.config = dict(DEFAULT_MONITOR_CONFIG, **(config or {}))
+        self.logger = logging.getLogger("auto_stock_analyzer")
+        
+        self.interval = self.config["interval"]
+        self._stop_event = threading.Event()
+        
+        # 上一轮的行情快照（按股票代码对齐的数组）
+        self._prev_codes = None
+        self._prev_volume = None
+        self._prev_amount = None
+        self._prev_pct = None
+        self._prev_fraction = None
+        
+        # 上一轮的行业资金净额
+        self._prev_flow = None
+        
+        # 提醒冷却记录和最近的提醒
+        self._last_alerted = {}
+        self.recent_alerts = deque(maxlen=200)
+    
+    def stop(self):
+        """停止监控"""
+        self._stop_event.set()
+    
+    def diff_spot(self, snapshot, fraction):
+        """对比本轮与上一轮的全市场行情，返回放量和急涨急跌提醒列表
+        
+        Args:
+            snapshot (DataFrame): 包含'代码'、'名称'、'成交量'、'成交额'、'涨跌幅'列的行情快照
+            fraction (float): 当前已交易时间占全天的比例
+        """
+        codes = pd.Index(normalize_codes(snapshot['代码']))
+        volume = pd.to_numeric(snapshot['成交量'], errors='coerce').to_numpy(dtype=float)
+        amount = pd.to_numeric(snapshot['成交额'], errors='coerce').to_numpy(dtype=float)
+        pct = pd.to_numeric(snapshot['涨跌幅'], errors='coerce').to_numpy(dtype=float)
+        names = snapshot['名称'].to_numpy()
+        
+        alerts = []
+        if self._prev_codes is not None:
+            rows = self._prev_codes.get_indexer(codes)
+            known = rows >= 0
+            safe_rows = np.where(known, rows, 0)
+            prev_volume = np.where(known, self._prev_volume[safe_rows], np.nan)
+            prev_amount = np.where(known, self._prev_amount[safe_rows], np.nan)
+            prev_pct = np.where(known, self._prev_pct[safe_rows], np.nan)
+            
+            elapsed_prev = self._prev_fraction * TRADING_MINUTES
+            interval_minutes = (fraction - self._prev_fraction) * TRADING_MINUTES
+            
+            with np.errstate(divide='ignore', invalid='ignore'):
+                # 本轮成交速度与当日此前平均成交速度之比
+                delta_volume = volume - prev_volume
+                burst_ratio = (delta_volume / interval_minutes) / (prev_volume / elapsed_prev)
+                delta_amount = amount - prev_amount
+                delta_pct = pct - prev_pct
+            
+            if interval_minutes > 0 and elapsed_prev > 0:
+                burst = (burst_ratio >= self.config["volume_burst_ratio"]) & (delta_amount >= self.config["min_burst_amount"])
+                for i in np.flatnonzero(burst):
+                    alerts.append((f"burst:{codes[i]}", burst_ratio[i],
+                                   f"🔊 {names[i]}({codes[i]}) 放量: {interval_minutes:.0f}分钟成交{delta_amount[i] / 1e8:.2f}亿元，"
+                                   f"成交速度为今日平均的{burst_ratio[i]:.1f}倍，涨跌幅{pct[i]:.2f}%"))
+            
+            move = np.abs(delta_pct) >= self.config["price_move"]
+            for i in np.flatnonzero(move):
+                direction = "急涨" if delta_pct[i] > 0 else "急跌"
+                alerts.append((f"move:{codes[i]}", abs(delta_pct[i]),
+                               f"{'🚀' if delta_pct[i] > 0 else '⚠️'} {names[i]}({codes[i]}) {direction}: "
+                               f"涨跌幅由{prev_pct[i]:.2f}%变为{pct[i]:.2f}%"))
+        
+        self._prev_codes = codes
+        self._prev_volume = volume
+        self._prev_amount = amount
+        self._prev_pct = pct
+        self._prev_fraction = fraction
+        return alerts
+    
+    def diff_industry_flow(self, flow_df):
+        """对比本轮与上一轮的行业资金净额，返回资金流向反转的提醒列表
+        
+        Args:
+            flow_df (DataFrame): 包含'行业名称'和'净额'（亿元）列的行业资金流向
+        """
+        current = pd.Series(pd.to_numeric(flow_df['净额'], errors='coerce').to_numpy(),
+                            index=flow_df['行业名称'].astype(str)).groupby(level=0).first()
+        
+        alerts = []
+        if self._prev_flow is not None:
+            previous = self._prev_flow.reindex(current.index)
+            flipped = (np.sign(previous) * np.sign(current) < 0) & (current.abs() >= self.config["min_flow_flip"])
+            for name in current.index[flipped.to_numpy()]:
+                direction = "转为净流入" if current[name] > 0 else "转为净流出"
+                alerts.append((f"flow:{name}", abs(current[name]),
+                               f"🔄 {name} 资金{direction}: 净额由{previous[name]:.2f}亿元变为{current[name]:.2f}亿元"))
+        
+        self._prev_flow = current
+        return alerts
+    
+    def _filter_alerts(self, alerts):
+        """去掉冷却期内重复的提醒，按强度排序并限制条数"""
+        now = time.time()
+        cooldown = self.config["alert_cooldown"]
+        # 清理过期的冷却记录，避免全天累积
+        self._last_alerted = {key: ts for key, ts in self._last_alerted.items() if now - ts < cooldown}
+        
+        fresh = []
+        for alert in sorted(alerts, key=lambda alert: alert[1], reverse=True):
+            if len(fresh) >= self.config["max_alerts_per_poll"]:
+                break
+            if alert[0] not in self._last_alerted:
+                self._last_alerted[alert[0]] = now
+                fresh.append(alert)
+        return fresh
+    
+    def _adapt_interval(self, alert_count):
+        """根据本轮提醒数量调整轮询间隔"""
+        if alert_count:
+            self.interval = max(self.config["min_interval"], self.interval / 2)
+        else:
+            self.interval = min(self.config["max_interval"], self.interval * 1.25)
+    
+    def poll_once(self):
+        """执行一轮轮询，返回本轮推送的提醒文本列表"""
+        fraction = trading_fraction()
+        alerts = []
+        
+        try:
+            snapshot = self.analyzer._fetch(self.config["spot_function"], use_cache=False)
+            alerts.extend(self.diff_spot(snapshot, fraction))
+        except Exception as e:
+            self.logger.error(f"盘中监控获取行情失败: {e}")
+        
+        try:
+            flow_df = self.analyzer._fetch('stock_fund_flow_industry', use_cache=False, symbol='即时')
+            flow_df = self.analyzer._normalize_industry_flow_columns(flow_df)
+            if flow_df is not None:
+                alerts.extend(self.diff_industry_flow(flow_df))
+        except Exception as e:
+            self.logger.error(f"盘中监控获取行业资金流向失败: {e}")
+        
+        alerts = self._filter_alerts(alerts)
+        self._adapt_interval(len(alerts))
+        
+        messages = [text for _, _, text in alerts]
+        if messages:
+            title = f"⚡ 盘中异动提醒 ({market_now('CN').strftime('%H:%M')})"
+            self.notification_sender.send_notification(title, "\n".join(messages))
+            self.recent_alerts.extend(messages)
+        self.logger.info(f"盘中监控本轮提醒{len(messages)}条，下次轮询间隔{self.interval:.0f}秒")
+        return messages
+    
+    def _seconds_until_trading(self, now):
+        """返回距离下一个连续竞价时段开始的秒数，今天已收盘时返回None"""
+        for start, _ in TRADING_PERIODS:
+            start_dt = datetime.combine(now.date(), start)
+            if now < start_dt:
+                return (start_dt - now).total_seconds()
+        return None
+    
+    def run(self):
+        """在交易时段内持续轮询，收盘后返回"""
+        self.logger.info("===== 盘中监控模式启动 =====")
+        while not self._stop_event.is_set():
+            now = market_now('CN')
+            if not get_calendar('CN').is_session(now.date()):
+                self.logger.info("今天不是交易日，盘中监控结束")
+                break
+            
+            if not is_trading_time(now):
+                wait = self._seconds_until_trading(now)
+                if wait is None:
+                    self.logger.info("今日已收盘，盘中监控结束")
+                    break
+                self.logger.info(f"非连续竞价时段，{wait / 60:.1f}分钟后继续监控")
+                self._stop_event.wait(wait)
+                continue
+            
+            start_time = time.time()
+            with metrics.span('poll', 'intraday'):
+                self.poll_once()
+            metrics.recorder.write_textfile()
+            # 轮询间隔从本轮开始计时，获取数据耗时超过间隔时立即开始下一轮
+            self._stop_event.wait(max(0, self.interval - (time.time() - start_time)))
+        self.logger.info("===== 盘中监控模式结束 =====")
@@ -0,0 +1,294 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import contextlib
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # Windows没有resource模块，不记录峰值内存
+    resource = None
+
+# 默认的指标输出文件，textfile目录可由node_exporter的textfile collector采集
+DEFAULT_JSONL_FILE = "./logs/metrics.jsonl"
+DEFAULT_TEXTFILE_DIR = "./logs"
+
+# Prometheus指标名前缀
+METRIC_PREFIX = "stock_agent"
+
+# 统计耗时分位数时每个阶段保留的最近样本数
+MAX_SAMPLES = 500
+
+def peak_rss_mb():
+    """返回进程的峰值常驻内存（MB），无法获取时返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS以字节为单位，Linux以KB为单位
+    if sys.platform == 'darwin':
+        return peak / 1024 / 1024
+    return peak / 1024
+
+def percentile(values, q):
+    """返回values的q分位数（线性插值），values为空时返回None"""
+    if not values:
+        return None
+    values = sorted(values)
+    pos = (len(values) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+class Span:
+    """一次计时的阶段，调用方可在with块内设置rows记录处理的数据行数"""
+    
+    def __init__(self, stage, name=None):
+        self.stage = stage
+        self.name = name
+        self.rows = None
+        self.status = 'ok'
+        self.error = None
+
+class MetricsRecorder:
+    """流水线各阶段的耗时和资源指标记录器
+    
+    每个阶段用span()包裹，记录墙钟时间、当前线程的CPU时间、处理行数和进程峰值内存，
+    每个阶段结束时追加一行到JSONL文件，write_textfile()把本进程的汇总写为Prometheus textfile。
+    各入口程序使用不同的process标签和textfile文件，子进程模式下不会互相覆盖。
+    """
+    
+    def __init__(self, jsonl_file=DEFAULT_JSONL_FILE, textfile=None, process=None, enabled=True):
+        """初始化指标记录器
+        
+        Args:
+            jsonl_file (str): 逐条记录各阶段指标的JSONL文件，为None时不写入
+            textfile (str): Prometheus textfile文件，默认为DEFAULT_TEXTFILE_DIR下以process命名的.prom文件
+            process (str): 指标的process标签，默认为入口脚本名
+            enabled (bool): 为False时span()只执行代码块，不记录任何指标
+        """
+        self.jsonl_file = jsonl_file
+        self.process = process or os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0] or 'python'
+        self.textfile = textfile or os.path.join(DEFAULT_TEXTFILE_DIR, f"{self.process}.prom")
+        self.enabled = enabled
+        self.run_id = datetime.now().strftime('%Y%m%d%H%M%S') + f"-{os.getpid()}"
+        self.logger = logging.getLogger("stock_analyzer")
+        self._lock = threading.Lock()
+        # (阶段, 名称) -> 汇总数据
+        self._stats = {}
+        # 指标名 -> (说明, 采集函数)，写出textfile时调用采集函数取得当前值
+        self._gauges = {}
+    
+    def configure(self, jsonl_file=None, textfile=None, process=None, enabled=None):
+        """修改输出文件、process标签或开关，未指定的参数保持不变"""
+        if jsonl_file is not None:
+            self.jsonl_file = jsonl_file
+        if process is not None:
+            self.process = process
+            self.textfile = os.path.join(DEFAULT_TEXTFILE_DIR, f"{process}.prom")
+        if textfile is not None:
+            self.textfile = textfile
+        if enabled is not None:
+            self.enabled = enabled
+    
+    def register_gauge(self, name, help_text, collect):
+        """注册一个gauge指标，每次write_textfile()时调用collect()取得当前值
+        
+        Args:
+            name (str): 指标名，不含METRIC_PREFIX前缀
+            help_text (str): 指标说明
+            collect (callable): 返回[(标签dict, 数值), ...]，标签中会自动加上process
+        """
+        with self._lock:
+            self._gauges[name] = (help_text, collect)
+    
+    @contextlib.contextmanager
+    def span(self, stage, name=None):
+        """记录一个阶段的耗时和资源占用
+        
+        Args:
+            stage (str): 阶段类型，如fetch、process、csv_write、chart、message、notify
+            name (str): 阶段的具体名称，如接口名、分析名或通知渠道
+        """
+        span = Span(stage, name)
+        if not self.enabled:
+            yield span
+            return
+        
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield span
+        except BaseException as e:
+            span.status = 'error'
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self._finish(span, time.perf_counter() - wall_start, time.thread_time() - cpu_start)
+    
+    def _finish(self, span, wall, cpu):
+        """汇总并写出一个阶段的指标，写入失败不影响分析流程"""
+        record = {
+            'ts': datetime.now().isoformat(timespec='milliseconds'),
+            'run_id': self.run_id,
+            'process': self.process,
+            'stage': span.stage,
+            'name': span.name,
+            'wall_ms': round(wall * 1000, 2),
+            'cpu_ms': round(cpu * 1000, 2),
+            'rows': span.rows,
+            'peak_rss_mb': None,
+            'status': span.status,
+        }
+        rss = peak_rss_mb()
+        if rss is not None:
+            record['peak_rss_mb'] = round(rss, 1)
+        if span.error:
+            record['error'] = span.error
+        
+        with self._lock:
+            stats = self._stats.setdefault((span.stage, span.name or ''), {
+                'count': 0, 'errors': 0, 'wall': 0.0, 'cpu': 0.0, 'rows': 0, 'samples': [],
+            })
+            stats['count'] += 1
+            stats['errors'] += span.status != 'ok'
+            stats['wall'] += wall
+            stats['cpu'] += cpu
+            stats['rows'] += span.rows or 0
+            stats['samples'] = (stats['samples'] + [wall])[-MAX_SAMPLES:]
+            
+            if self.jsonl_file:
+                try:
+                    log_dir = os.path.dirname(self.jsonl_file)
+                    if log_dir:
+                        os.makedirs(log_dir, exist_ok=True)
+                    with open(self.jsonl_file, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                except Exception as e:
+                    self.logger.warning(f"写入指标文件失败: {e}")
+    
+    def write_textfile(self):
+        """把本进程各阶段的汇总指标写为Prometheus textfile，返回文件路径"""
+        if not self.enabled or not self.textfile:
+            return None
+        with self._lock:
+            stats = {key: dict(value, samples=list(value['samples'])) for key, value in self._stats.items()}
+            gauges = dict(self._gauges)
+        
+        lines = []
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+            for label_values, value in samples:
+                lines.append(f"{METRIC_PREFIX}_{name}{{{_label_text(label_values)}}} {float(value)!r}")
+        
+        def labels(key=None, **extra):
+            base = {'process': self.process}
+            if key is not None:
+                base.update(stage=key[0], name=key[1])
+            return dict(base, **extra)
+        
+        # 耗时以summary类型输出本进程最近样本的p50/p95，以及总耗时和次数
+        lines.append(f"# HELP {METRIC_PREFIX}_stage_duration_seconds 各阶段墙钟耗时")
+        lines.append(f"# TYPE {METRIC_PREFIX}_stage_duration_seconds summary")
+        for key, value in sorted(stats.items()):
+            for q in (0.5, 0.95):
+                label_text = _label_text(labels(key, quantile=str(q)))
+                lines.append(f"{METRIC_PREFIX}_stage_duration_seconds{{{label_text}}} "
+                             f"{percentile(value['samples'], q)!r}")
+            label_text = _label_text(labels(key))
+            lines.append(f"{METRIC_PREFIX}_stage_duration_seconds_sum{{{label_text}}} {value['wall']!r}")
+            lines.append(f"{METRIC_PREFIX}_stage_duration_seconds_count{{{label_text}}} {value['count']}")
+        
+        metric('stage_cpu_seconds_total', 'counter', '各阶段占用的CPU时间',
+               [(labels(key), value['cpu']) for key, value in sorted(stats.items())])
+        metric('stage_rows_total', 'counter', '各阶段处理的数据行数',
+               [(labels(key), value['rows']) for key, value in sorted(stats.items())])
+        metric('stage_errors_total', 'counter', '各阶段出错次数',
+               [(labels(key), value['errors']) for key, value in sorted(stats.items())])
+        rss = peak_rss_mb()
+        if rss is not None:
+            metric('peak_rss_bytes', 'gauge', '进程峰值常驻内存', [(labels(), rss * 1024 * 1024)])
+        for name, (help_text, collect) in sorted(gauges.items()):
+            try:
+                samples = [(labels(**extra), value) for extra, value in collect()]
+            except Exception as e:
+                self.logger.warning(f"采集指标{name}失败: {e}")
+                continue
+            if samples:
+                metric(name, 'gauge', help_text, samples)
+        metric('last_write_timestamp_seconds', 'gauge', '指标文件最近一次写入的时间', [(labels(), time.time())])
+        
+        try:
+            text_dir = os.path.dirname(self.textfile)
+            if text_dir:
+                os.makedirs(text_dir, exist_ok=True)
+            # 先写临时文件再替换，采集器不会读到写了一半的文件
+            tmp_file = self.textfile + ".tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp_file, self.textfile)
+            return self.textfile
+        except Exception as e:
+            self.logger.warning(f"写入Prometheus指标文件失败: {e}")
+            return None
+
+def _label_text(labels):
+    """生成Prometheus标签文本，转义标签值中的特殊字符"""
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ",".join(f'{key}="{escape(value)}"' for key, value in labels.items())
+
+# 进程内共享的指标记录器
+recorder = MetricsRecorder()
+
+def span(stage, name=None):
+    """使用共享记录器记录一个阶段，见MetricsRecorder.span"""
+    return recorder.span(stage, name)
+
+def register_gauge(name, help_text, collect):
+    """在共享记录器上注册gauge指标，见MetricsRecorder.register_gauge"""
+    recorder.register_gauge(name, help_text, collect)
+
+def summarize(jsonl_file=DEFAULT_JSONL_FILE, days=7):
+    """统计JSONL文件中最近days天各阶段的耗时分位数
+    
+    Returns:
+        list: [(阶段, 名称, 次数, p50毫秒, p95毫秒, 最大毫秒, 出错次数), ...]，按p95降序
+    """
+    if not os.path.exists(jsonl_file):
+        return []
+    since = (datetime.now().timestamp() - days * 86400) if days else None
+    samples = {}
+    with open(jsonl_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if since and datetime.fromisoformat(record['ts']).timestamp() < since:
+                continue
+            entry = samples.setdefault((record['stage'], record.get('name') or ''), [[], 0])
+            entry[0].append(record['wall_ms'])
+            entry[1] += record.get('status') != 'ok'
+    rows = [(stage, name, len(walls), percentile(walls, 0.5), percentile(walls, 0.95), max(walls), errors)
+            for (stage, name), (walls, errors) in samples.items()]
+    return sorted(rows, key=lambda row: row[4], reverse=True)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='流水线阶段耗时统计')
+    parser.add_argument('--file', default=DEFAULT_JSONL_FILE, help='指标JSONL文件')
+    parser.add_argument('--days', type=int, default=7, help='统计最近的天数，0表示全部')
+    args = parser.parse_args()
+    
+    rows = summarize(args.file, args.days)
+    if not rows:
+        print(f"{args.file}中没有指标记录")
+    else:
+        print(f"{'阶段':<12}{'名称':<32}{'次数':>6}{'p50(ms)':>12}{'p95(ms)':>12}{'最大(ms)':>12}{'出错':>6}")
+        for stage, name, count, p50, p95, peak, errors in rows:
+            print(f"{stage:<12}{name:<32}{count:>6}{p50:>12.1f}{p95:>12.1f}{peak:>12.1f}{errors:>6}")
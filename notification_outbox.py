@@ -0,0 +1,331 @@
+import os
+import time
+import random
+import sqlite3
+import logging
+import threading
+import contextlib
+import concurrent.futures
+
+# 通知发件箱的默认配置
+DEFAULT_OUTBOX_CONFIG = {
+    "db_file": "./cache/outbox.db",  # 发件箱数据库文件
+    "base_delay": 30,                # 首次重试的等待时间（秒），之后按指数增长
+    "max_delay": 1800,               # 重试等待时间上限（秒）
+    "max_attempts": 8,               # 最多尝试次数，超过后标记为失败
+    "max_age": 43200,                # 超过该时长（秒）仍未发出的消息不再发送
+    "max_batch": 5,                  # 同一渠道最多合并发送的消息条数
+    "max_chars": 4000,               # 合并后消息内容的最大字符数
+    "flush_timeout": 60,             # 单次运行模式退出前等待发件箱发送完毕的最长时间（秒）
+    "lease": 300,                    # 认领消息后的发送租约（秒），进程在租约内未记录发送结果时消息重新等待发送
+    # 各渠道每分钟最多发送的消息数
+    "rate_limits": {
+        "wechat_work": 20,
+        "server_chan": 20,
+        "pushplus": 10,
+        "email": 10,
+        "dingtalk": 20,
+    },
+}
+
+class NotificationOutbox:
+    """持久化的通知发件箱
+    
+    send_notification()只把消息按渠道写入SQLite后立即返回，由后台线程负责发送：
+    同一渠道积压的多条消息合并为一条发送，按渠道限速，失败后按带抖动的指数退避重试。
+    发送前先把消息从pending认领为sending并设置租约，多个进程（如定时模式和盘中监控）共用发件箱时不会重复发送；
+    进程退出时未发出的消息保留在数据库中，下次启动后继续发送，租约过期仍未记录结果的消息重新等待发送。
+    """
+    
+    def __init__(self, notification_sender, config=None):
+        """初始化发件箱
+        
+        Args:
+            notification_sender (NotificationSender): 实际发送通知的发送器
+            config (dict): 覆盖DEFAULT_OUTBOX_CONFIG中的设置
+        """
+        self.notification_sender = notification_sender
+        self.config = dict(DEFAULT_OUTBOX_CONFIG, **(config or {}))
+        self.config["rate_limits"] = dict(DEFAULT_OUTBOX_CONFIG["rate_limits"], **self.config["rate_limits"])
+        self.db_file = self.config["db_file"]
+        self.logger = logging.getLogger("auto_stock_analyzer")
+        
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        # 各渠道下次允许发送的时间，用于限速和失败后的渠道冷却
+        self._channel_ready = {}
+        self._init_db()
+    
+    @contextlib.contextmanager
+    def _connect(self):
+        """打开数据库连接，每个线程每次操作使用独立的连接，正常结束时提交事务"""
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    def _init_db(self):
+        """创建发件箱表"""
+        db_dir = os.path.dirname(self.db_file)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    channel TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    next_attempt REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    last_error TEXT,
+                    sent_at REAL,
+                    lease_until REAL
+                )
+            """)
+            # 兼容没有租约字段的旧发件箱
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(outbox)")]
+            if 'lease_until' not in columns:
+                conn.execute("ALTER TABLE outbox ADD COLUMN lease_until REAL")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (status, channel, next_attempt)")
+    
+    def send_notification(self, title, content, methods=None):
+        """把通知写入发件箱后立即返回，接口与NotificationSender.send_notification一致
+        
+        Returns:
+            dict: 渠道名 -> 发件箱中的消息编号；没有配置任何通知方式时直接打印到控制台
+        """
+        channels = methods or self.notification_sender.configured_methods()
+        if not channels:
+            return self.notification_sender.send_notification(title, content)
+        
+        now = time.time()
+        results = {}
+        with self._connect() as conn:
+            for channel in channels:
+                cursor = conn.execute(
+                    "INSERT INTO outbox (channel, title, content, created, next_attempt) VALUES (?, ?, ?, ?, ?)",
+                    (channel, title, content, now, now)
+                )
+                results[channel] = cursor.lastrowid
+        self.logger.info(f"通知已加入发件箱: {title} -> {', '.join(channels)}")
+        self._wakeup.set()
+        return results
+    
+    def pending_count(self):
+        """返回尚未发出的消息数，包括已被认领、正在发送的消息"""
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM outbox WHERE status IN ('pending', 'sending')").fetchone()[0]
+    
+    def stats(self):
+        """返回各状态的消息数"""
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+    
+    def _expire_and_purge(self, conn, now):
+        """收回租约已过期的消息，放弃过期未发出的消息，清理一周前已处理的记录"""
+        released = conn.execute(
+            "UPDATE outbox SET status = 'pending', lease_until = NULL WHERE status = 'sending' AND lease_until < ?",
+            (now,)
+        ).rowcount
+        if released:
+            self.logger.warning(f"发件箱中有{released}条消息的发送租约已过期，重新等待发送")
+        expired = conn.execute(
+            "UPDATE outbox SET status = 'expired' WHERE status = 'pending' AND created < ?",
+            (now - self.config["max_age"],)
+        ).rowcount
+        if expired:
+            self.logger.warning(f"发件箱中有{expired}条消息超过{self.config['max_age'] / 3600:.0f}小时未发出，已放弃")
+        conn.execute("DELETE FROM outbox WHERE status NOT IN ('pending', 'sending') AND created < ?",
+                     (now - 7 * 86400,))
+    
+    def _take_batch(self, conn, channel, now):
+        """认领渠道中已到重试时间的消息，按先后顺序合并，返回(消息编号列表, 标题, 内容)"""
+        rows = conn.execute(
+            "SELECT id, title, content FROM outbox WHERE status = 'pending' AND channel = ? AND next_attempt <= ? "
+            "ORDER BY id LIMIT ?",
+            (channel, now, self.config["max_batch"])
+        ).fetchall()
+        if not rows:
+            return None
+        
+        batch = [rows[0]]
+        length = len(rows[0][2])
+        for row in rows[1:]:
+            length += len(row[1]) + len(row[2]) + 2
+            if length > self.config["max_chars"]:
+                break
+            batch.append(row)
+        
+        ids = [row[0] for row in batch]
+        # 认领消息，只发送由本次更新从pending改为sending的消息
+        marks = ",".join("?" * len(ids))
+        lease_until = now + self.config["lease"]
+        claimed = conn.execute(
+            f"UPDATE outbox SET status = 'sending', lease_until = ? WHERE id IN ({marks}) AND status = 'pending'",
+            [lease_until] + ids
+        ).rowcount
+        if claimed != len(ids):
+            # 部分消息已被其他进程认领，放回本次认领的消息，下一轮重新合并
+            conn.execute(f"UPDATE outbox SET status = 'pending', lease_until = NULL "
+                         f"WHERE id IN ({marks}) AND status = 'sending' AND lease_until = ?", ids + [lease_until])
+            self.logger.warning(f"{channel}渠道的消息已被其他进程认领，跳过本轮发送")
+            return None
+        if len(batch) == 1:
+            return ids, batch[0][1], batch[0][2]
+        title = f"{batch[-1][1]}（合并{len(batch)}条）"
+        content = "\n\n".join(f"{row[1]}\n{row[2]}" for row in batch)
+        return ids, title, content
+    
+    def _record_result(self, conn, channel, ids, result, now):
+        """根据发送结果更新消息状态，失败时安排下一次重试并让渠道冷却"""
+        marks = ",".join("?" * len(ids))
+        if result:
+            conn.execute(f"UPDATE outbox SET status = 'sent', sent_at = ?, last_error = NULL, lease_until = NULL "
+                         f"WHERE id IN ({marks})", [now] + ids)
+            return
+        
+        attempts = conn.execute(f"SELECT MAX(attempts) FROM outbox WHERE id IN ({marks})", ids).fetchone()[0] + 1
+        # 带抖动的指数退避，避免多条消息在同一时刻集中重试
+        delay = min(self.config["max_delay"], self.config["base_delay"] * 2 ** (attempts - 1))
+        delay *= random.uniform(0.5, 1.5)
+        status = 'failed' if attempts >= self.config["max_attempts"] else 'pending'
+        conn.execute(
+            f"UPDATE outbox SET attempts = ?, next_attempt = ?, status = ?, last_error = ?, lease_until = NULL "
+            f"WHERE id IN ({marks})",
+            [attempts, now + delay, status, result.error or "发送失败"] + ids
+        )
+        # 失败可能由渠道限流引起，冷却期内该渠道的其他消息也暂停发送
+        self._channel_ready[channel] = max(self._channel_ready.get(channel, 0), now + delay)
+        if status == 'failed':
+            self.logger.error(f"{channel}渠道的{len(ids)}条消息已尝试{attempts}次仍未发出，不再重试")
+        else:
+            self.logger.warning(f"{channel}渠道发送失败，{delay:.0f}秒后进行第{attempts + 1}次尝试")
+    
+    def dispatch_once(self):
+        """发送各渠道已到时间的消息，各渠道并发发送
+        
+        Returns:
+            int: 本轮成功发送的消息数
+        """
+        now = time.time()
+        batches = {}
+        with self._connect() as conn:
+            # 查询和认领在同一个写事务内完成，其他进程此时无法认领同一批消息
+            conn.execute("BEGIN IMMEDIATE")
+            self._expire_and_purge(conn, now)
+            channels = [row[0] for row in conn.execute(
+                "SELECT DISTINCT channel FROM outbox WHERE status = 'pending' AND next_attempt <= ?", (now,)
+            )]
+            for channel in channels:
+                if self._channel_ready.get(channel, 0) > now:
+                    continue
+                batch = self._take_batch(conn, channel, now)
+                if batch:
+                    batches[channel] = batch
+        if not batches:
+            return 0
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(batches)) as executor:
+            futures = {channel: executor.submit(self.notification_sender.send_channel, channel, title, content)
+                       for channel, (_, title, content) in batches.items()}
+            results = {channel: future.result() for channel, future in futures.items()}
+        
+        sent = 0
+        now = time.time()
+        with self._connect() as conn:
+            for channel, result in results.items():
+                ids = batches[channel][0]
+                # 按渠道每分钟的限额安排下次发送时间
+                rate_limit = self.config["rate_limits"].get(channel)
+                if rate_limit:
+                    self._channel_ready[channel] = now + 60.0 / rate_limit
+                self._record_result(conn, channel, ids, result, now)
+                if result:
+                    sent += len(ids)
+                    self.logger.info(f"发件箱通过{channel}发送{len(ids)}条消息，耗时{result.latency * 1000:.0f}ms")
+        return sent
+    
+    def _seconds_until_next(self):
+        """返回距离下一条消息可以发送的秒数，没有待发送消息时返回None；正在发送的消息按租约到期时间计算"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT channel, MIN(CASE WHEN status = 'pending' THEN next_attempt ELSE lease_until END) "
+                "FROM outbox WHERE status IN ('pending', 'sending') GROUP BY channel"
+            ).fetchall()
+        if not rows:
+            return None
+        now = time.time()
+        return max(0.0, min(max(next_attempt, self._channel_ready.get(channel, 0)) - now
+                            for channel, next_attempt in rows))
+    
+    def _run(self):
+        """后台发送线程"""
+        while not self._stop_event.is_set():
+            try:
+                self.dispatch_once()
+                wait = self._seconds_until_next()
+            except Exception as e:
+                self.logger.error(f"发件箱发送过程中发生异常: {e}")
+                wait = self.config["base_delay"]
+            # 有新消息加入时立即唤醒
+            self._wakeup.wait(60 if wait is None else min(wait, 60))
+            self._wakeup.clear()
+    
+    def start(self):
+        """启动后台发送线程，上次未发出的消息会继续发送"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="notification-outbox", daemon=True)
+            self._thread.start()
+        return self
+    
+    def stop(self, timeout=None):
+        """停止后台发送线程，未发出的消息保留在发件箱中"""
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+    
+    def flush(self, timeout=None):
+        """等待发件箱中的消息发送完毕
+        
+        Args:
+            timeout (float): 最长等待秒数，默认使用配置中的flush_timeout
+        
+        Returns:
+            bool: 是否已全部发出；未发出的消息保留到下次启动后继续发送
+        """
+        timeout = self.config["flush_timeout"] if timeout is None else timeout
+        deadline = time.time() + timeout
+        while self.pending_count():
+            if self._thread is None:
+                self.dispatch_once()
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                self.logger.warning(f"发件箱仍有{self.pending_count()}条消息未发出，将在下次启动后继续发送")
+                return False
+            wait = self._seconds_until_next()
+            time.sleep(min(remaining, 0.5 if wait is None else max(wait, 0.1)))
+        return True
+
+if __name__ == "__main__":
+    import argparse
+    from notification_utils import NotificationSender
+    parser = argparse.ArgumentParser(description='通知发件箱工具')
+    parser.add_argument('--db', default=DEFAULT_OUTBOX_CONFIG["db_file"], help='发件箱数据库文件')
+    parser.add_argument('--flush', action='store_true', help='发送发件箱中积压的消息')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    outbox = NotificationOutbox(NotificationSender("notification_config.json"), {"db_file": args.db})
+    if args.flush:
+        outbox.flush()
+    print(f"发件箱状态: {outbox.stats()}")
@@ -1,20 +1,54 @@
-import requests
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import os
 import json
 import logging
-from email.header import Header
 import time
+import threading
+import concurrent.futures
+import metrics
+
+# 各推送渠道的请求超时（秒）
+REQUEST_TIMEOUT = 10
+
+# 支持的通知方式，按发送顺序排列
+CHANNEL_METHODS = ['wechat_work', 'server_chan', 'pushplus', 'email', 'dingtalk']
+
+class ChannelResult:
+    """单个推送渠道的发送结果，可直接作为布尔值判断是否发送成功"""
+    
+    def __init__(self, ok, latency, error=None):
+        """初始化发送结果
+        
+        Args:
+            ok (bool): 是否发送成功
+            latency (float): 发送耗时（秒）
+            error (str): 失败原因
+        """
+        self.ok = bool(ok)
+        self.latency = latency
+        self.error = error
+    
+    def __bool__(self):
+        return self.ok
+    
+    def __repr__(self):
+        status = "成功" if self.ok else f"失败({self.error})" if self.error else "失败"
+        return f"<ChannelResult {status} {self.latency * 1000:.0f}ms>"
 
 class NotificationSender:
-    """通知发送工具类，支持多种推送方式"""
+    """通知发送工具类，支持多种推送方式
+    
+    多个推送渠道并发发送，HTTP渠道共用一个保持连接的requests.Session，
+    邮件渠道复用已登录的SMTP连接，用完后可调用close()释放连接。
+    """
     
     def __init__(self, config_file=None):
         """初始化通知发送器，可以从配置文件加载设置"""
         self.config = {}
         self.logger = self._setup_logger()
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._smtp = None
+        self._smtp_lock = threading.Lock()
         
         if config_file and os.path.exists(config_file):
             try:
@@ -40,6 +74,54 @@ class NotificationSender:
             logger.addHandler(handler)
         return logger
     
+    @property
+    def session(self):
+        """共用的HTTP会话，按主机保持连接，首次使用时创建"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+        return self._session
+    
+    def close(self):
+        """关闭HTTP会话和SMTP连接"""
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+        with self._smtp_lock:
+            self._close_smtp()
+    
+    def _close_smtp(self):
+        """关闭SMTP连接，调用方需持有_smtp_lock"""
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+    
+    def _get_smtp(self, smtp_server, smtp_port, username, password):
+        """返回已登录的SMTP连接，已有连接仍然可用时直接复用，调用方需持有_smtp_lock"""
+        import smtplib
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except Exception:
+                pass
+            self._close_smtp()
+        server = smtplib.SMTP_SSL(smtp_server, smtp_port, timeout=REQUEST_TIMEOUT)
+        server.login(username, password)
+        self._smtp = server
+        return server
+    
     def send_server酱(self, title, content, sendkey=None):
         """使用Server酱发送微信通知（已替换为企业微信群机器人，此方法保留为兼容性）"""
         self.logger.warning("Server酱推送已被替换为企业微信群机器人推送，请使用send_wechat_work方法")
@@ -82,7 +164,7 @@ class NotificationSender:
             else:
                 webhook_url = webhook
             
-            response = requests.post(webhook_url, json=data, timeout=10)
+            response = self.session.post(webhook_url, json=data, timeout=REQUEST_TIMEOUT)
             result = response.json()
             
             if result.get('errcode') == 0:
@@ -111,7 +193,7 @@ class NotificationSender:
                 "template": "txt"
             }
             
-            response = requests.post(url, json=data, timeout=10)
+            response = self.session.post(url, json=data, timeout=REQUEST_TIMEOUT)
             result = response.json()
             
             if result.get('code') == 200:
@@ -141,6 +223,10 @@ class NotificationSender:
                 self.logger.warning("邮箱配置不完整，无法发送邮件")
                 return False
             
+            from email.mime.text import MIMEText
+            from email.mime.multipart import MIMEMultipart
+            from email.header import Header
+            
             # 创建邮件
             msg = MIMEMultipart()
             msg['From'] = Header(from_email)
@@ -150,11 +236,14 @@ class NotificationSender:
             # 添加邮件正文
             msg.attach(MIMEText(content, 'plain', 'utf-8'))
             
-            # 发送邮件
-            server = smtplib.SMTP_SSL(smtp_server, smtp_port)
-            server.login(username, password)
-            server.send_message(msg)
-            server.quit()
+            # 发送邮件，复用已登录的连接；连接在发送过程中断开时重新登录一次
+            with self._smtp_lock:
+                try:
+                    self._get_smtp(smtp_server, smtp_port, username, password).send_message(msg)
+                except Exception as e:
+                    self.logger.warning(f"SMTP连接不可用，重新连接: {e}")
+                    self._close_smtp()
+                    self._get_smtp(smtp_server, smtp_port, username, password).send_message(msg)
             
             self.logger.info("邮件发送成功")
             return True
@@ -197,7 +286,7 @@ class NotificationSender:
                 }
             }
             
-            response = requests.post(url, json=data, timeout=10)
+            response = self.session.post(url, json=data, timeout=REQUEST_TIMEOUT)
             result = response.json()
             
             if result.get('errcode') == 0:
@@ -210,44 +299,75 @@ class NotificationSender:
             self.logger.error(f"钉钉发送异常: {e}")
             return False
     
+    def configured_methods(self):
+        """返回配置文件中已配置的通知方式列表"""
+        methods = []
+        if self.config.get('wechat_work', {}).get('webhook'):
+            methods.append('wechat_work')
+        elif self.config.get('server_chan', {}).get('sendkey'):
+            methods.append('server_chan')
+        if self.config.get('pushplus', {}).get('token'):
+            methods.append('pushplus')
+        if self.config.get('email', {}).get('smtp_server'):
+            methods.append('email')
+        if self.config.get('dingtalk', {}).get('access_token'):
+            methods.append('dingtalk')
+        return methods
+    
+    def send_channel(self, method, title, content):
+        """通过单个渠道发送通知并记录耗时
+        
+        Args:
+            method (str): 通知方式，如'wechat_work'、'email'
+        
+        Returns:
+            ChannelResult: 发送结果
+        """
+        senders = {
+            'wechat_work': self.send_wechat_work,
+            'server_chan': self.send_server酱,
+            'pushplus': self.send_pushplus,
+            'email': self.send_email,
+            'dingtalk': self.send_dingtalk,
+        }
+        start_time = time.time()
+        with metrics.span('notify', method) as span:
+            try:
+                ok = senders[method](title, content)
+                error = None
+            except Exception as e:
+                ok, error = False, str(e)
+            if not ok:
+                span.status, span.error = 'error', error or "发送失败"
+        return ChannelResult(ok, time.time() - start_time, error)
+    
     def send_notification(self, title, content, methods=None):
-        """统一发送通知接口，支持多种方式同时发送"""
+        """统一发送通知接口，支持多种方式同时发送
+        
+        Returns:
+            dict: 渠道名 -> ChannelResult，包含是否成功和发送耗时
+        """
         # 如果未指定发送方式，使用所有已配置的方式
         if not methods:
-            methods = []
-            if self.config.get('wechat_work', {}).get('webhook'):
-                methods.append('wechat_work')
-            elif self.config.get('server_chan', {}).get('sendkey'):
-                methods.append('server_chan')
-            if self.config.get('pushplus', {}).get('token'):
-                methods.append('pushplus')
-            if self.config.get('email', {}).get('smtp_server'):
-                methods.append('email')
-            if self.config.get('dingtalk', {}).get('access_token'):
-                methods.append('dingtalk')
+            methods = self.configured_methods()
+        channels = [method for method in CHANNEL_METHODS if method in methods]
         
+        # 各渠道并发发送，慢的渠道不会拖延其他渠道
         results = {}
-        
-        # 发送通知
-        if 'wechat_work' in methods:
-            results['wechat_work'] = self.send_wechat_work(title, content)
-        
-        if 'server_chan' in methods:
-            results['server_chan'] = self.send_server酱(title, content)
-        
-        if 'pushplus' in methods:
-            results['pushplus'] = self.send_pushplus(title, content)
-        
-        if 'email' in methods:
-            results['email'] = self.send_email(title, content)
-        
-        if 'dingtalk' in methods:
-            results['dingtalk'] = self.send_dingtalk(title, content)
+        if channels:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(channels)) as executor:
+                futures = {method: executor.submit(self.send_channel, method, title, content)
+                           for method in channels}
+                for method in channels:
+                    results[method] = futures[method].result()
+            summary = ", ".join(f"{method}={'成功' if result else '失败'}({result.latency * 1000:.0f}ms)"
+                                for method, result in results.items())
+            self.logger.info(f"通知发送完成: {summary}")
         
         # 如果没有配置任何发送方式，打印通知内容到控制台
         if not methods:
             self.logger.info(f"未配置任何通知方式，以下是通知内容:\n标题: {title}\n内容:\n{content}")
-            results['console'] = True
+            results['console'] = ChannelResult(True, 0.0)
         
         return results
 
@@ -312,4 +432,4 @@ if __name__ == "__main__":
     print("\n尝试发送测试通知（由于没有配置，只会打印到控制台）:")
     sender.send_notification(title, content)
     
-    print("\n===== 示例结束 =====")
\ No newline at end of file
+    print("\n===== 示例结束 =====")
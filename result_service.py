@@ -0,0 +1,389 @@
+import os
+import re
+import glob
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# 结果服务的默认配置
+DEFAULT_SERVICE_CONFIG = {
+    "enabled": False,            # 自动分析器是否启动结果服务
+    "host": "127.0.0.1",         # 监听地址，默认只允许本机访问
+    "port": 8765,                # 监听端口
+    "poll_interval": 10,         # 检查历史数据存储和报告文件是否有新结果的间隔（秒）
+    "heartbeat": 15,             # SSE连接无更新时发送心跳注释的间隔（秒）
+    "history_root": "./history",
+    "output_dir": "./output",
+}
+
+# 分析结果 -> 历史数据集
+RESULT_DATASETS = {
+    'industry_flow': 'industry_flow',
+    'abnormal_volume': 'abnormal_volume',
+    'us_stock': 'us_sectors',
+}
+
+# 合并报告文件名，与stock_analysis.StockAnalyzer.run_analysis_report保存的文件一致
+REPORT_PATTERN = "report_*.txt"
+
+# 为断线重连的SSE订阅者保留的最近事件数
+MAX_EVENTS = 100
+
+def _etag(body):
+    return '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+
+class ResultCache:
+    """各分析最新结果的内存缓存
+    
+    结果只从历史数据存储（每个数据集最近一个交易日的分区）和合并报告文件加载，进程内运行和
+    子进程运行的结果以同一种形式提供。内容序列化一次并按内容计算ETag，内容不变时ETag不变，
+    客户端的条件请求直接返回304；内容变化时生成一个事件，通知所有SSE订阅者。
+    """
+    
+    def __init__(self, history_root="./history", output_dir="./output"):
+        """初始化结果缓存
+        
+        Args:
+            history_root (str): 历史数据存储目录
+            output_dir (str): 合并报告文件所在目录
+        """
+        self.history_root = history_root
+        self.output_dir = output_dir
+        self.logger = logging.getLogger("auto_stock_analyzer")
+        self._history = None
+        self._condition = threading.Condition()
+        # 名称 -> {'body', 'etag', 'updated_at', 'frame', 'signature'}
+        self._entries = {}
+        self._events = deque(maxlen=MAX_EVENTS)
+        self._seq = 0
+        self._refresh_lock = threading.Lock()
+    
+    @property
+    def history(self):
+        """历史数据存储，首次使用时创建（导入pandas）"""
+        if self._history is None:
+            from history_store import HistoryStore
+            self._history = HistoryStore(self.history_root)
+        return self._history
+    
+    def _dataset_signature(self, dataset):
+        """返回数据集最近一个交易日及其分区文件的修改时间，用于判断是否需要重新加载"""
+        dates = self.history.list_dates(dataset)
+        if not dates:
+            return None
+        latest = dates[-1]
+        files = glob.glob(os.path.join(self.history_root, dataset, f"date={latest:%Y-%m-%d}", "*.parquet"))
+        return latest, tuple(sorted((os.path.basename(f), os.path.getmtime(f)) for f in files))
+    
+    def _report_file(self):
+        """返回最新的合并报告文件"""
+        files = [f for f in glob.glob(os.path.join(self.output_dir, REPORT_PATTERN))
+                 if re.search(r"report_\d{8}\.txt$", f)]
+        return max(files) if files else None
+    
+    def refresh(self):
+        """检查各结果的来源是否有变化，有变化时重新加载，返回更新了的结果名称列表"""
+        updated = []
+        with self._refresh_lock:
+            if self.history.available:
+                for name, dataset in RESULT_DATASETS.items():
+                    try:
+                        signature = self._dataset_signature(dataset)
+                        if signature is None or signature == self._entries.get(name, {}).get('signature'):
+                            continue
+                        latest = signature[0]
+                        frame = self.history.read(dataset, start=latest, end=latest).drop(columns='date')
+                        payload = {'name': name, 'date': latest.isoformat(), 'rows': len(frame),
+                                   'columns': list(frame.columns),
+                                   'data': json.loads(frame.to_json(orient='records', force_ascii=False))}
+                        if self._store(name, payload, frame, signature):
+                            updated.append(name)
+                    except Exception as e:
+                        self.logger.error(f"加载{name}的最新结果失败: {e}")
+            
+            report_file = self._report_file()
+            if report_file:
+                try:
+                    signature = (report_file, os.path.getmtime(report_file))
+                    if signature != self._entries.get('report', {}).get('signature'):
+                        with open(report_file, 'r', encoding='utf-8') as f:
+                            title, _, message = f.read().partition("\n\n")
+                        day = re.search(r"(\d{8})\.txt$", report_file).group(1)
+                        payload = {'name': 'report', 'date': f"{day[:4]}-{day[4:6]}-{day[6:]}",
+                                   'title': title, 'message': message}
+                        if self._store('report', payload, None, signature):
+                            updated.append('report')
+                except Exception as e:
+                    self.logger.error(f"加载合并报告失败: {e}")
+        return updated
+    
+    def _store(self, name, payload, frame, signature):
+        """保存一个结果，内容变化时生成事件，返回内容是否变化"""
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        etag = _etag(body)
+        with self._condition:
+            entry = self._entries.get(name)
+            if entry is not None and entry['etag'] == etag:
+                entry['signature'] = signature
+                return False
+            updated_at = datetime.now().isoformat(timespec='seconds')
+            self._entries[name] = {'body': body, 'etag': etag, 'updated_at': updated_at,
+                                   'frame': frame, 'signature': signature}
+            self._seq += 1
+            self._events.append((self._seq, name, {'name': name, 'etag': etag, 'date': payload.get('date'),
+                                                   'updated_at': updated_at}))
+            self._condition.notify_all()
+        self.logger.info(f"结果服务已更新{name}（{payload.get('date')}）")
+        return True
+    
+    def get(self, name):
+        """返回结果的缓存项，没有该结果时返回None"""
+        with self._condition:
+            return self._entries.get(name)
+    
+    def index(self):
+        """返回所有结果的概况：名称 -> {'etag', 'updated_at', 'url'}"""
+        with self._condition:
+            return {name: {'etag': entry['etag'], 'updated_at': entry['updated_at'], 'url': f"/results/{name}"}
+                    for name, entry in self._entries.items()}
+    
+    def events_after(self, seq, timeout, closed=None):
+        """等待并返回序号大于seq的事件，超时返回空列表
+        
+        Returns:
+            list: [(序号, 名称, 事件数据), ...]
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._seq > seq or (closed is not None and closed.is_set()),
+                                     timeout=timeout)
+            return [event for event in self._events if event[0] > seq]
+    
+    @property
+    def seq(self):
+        with self._condition:
+            return self._seq
+    
+    def wake(self):
+        """唤醒所有等待事件的订阅者，用于关闭服务"""
+        with self._condition:
+            self._condition.notify_all()
+
+class _Handler(BaseHTTPRequestHandler):
+    """结果服务的请求处理"""
+    
+    protocol_version = "HTTP/1.1"
+    server_version = "StockResultService/1.0"
+    
+    def log_message(self, format, *args):
+        self.server.service.logger.debug(f"{self.address_string()} {format % args}")
+    
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path.rstrip('/') or '/'
+        query = parse_qs(url.query)
+        try:
+            if path == '/events':
+                self._stream_events()
+            elif path in ('/', '/results'):
+                self._send_json(json.dumps(self.server.service.cache.index(), ensure_ascii=False).encode('utf-8'))
+            elif path.startswith('/results/'):
+                self._send_result(path[len('/results/'):], query)
+            elif path == '/health':
+                self._send_json(json.dumps({'status': 'ok', 'subscribers': self.server.service.subscribers}).encode('utf-8'))
+            else:
+                self._send_error(404, "未知的路径")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+    
+    def _not_modified(self, etag):
+        """请求的If-None-Match是否与ETag一致"""
+        tags = [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',') if tag.strip()]
+        return etag in tags or '*' in tags
+    
+    def _send_not_modified(self, etag):
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+    
+    def _send_json(self, body, etag=None):
+        """发送JSON响应，请求的If-None-Match与ETag一致时返回304"""
+        if etag and self._not_modified(etag):
+            self._send_not_modified(etag)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _send_error(self, status, message):
+        body = json.dumps({'error': message}, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _send_result(self, name, query):
+        """返回一个结果；支持sort、ascending和limit参数，结果按内容和参数计算ETag"""
+        entry = self.server.service.cache.get(name)
+        if entry is None:
+            self._send_error(404, f"没有{name}的结果")
+            return
+        sort = query.get('sort', [None])[0]
+        limit = query.get('limit', [None])[0]
+        if entry['frame'] is None or (sort is None and limit is None):
+            self._send_json(entry['body'], entry['etag'])
+            return
+        
+        frame = entry['frame']
+        ascending = query.get('ascending', ['false'])[0].lower() in ('1', 'true')
+        if sort is not None and sort not in frame.columns:
+            self._send_error(400, f"没有{sort}列")
+            return
+        if limit is not None and not limit.isdigit():
+            self._send_error(400, "limit必须是非负整数")
+            return
+        # 同一内容的同一查询结果相同，ETag由结果的ETag和查询参数决定，不需要排序和序列化即可判断304
+        etag = _etag(f"{entry['etag']}?sort={sort}&ascending={ascending}&limit={limit}".encode('utf-8'))
+        if self._not_modified(etag):
+            self._send_not_modified(etag)
+            return
+        if sort is not None:
+            frame = frame.sort_values(sort, ascending=ascending, na_position='last')
+        if limit is not None:
+            frame = frame.head(int(limit))
+        payload = json.loads(entry['body'])
+        payload['rows'] = len(frame)
+        payload['data'] = json.loads(frame.to_json(orient='records', force_ascii=False))
+        self._send_json(json.dumps(payload, ensure_ascii=False).encode('utf-8'), etag)
+    
+    def _stream_events(self):
+        """以Server-Sent Events推送结果更新，重连时按Last-Event-ID补发错过的事件"""
+        service = self.server.service
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'keep-alive')
+        self.end_headers()
+        
+        last_id = self.headers.get('Last-Event-ID')
+        seq = int(last_id) if last_id and last_id.isdigit() else service.cache.seq
+        self.wfile.write(f"retry: {int(service.config['heartbeat'] * 1000)}\n\n".encode('utf-8'))
+        self.wfile.flush()
+        with service.subscribers_lock:
+            service.subscribers += 1
+        try:
+            while not service.closed.is_set():
+                events = service.cache.events_after(seq, service.config['heartbeat'], service.closed)
+                if not events:
+                    self.wfile.write(b": heartbeat\n\n")
+                for event_seq, name, data in events:
+                    message = f"id: {event_seq}\nevent: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                    self.wfile.write(message.encode('utf-8'))
+                    seq = event_seq
+                self.wfile.flush()
+        finally:
+            with service.subscribers_lock:
+                service.subscribers -= 1
+            self.close_connection = True
+
+class ResultService:
+    """本地结果查询和推送服务
+    
+    在后台线程中运行HTTP服务，从ResultCache的内存缓存回答查询，不访问上游数据源：
+    GET /results 列出所有结果，GET /results/<名称> 返回结果（industry_flow、abnormal_volume、us_stock、report，
+    支持If-None-Match条件请求），GET /events 以SSE推送结果更新。
+    后台线程定期检查历史数据存储和报告文件，进程内运行的分析完成后可调用notify()立即刷新。
+    """
+    
+    def __init__(self, config=None):
+        """初始化结果服务
+        
+        Args:
+            config (dict): 覆盖DEFAULT_SERVICE_CONFIG中的设置
+        """
+        self.config = dict(DEFAULT_SERVICE_CONFIG, **(config or {}))
+        self.logger = logging.getLogger("auto_stock_analyzer")
+        self.cache = ResultCache(self.config["history_root"], self.config["output_dir"])
+        self.closed = threading.Event()
+        self.subscribers = 0
+        self.subscribers_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._server = None
+        self._threads = []
+    
+    @property
+    def address(self):
+        """服务的实际监听地址 (host, port)"""
+        return self._server.server_address[:2] if self._server else None
+    
+    def start(self):
+        """加载当前结果并在后台线程中启动HTTP服务和结果检查，返回self"""
+        if self._server is not None:
+            return self
+        self.cache.refresh()
+        self._server = ThreadingHTTPServer((self.config["host"], self.config["port"]), _Handler)
+        self._server.daemon_threads = True
+        self._server.service = self
+        for target, name in ((self._server.serve_forever, "result-service"), (self._poll, "result-service-poll")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        host, port = self.address
+        self.logger.info(f"结果服务已启动: http://{host}:{port}/results")
+        return self
+    
+    def _poll(self):
+        """定期检查是否有新结果"""
+        while not self.closed.is_set():
+            self._wakeup.wait(self.config["poll_interval"])
+            self._wakeup.clear()
+            if self.closed.is_set():
+                break
+            self.cache.refresh()
+    
+    def notify(self):
+        """通知服务有新的分析结果，立即重新检查，不等待下一次定期检查"""
+        self._wakeup.set()
+    
+    def stop(self):
+        """停止服务，断开所有SSE订阅者"""
+        if self._server is None:
+            return
+        self.closed.set()
+        self._wakeup.set()
+        self.cache.wake()
+        self._server.shutdown()
+        self._server.server_close()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._server = None
+        self._threads = []
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='本地分析结果查询和推送服务')
+    parser.add_argument('--host', default=DEFAULT_SERVICE_CONFIG["host"], help='监听地址（默认只允许本机访问）')
+    parser.add_argument('--port', type=int, default=DEFAULT_SERVICE_CONFIG["port"], help='监听端口')
+    parser.add_argument('--poll', type=float, default=DEFAULT_SERVICE_CONFIG["poll_interval"],
+                        help='检查新结果的间隔（秒）')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    service = ResultService({"host": args.host, "port": args.port, "poll_interval": args.poll}).start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        service.stop()
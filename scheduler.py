@@ -0,0 +1,292 @@
+import os
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+
+# cron表达式各字段的取值范围：分 时 日 月 周（0和7都表示周日）
+CRON_FIELDS = [
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    ('weekday', 0, 7),
+]
+
+# 默认的补跑宽限时间（秒）：错过的运行在该时间内补跑，超过则跳过
+DEFAULT_GRACE = 900
+
+# 定时模式下检查配置文件是否修改的最长间隔（秒）
+CONFIG_CHECK_INTERVAL = 30
+
+def _parse_field(text, low, high):
+    """解析cron表达式的一个字段，返回取值集合，支持*、列表、范围和步长"""
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+            if step <= 0:
+                raise ValueError(f"步长必须为正数: {text}")
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start_text, end_text = part.split('-', 1)
+            start, end = int(start_text), int(end_text)
+        else:
+            start = int(part)
+            # '5/10'表示从5开始每10个取一个
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError(f"取值超出范围{low}-{high}: {text}")
+        values.update(range(start, end + 1, step))
+    return values
+
+class CronSpec:
+    """cron风格的运行时间表达式
+    
+    支持标准的5字段表达式（分 时 日 月 周），如'45 9 * * 1-5'表示工作日9:45；
+    也支持'HH:MM'简写表示每天的固定时间。日和周都有限制时，满足其一即可（与cron一致）。
+    """
+    
+    def __init__(self, expr):
+        self.expr = expr.strip()
+        fields = self.expr.split()
+        if len(fields) == 1 and ':' in fields[0]:
+            hour, minute = fields[0].split(':')
+            fields = [str(int(minute)), str(int(hour)), '*', '*', '*']
+        if len(fields) != 5:
+            raise ValueError(f"cron表达式应包含5个字段: {expr}")
+        
+        parsed = {name: _parse_field(text, low, high) for (name, low, high), text in zip(CRON_FIELDS, fields)}
+        self.minutes = sorted(parsed['minute'])
+        self.hours = sorted(parsed['hour'])
+        self.days = parsed['day']
+        self.months = parsed['month']
+        # cron中周日为0或7，转换为Python的weekday()：周一为0，周日为6
+        self.weekdays = {(value - 1) % 7 for value in parsed['weekday']}
+        self.day_restricted = fields[2] != '*'
+        self.weekday_restricted = fields[4] != '*'
+    
+    def matches_day(self, day):
+        """判断某一天是否满足日、月、周的限制"""
+        if day.month not in self.months:
+            return False
+        day_ok = day.day in self.days
+        weekday_ok = day.weekday() in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+    
+    def next_after(self, moment):
+        """返回严格晚于moment的下一个运行时间"""
+        start = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.date()
+        # 最多向后查找5年（2月29日等罕见组合）
+        for _ in range(366 * 5):
+            if self.matches_day(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = datetime(day.year, day.month, day.day, hour, minute)
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f"cron表达式没有可能的运行时间: {self.expr}")
+    
+    def __repr__(self):
+        return f"CronSpec({self.expr!r})"
+
+class Job:
+    """一个定时任务"""
+    
+    def __init__(self, name, cron, action, grace=DEFAULT_GRACE, options=None):
+        """初始化定时任务
+        
+        Args:
+            name (str): 任务名称
+            cron (str): 运行时间表达式，见CronSpec
+            action (callable): 到期时调用action(job)
+            grace (float): 补跑宽限时间（秒）
+            options (dict): 任务的其他设置，供action使用
+        """
+        self.name = name
+        self.cron = CronSpec(cron)
+        self.action = action
+        self.grace = grace
+        self.options = options or {}
+        # 同一任务的上一次运行尚未结束时不再启动新的运行
+        self.running = threading.Lock()
+
+class Scheduler:
+    """事件驱动的定时任务调度器
+    
+    计算各任务的下一次运行时间并一直等待到最早的那一个，不按固定间隔轮询；
+    进程停止期间错过的运行在宽限时间内补跑一次，超过宽限时间的跳过；
+    同一任务上一次运行尚未结束时跳过本次运行；每个任务的最近运行时间持久化到state_file。
+    """
+    
+    def __init__(self, state_file="./logs/scheduler_state.json", reload=None, reload_interval=CONFIG_CHECK_INTERVAL):
+        """初始化调度器
+        
+        Args:
+            state_file (str): 记录各任务最近一次运行时间的文件
+            reload (callable): 每次唤醒时调用，返回新的任务列表表示配置已变化，返回None表示未变化
+            reload_interval (float): 两次调用reload的最长间隔（秒）
+        """
+        self.state_file = state_file
+        self.reload = reload
+        self.reload_interval = reload_interval
+        self.logger = logging.getLogger("auto_stock_analyzer")
+        self.jobs = {}
+        # 已提示过错过运行的任务，避免每次唤醒重复提示
+        self._missed_reported = set()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._threads = []
+        self._state_lock = threading.Lock()
+        self.state = self._load_state()
+    
+    def _load_state(self):
+        """读取各任务最近一次运行的计划时间"""
+        if not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return {name: datetime.fromisoformat(value) for name, value in json.load(f).items()}
+        except Exception as e:
+            self.logger.warning(f"读取调度状态失败，将按首次启动处理: {e}")
+            return {}
+    
+    def _save_state(self):
+        """保存各任务最近一次运行的计划时间"""
+        state_dir = os.path.dirname(self.state_file)
+        if state_dir and not os.path.exists(state_dir):
+            os.makedirs(state_dir)
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({name: value.isoformat() for name, value in self.state.items()}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.state_file)
+    
+    def set_jobs(self, jobs):
+        """替换任务列表，正在运行的任务不受影响"""
+        for job in jobs:
+            # 沿用同名任务的运行锁，重新加载配置时正在运行的任务不会被重复启动
+            if job.name in self.jobs:
+                job.running = self.jobs[job.name].running
+        self.jobs = {job.name: job for job in jobs}
+        for job in jobs:
+            self.logger.info(f"定时任务 {job.name}: {job.cron.expr}，下次运行时间 {self.next_run(job):%Y-%m-%d %H:%M}")
+        self._wakeup.set()
+    
+    def next_run(self, job, now=None):
+        """返回任务下一次应运行的计划时间，早于当前时间时表示需要补跑
+        
+        超过宽限时间的计划时间不再补跑，首次运行的任务也只补跑宽限时间内错过的一次。
+        """
+        now = now or datetime.now()
+        earliest = now - timedelta(seconds=job.grace)
+        last_run = self.state.get(job.name)
+        if last_run is None or last_run < earliest:
+            return job.cron.next_after(earliest)
+        return job.cron.next_after(last_run)
+    
+    def _report_missed(self, job, now):
+        """提示超过宽限时间而跳过的运行，每个任务只提示一次"""
+        last_run = self.state.get(job.name)
+        if last_run is None or job.name in self._missed_reported:
+            return
+        missed = job.cron.next_after(last_run)
+        if missed < now - timedelta(seconds=job.grace):
+            self.logger.warning(f"定时任务 {job.name} 错过了{missed:%Y-%m-%d %H:%M}的运行，已超过宽限时间，跳过")
+            self._missed_reported.add(job.name)
+    
+    def _latest_due(self, job, now):
+        """返回不晚于now的最近一次计划时间，用于补跑多次时只运行一次"""
+        due = self.next_run(job, now)
+        while True:
+            following = job.cron.next_after(due)
+            if following > now:
+                return due
+            due = following
+    
+    def _start(self, job, due):
+        """在独立线程中运行到期的任务
+        
+        上一次运行尚未结束时跳过本次运行，但同样记录计划时间，next_run()才会前进到下一个计划时间，
+        否则调度循环会反复拿到同一个已到期的时间而空转。
+        """
+        started = job.running.acquire(blocking=False)
+        with self._state_lock:
+            self.state[job.name] = due
+            self._save_state()
+        if not started:
+            self.logger.warning(f"定时任务 {job.name} 上一次运行尚未结束，跳过{due:%H:%M}的运行")
+            return
+        self._missed_reported.discard(job.name)
+        late = (datetime.now() - due).total_seconds()
+        if late > 60:
+            self.logger.info(f"补跑定时任务 {job.name}（计划时间{due:%Y-%m-%d %H:%M}，延迟{late / 60:.0f}分钟）")
+        else:
+            self.logger.info(f"开始运行定时任务 {job.name}（计划时间{due:%H:%M}）")
+        
+        def run():
+            try:
+                job.action(job)
+            except Exception as e:
+                self.logger.error(f"定时任务 {job.name} 运行异常: {e}")
+            finally:
+                job.running.release()
+                self.logger.info(f"定时任务 {job.name} 已结束，下次运行时间 {self.next_run(job):%Y-%m-%d %H:%M}")
+        
+        thread = threading.Thread(target=run, name=f"job-{job.name}", daemon=True)
+        thread.start()
+        self._threads = [t for t in self._threads if t.is_alive()] + [thread]
+    
+    def _check_reload(self):
+        """调用reload检查配置，任务列表变化时替换"""
+        if self.reload is None:
+            return
+        try:
+            jobs = self.reload()
+        except Exception as e:
+            self.logger.error(f"重新加载定时任务配置失败，继续使用原有配置: {e}")
+            return
+        if jobs is not None:
+            self.logger.info("配置文件已修改，重新加载定时任务")
+            self.set_jobs(jobs)
+    
+    def run(self):
+        """运行调度循环，直到stop()被调用"""
+        self.logger.info(f"调度器启动，共{len(self.jobs)}个定时任务")
+        last_reload = datetime.now()
+        while not self._stop_event.is_set():
+            now = datetime.now()
+            if (now - last_reload).total_seconds() >= self.reload_interval:
+                self._check_reload()
+                last_reload = now
+            
+            next_due = None
+            for job in list(self.jobs.values()):
+                self._report_missed(job, now)
+                due = self.next_run(job, now)
+                if due <= now:
+                    self._start(job, self._latest_due(job, now))
+                    due = self.next_run(job, now)
+                next_due = due if next_due is None else min(next_due, due)
+            
+            # 一直等待到最早到期的任务，期间定期检查配置是否修改
+            wait = self.reload_interval if self.reload else None
+            if next_due is not None:
+                until_due = max(0.0, (next_due - datetime.now()).total_seconds())
+                wait = until_due if wait is None else min(wait, until_due)
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+        self.logger.info("调度器已停止")
+    
+    def stop(self, timeout=None):
+        """停止调度循环并等待正在运行的任务结束"""
+        self._stop_event.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
@@ -0,0 +1,262 @@
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+# 各数据源的统一字段（列名 -> 紧凑类型）、列名别名和模糊匹配关键词
+# 名称和代码使用category，价格、涨跌幅和成交量使用float32，资金和成交额保留float64以免求和时损失精度
+SOURCE_SCHEMAS = {
+    'industry_flow': {
+        'columns': {
+            '行业名称': 'category',
+            '行业指数': 'float32',
+            '涨跌幅': 'float32',
+            '流入资金': 'float64',
+            '流出资金': 'float64',
+            '净额': 'float64',
+            '公司家数': 'int32',
+            '领涨股': 'category',
+            '领涨股涨跌幅': 'float32',
+            '当前价': 'float32',
+            '超大单净额': 'float64',
+            '大单净额': 'float64',
+            '中单净额': 'float64',
+            '小单净额': 'float64',
+        },
+        'aliases': {
+            '行业': '行业名称',
+            '板块名称': '行业名称',
+            '名称': '行业名称',
+            '行业-涨跌幅': '涨跌幅',
+            '阶段涨跌幅': '涨跌幅',
+            '领涨股-涨跌幅': '领涨股涨跌幅',
+        },
+        # 别名未命中时，按列名包含的关键词匹配（只对尚未映射的列）
+        'patterns': [
+            ('净额', ['净额', '净流入']),
+            ('行业名称', ['行业', '板块']),
+        ],
+        'required': ['净额'],
+    },
+    'a_spot': {
+        'columns': {
+            '代码': 'category',
+            '名称': 'category',
+            '最新价': 'float32',
+            '涨跌额': 'float32',
+            '涨跌幅': 'float32',
+            '昨收': 'float32',
+            '今开': 'float32',
+            '最高': 'float32',
+            '最低': 'float32',
+            '成交量': 'float32',
+            '成交额': 'float64',
+        },
+        'aliases': {},
+        'patterns': [],
+        'required': ['代码', '成交量'],
+    },
+    # 个股资金流向，各类订单的净流入金额为元（接口的'今日'、'5日'等前缀按关键词匹配）
+    'stock_flow': {
+        'columns': {
+            '代码': 'category',
+            '名称': 'category',
+            '最新价': 'float32',
+            '涨跌幅': 'float32',
+            '主力净流入': 'float64',
+            '超大单净流入': 'float64',
+            '大单净流入': 'float64',
+            '中单净流入': 'float64',
+            '小单净流入': 'float64',
+        },
+        'aliases': {},
+        'patterns': [
+            ('主力净流入', ['主力净流入-净额']),
+            ('超大单净流入', ['超大单净流入-净额']),
+            ('大单净流入', ['大单净流入-净额']),
+            ('中单净流入', ['中单净流入-净额']),
+            ('小单净流入', ['小单净流入-净额']),
+            ('涨跌幅', ['涨跌幅']),
+        ],
+        'required': ['代码', '主力净流入'],
+    },
+    'us_sectors': {
+        'columns': {
+            '名称': 'category',
+            '最新价': 'float32',
+            '涨跌额': 'float32',
+            '涨跌幅': 'float32',
+        },
+        'aliases': {
+            '指数名称': '名称',
+        },
+        'patterns': [],
+        'required': ['涨跌幅'],
+    },
+}
+
+# akshare接口 -> 数据源
+SOURCE_FUNCTIONS = {
+    'stock_fund_flow_industry': 'industry_flow',
+    'stock_zh_a_spot': 'a_spot',
+    'stock_individual_fund_flow_rank': 'stock_flow',
+    'stock_us_dji_spot': 'us_sectors',
+}
+
+# 字段类型对应的pandas类型，整数列使用可空整数类型
+PANDAS_TYPES = {
+    'category': 'category',
+    'float32': 'float32',
+    'float64': 'float64',
+    'int32': 'Int32',
+}
+
+# 资金金额超过该数值时视为以元为单位
+YUAN_THRESHOLD = 1e6
+
+# 净额与流入减流出之比接近这些倍数（元/万元/亿元之间的换算）时视为单位不一致
+UNIT_SCALES = (1e4, 1e8, 1e-4, 1e-8)
+
+# 比值与上述倍数的相对误差不超过该值时才换算，其他比值说明数据本身有问题，不做猜测
+UNIT_SCALE_TOLERANCE = 0.02
+
+logger = logging.getLogger("stock_analyzer")
+
+# (数据源, 原始列名) -> 列名映射，同一数据源的列名结构只解析一次
+_mapping_cache = {}
+_mapping_lock = threading.Lock()
+
+def resolve_columns(source, columns):
+    """解析原始列名到统一字段的映射，结果按数据源和列名结构缓存
+    
+    Args:
+        source (str): 数据源，见SOURCE_SCHEMAS
+        columns: 原始列名
+    
+    Returns:
+        dict: 原始列名 -> 统一字段名，只包含统一字段中的列；缺少必需字段时返回None
+    """
+    key = (source, tuple(map(str, columns)))
+    with _mapping_lock:
+        if key in _mapping_cache:
+            return _mapping_cache[key]
+    
+    schema = SOURCE_SCHEMAS[source]
+    mapping = {}
+    for column in key[1]:
+        target = column if column in schema['columns'] else schema['aliases'].get(column)
+        # 多个原始列映射到同一字段时保留第一列
+        if target and target not in mapping.values():
+            mapping[column] = target
+    for target, keywords in schema['patterns']:
+        if target in mapping.values():
+            continue
+        for column in key[1]:
+            if column not in mapping and any(keyword in column for keyword in keywords):
+                mapping[column] = target
+                logger.info(f"{source}数据的'{column}'列按关键词映射为'{target}'")
+                break
+    
+    missing = [column for column in schema['required'] if column not in mapping.values()]
+    if missing:
+        logger.error(f"{source}数据缺少必需的字段{missing}，原始列为{list(key[1])}")
+        mapping = None
+    with _mapping_lock:
+        _mapping_cache[key] = mapping
+    return mapping
+
+def _to_numeric(values):
+    """把列转换为数值，'0.19%'、'1,234'形式的字符串去掉符号后转换"""
+    if not pd.api.types.is_numeric_dtype(values):
+        values = values.astype(str).str.rstrip('%').str.replace(',', '')
+    return pd.to_numeric(values, errors='coerce')
+
+def _normalize_flow_units(df):
+    """把行业资金流向的金额统一为亿元
+    
+    流入、流出资金以元为单位时换算为亿元；净额与流入减流出的比值在UNIT_SCALE_TOLERANCE内接近
+    UNIT_SCALES中的某个倍数时按该倍数换算，没有流入、流出资金可以对照时，净额以元为单位的按亿元换算。
+    每次换算都记录警告。
+    """
+    for column in ('流入资金', '流出资金', '净额'):
+        values = df[column].to_numpy()
+        finite = values[np.isfinite(values)]
+        if len(finite) and np.median(np.abs(finite)) > YUAN_THRESHOLD:
+            logger.warning(f"行业资金{column}以元为单位，已换算为亿元")
+            df[column] = values / 1e8
+    
+    net = df['净额'].to_numpy()
+    reference = df['流入资金'].to_numpy() - df['流出资金'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        valid = np.isfinite(net) & np.isfinite(reference) & (np.abs(reference) > 1e-6) & (net != 0)
+        if valid.sum() >= 3:
+            ratio = np.median(net[valid] / reference[valid])
+            for scale in UNIT_SCALES:
+                if abs(ratio / scale - 1) <= UNIT_SCALE_TOLERANCE:
+                    logger.warning(f"行业资金净额是流入减流出的{ratio:g}倍，按{scale:g}倍换算为亿元")
+                    df['净额'] = net / scale
+                    break
+    return df
+
+# 数据源 -> 单位换算函数
+UNIT_NORMALIZERS = {
+    'industry_flow': _normalize_flow_units,
+}
+
+def conform(df, source):
+    """把原始数据转换为数据源的统一字段、单位和紧凑类型
+    
+    只保留统一字段中的列并按固定顺序排列，缺失的字段补为空值。已经转换过的数据再次转换结果不变。
+    
+    Args:
+        df (DataFrame): 原始数据
+        source (str): 数据源，见SOURCE_SCHEMAS
+    
+    Returns:
+        DataFrame: 转换后的数据，缺少必需字段时返回None
+    """
+    mapping = resolve_columns(source, df.columns)
+    if mapping is None:
+        return None
+    schema = SOURCE_SCHEMAS[source]
+    # 原始列名可能重复，按位置取列
+    positions = {}
+    for i, column in enumerate(map(str, df.columns)):
+        target = mapping.get(column)
+        if target and target not in positions:
+            positions[target] = i
+    
+    result = {}
+    for column, dtype in schema['columns'].items():
+        pandas_type = PANDAS_TYPES[dtype]
+        if column not in positions:
+            result[column] = pd.Series([None] * len(df), dtype=pandas_type)
+            continue
+        values = df.iloc[:, positions[column]].reset_index(drop=True)
+        if dtype == 'category':
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype('string').astype('category')
+        else:
+            values = _to_numeric(values)
+            if dtype.startswith('int'):
+                values = values.round()
+            values = values.astype(pandas_type)
+        result[column] = values
+    normalized = pd.DataFrame(result)
+    
+    normalizer = UNIT_NORMALIZERS.get(source)
+    if normalizer is not None:
+        normalized = normalizer(normalized)
+    return normalized
+
+def conform_result(func_name, data):
+    """按akshare接口对应的数据源转换返回数据，没有对应数据源或不是DataFrame时原样返回"""
+    source = SOURCE_FUNCTIONS.get(func_name)
+    if source is None or not isinstance(data, pd.DataFrame):
+        return data
+    return conform(data, source)
+
+def memory_mb(df):
+    """返回DataFrame占用的内存（MB），包括字符串对象"""
+    return df.memory_usage(deep=True).sum() / 1024 / 1024
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+def top_k_indices(values, k, ascending=False, mask=None):
+    """用部分选择返回数组中最大（或最小）的k个元素的位置，按排名顺序排列
+    
+    Args:
+        values (ndarray): 一维数值数组
+        k (int): 需要的个数
+        ascending (bool): 为True时选最小的k个
+        mask (ndarray): 布尔数组，只在为True的位置中选择
+    
+    Returns:
+        ndarray: 位置数组，NaN不参与排名
+    """
+    values = np.asarray(values, dtype=float)
+    candidates = ~np.isnan(values)
+    if mask is not None:
+        candidates &= mask
+    candidates = np.flatnonzero(candidates)
+    if k <= 0 or len(candidates) == 0:
+        return candidates[:0]
+    
+    keys = values[candidates] if ascending else -values[candidates]
+    if k < len(candidates):
+        # 只把前k个分区出来，再对这k个排序，复杂度O(n + k log k)
+        part = np.argpartition(keys, k - 1)[:k]
+        return candidates[part[np.argsort(keys[part], kind='stable')]]
+    return candidates[np.argsort(keys, kind='stable')]
+
+class Screener:
+    """行情快照选股器：按过滤条件和多个排序键一次性选出各自的前K名
+    
+    列数据只转换一次为NumPy数组，过滤条件按表达式缓存，多个排序键共享同一个过滤掩码。
+    
+    示例:
+        screener = Screener(spot_df)
+        result = screener.screen([
+            ('volume', '成交量', 20),
+            ('gainers', '涨跌幅', 10),
+            ('losers', '涨跌幅', 10, True),
+        ], where="`最新价` > 2 and `成交量` > 0")
+    """
+    
+    def __init__(self, df):
+        """初始化选股器
+        
+        Args:
+            df (DataFrame): 行情快照
+        """
+        self.df = df
+        self._values = {}
+        self._masks = {}
+    
+    def values(self, column):
+        """返回列的浮点数组（缓存）"""
+        if column not in self._values:
+            self._values[column] = pd.to_numeric(self.df[column], errors='coerce').to_numpy(dtype=float)
+        return self._values[column]
+    
+    def mask(self, where=None):
+        """返回过滤条件对应的布尔数组
+        
+        Args:
+            where: 过滤条件，可以是DataFrame.eval表达式字符串（中文列名用反引号括起）、
+                表达式列表（按与运算组合）、布尔数组或以DataFrame为参数的函数；为None时不过滤
+        """
+        if where is None:
+            return None
+        if isinstance(where, (list, tuple)):
+            combined = None
+            for condition in where:
+                condition_mask = self.mask(condition)
+                combined = condition_mask if combined is None else combined & condition_mask
+            return combined
+        if isinstance(where, str):
+            if where not in self._masks:
+                self._masks[where] = np.asarray(self.df.eval(where), dtype=bool)
+            return self._masks[where]
+        if callable(where):
+            return np.asarray(where(self.df), dtype=bool)
+        return np.asarray(where, dtype=bool)
+    
+    def top_k(self, column, k=10, ascending=False, where=None):
+        """返回按column排名的前k行
+        
+        Args:
+            column (str): 排序列
+            k (int): 返回行数
+            ascending (bool): 为True时返回最小的k行
+            where: 过滤条件，见mask()
+        """
+        positions = top_k_indices(self.values(column), k, ascending, self.mask(where))
+        return self.df.iloc[positions]
+    
+    def screen(self, keys, where=None):
+        """按多个排序键选股，所有键共享同一个过滤掩码
+        
+        Args:
+            keys (list): 排序键列表，每项为(名称, 列名, k)或(名称, 列名, k, ascending)
+            where: 所有排序键共用的过滤条件，见mask()
+        
+        Returns:
+            dict: 名称 -> 前k行DataFrame
+        """
+        mask = self.mask(where)
+        results = {}
+        for key in keys:
+            name, column, k = key[:3]
+            ascending = key[3] if len(key) > 3 else False
+            positions = top_k_indices(self.values(column), k, ascending, mask)
+            results[name] = self.df.iloc[positions]
+        return results
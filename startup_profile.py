@@ -0,0 +1,82 @@
+import os
+import re
+import sys
+import subprocess
+
+# 命令行入口在分析时才按需导入的重量级依赖，stock_analysis.py和auto_analyzer.py的--startup-profile共用
+LAZY_MODULES = ["pandas", "akshare", "matplotlib.backends.backend_agg", "pyarrow.parquet"]
+
+# -X importtime 输出行格式: "import time:  self [us] | cumulative | imported package"
+IMPORTTIME_PATTERN = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def profile_imports(module, preload=None, python=None):
+    """在新的解释器中用-X importtime导入模块，返回导入该模块新增的累计耗时
+    
+    Args:
+        module (str): 要统计的模块
+        preload (list): 先导入但不统计的模块，用于统计按需导入时的增量耗时
+        python (str): Python解释器路径，默认为当前解释器
+    
+    Returns:
+        tuple: (累计耗时毫秒, 新导入的模块数)，导入失败时返回None
+    """
+    statements = [f"import {name}" for name in preload or []]
+    # 用标记行区分预加载和需要统计的模块
+    statements.append("import sys; sys.stderr.write('== profile start ==\\n')")
+    statements.append(f"import {module}")
+    
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [python or sys.executable, "-X", "importtime", "-c", "\n".join(statements)],
+        cwd=cwd, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return None
+    
+    lines = result.stderr.splitlines()
+    if "== profile start ==" in lines:
+        lines = lines[lines.index("== profile start ==") + 1:]
+    
+    # 子模块先于父模块输出，累计耗时记录在没有缩进的顶层行上，
+    # 依赖在顶层单独列出时（如先导入的numpy）也计入该模块
+    total_ms = 0.0
+    imported = 0
+    for line in lines:
+        match = IMPORTTIME_PATTERN.match(line)
+        if not match:
+            continue
+        imported += 1
+        if len(match.group(3)) <= 1:
+            total_ms += int(match.group(2)) / 1000.0
+    return total_ms, imported
+
+def print_startup_profile(entry_module, lazy_modules):
+    """打印命令行入口的启动导入耗时，以及各按需导入模块的增量耗时
+    
+    Args:
+        entry_module (str): 命令行入口模块，如'stock_analysis'
+        lazy_modules (list): 运行时按需导入的模块
+    """
+    print(f"===== 启动导入耗时分析: {entry_module} =====")
+    entry = profile_imports(entry_module)
+    if entry is None:
+        print(f"{entry_module} 导入失败")
+        return
+    entry_ms, entry_count = entry
+    print(f"启动导入: {entry_ms:.1f} ms（{entry_count}个模块）")
+    
+    print("\n按需导入（仅在实际使用时产生）:")
+    total_ms = entry_ms
+    # 按顺序累加预加载模块，每个模块只统计在前面模块之上新增的部分
+    preload = [entry_module]
+    for name in lazy_modules:
+        lazy = profile_imports(name, preload=preload)
+        if lazy is None:
+            print(f"  {name:<22}{'未安装':>10}")
+            continue
+        preload.append(name)
+        lazy_ms, lazy_count = lazy
+        total_ms += lazy_ms
+        print(f"  {name:<22}{lazy_ms:>10.1f} ms（{lazy_count}个模块）")
+    
+    print(f"\n全部加载合计: {total_ms:.1f} ms")
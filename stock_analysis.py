@@ -1,26 +1,89 @@
 import os
 import sys
-import akshare as ak
-import pandas as pd
-import matplotlib.pyplot as plt
-import numpy as np
+import shutil
 from datetime import datetime, timedelta
 import time
 import random
 import logging
-from notification_utils import NotificationSender
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, wait, FIRST_COMPLETED
+from fetch_pool import BoundedPool
+from data_provider import DataProvider, add_provider_arguments, provider_config
+import metrics
+# 依赖pandas、numpy和pyarrow的模块以及通知发送器在使用处导入，--help和--startup-profile不加载它们
 
-# 设置中文显示
-plt.rcParams["font.family"] = ["SimHei", "WenQuanYi Micro Hei", "Heiti TC", "SourceHanSansSC-Bold"]
-plt.rcParams['axes.unicode_minus'] = False  # 用来正常显示负号
+# 行业资金流向的数据来源，按优先级排列：(来源名称, 接口参数)
+INDUSTRY_FLOW_SOURCES = [
+    ('即时', {'symbol': '即时'}),
+    ('5日排行', {'symbol': '5日排行'}),
+]
+
+# 由个股资金流向按行业汇总得到的数据来源名称
+STOCK_FLOW_SOURCE = '个股汇总'
+
+# 行业资金流向的获取方式：industry为优先使用行业接口，stocks为优先由个股资金流向汇总
+FLOW_MODES = ['industry', 'stocks']
+
+# 行业下钻时每个行业列出的主要贡献个股数量，以及等待成分股和行情的最长时间（秒）
+DRILL_DOWN_CONTRIBUTORS = 3
+DRILL_DOWN_TIMEOUT = 20
+
+# 所有数据来源都不可用时使用的演示数据的来源名称
+MOCK_SOURCE = '模拟数据'
+
+# 录制和回放时状态和输出文件所在的目录，位于录制目录下
+SANDBOX_DIR = "sandbox"
 
 class StockAnalyzer:
     """股票数据分析工具类，集成多种分析功能"""
     
-    def __init__(self):
-        """初始化股票分析器"""
+    # 分析类型及对应的分析方法，顺序即为合并报告中消息的顺序
+    ANALYSIS_METHODS = [
+        ('industry_flow', 'analyze_industry_money_flow'),
+        ('abnormal_volume', 'analyze_abnormal_volume'),
+        ('us_stock', 'analyze_us_stock_industry_flow'),
+    ]
+    
+    def __init__(self, workers=None, use_cache=True, export_csv=False, provider=None, hedge_delay=5.0,
+                 flow_mode='industry', drill_down=0):
+        """初始化股票分析器
+        
+        Args:
+            workers (int): 并发运行分析的最大线程数，为None时每个分析一个线程，为1时顺序执行
+            use_cache (bool): 是否使用本地数据缓存，为False时每次都重新获取数据
+            export_csv (bool): 是否在写入历史数据存储的同时导出按天的CSV文件
+            provider (DataProvider): 数据源，为None时直接调用akshare
+            hedge_delay (float): 行业资金流向的首选数据来源超过该时间（秒）未返回时，并行请求下一个来源；为0时同时请求所有来源
+            flow_mode (str): 行业资金流向的获取方式，见FLOW_MODES
+            drill_down (int): 对净流入最多和净流出最多的各N个行业获取成分股和行情，在报告中列出主要贡献个股；为0时不下钻
+        """
+        self.workers = workers
+        self.provider = provider or DataProvider()
+        self.hedge_delay = hedge_delay
+        self.flow_mode = flow_mode
+        self.drill_down = drill_down
+        
+        # 最近一次运行的结构化结果，按分析类型记录消息、数据和输出文件
+        self.results = {}
+        # 分析线程所属那次运行的结果字典，超时或渲染较慢的结果不会写进下一次运行
+        self._run_local = threading.local()
+        
+        from data_cache import DataCache
+        from history_store import HistoryStore
+        from chart_renderer import ChartRenderer
+        from notification_utils import NotificationSender
+        
+        # 录制和回放时历史数据、基线、趋势、行业映射和输出文件都写入录制目录下的沙盒，不覆盖实际运行的状态；
+        # 每次都从空的沙盒开始，录制和回放经过相同的代码路径，回放结果可以重现
+        self.state_dir = "."
+        if self.provider.mode != 'live':
+            self.state_dir = os.path.join(self.provider.recordings_dir, SANDBOX_DIR)
+            shutil.rmtree(self.state_dir, ignore_errors=True)
+        self.cache_dir = os.path.join(self.state_dir, "cache")
+        
         # 创建输出目录
-        self.output_dir = "./output"
+        self.output_dir = os.path.join(self.state_dir, "output")
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
         
@@ -32,6 +95,33 @@ class StockAnalyzer:
         # 设置日志
         self.logger = self._setup_logger()
         
+        # akshare数据缓存，录制和回放时每次调用都要经过数据源，不使用缓存
+        self.cache = DataCache(self.cache_dir, enabled=use_cache and self.provider.mode == 'live')
+        if self.provider.mode != 'live':
+            self.logger.info(f"数据源模式: {self.provider.mode}（{self.provider.recordings_dir}），"
+                             f"状态和输出文件写入{self.state_dir}，不发送通知")
+            # 交易日历也经过数据源获取并缓存在沙盒中，离线回放不需要访问网络
+            import trading_calendar
+            trading_calendar.configure(self.provider, self.cache_dir)
+        
+        # 按数据集和交易日分区的历史数据存储
+        self.history = HistoryStore(os.path.join(self.state_dir, "history"))
+        self.export_csv = export_csv
+        
+        # 后台图表渲染器，报告和通知不等待图表生成
+        self.charts = ChartRenderer(self.output_dir, os.path.join(self.cache_dir, "charts.json"))
+        
+        # 基于个股自身历史基线的成交量异常评分引擎，首次分析成交量时加载
+        self._volume_engine = None
+        
+        # 行业资金流向的多日趋势和轮动分析引擎，首次分析行业资金流向时加载
+        self._trend_engine = None
+        
+        # 个股到行业的映射，首次使用时从缓存目录中的industry_index.npz加载，按天在后台增量刷新
+        self._industry_index = None
+        self._industry_index_lock = threading.Lock()
+        self._industry_index_thread = None
+        
         # 通知发送器
         self.notification_sender = NotificationSender("notification_config.json")
     
@@ -42,6 +132,9 @@ class StockAnalyzer:
         logger = logging.getLogger("stock_analyzer")
         logger.setLevel(logging.INFO)
         
+        # 在自动分析器进程内运行时，避免日志再传递给根日志器重复输出
+        logger.propagate = False
+        
         # 避免重复添加处理器
         if not logger.handlers:
             # 文件处理器
@@ -57,27 +150,162 @@ class StockAnalyzer:
         
         return logger
     
-    def get_industry_list(self):
-        """获取一级行业列表"""
+    def _fetch(self, func_name, kind='intraday', market='CN', use_cache=True, **kwargs):
+        """通过数据源调用akshare接口获取数据，优先使用缓存
+        
+        Args:
+            func_name (str): akshare接口名
+            kind (str): 数据类型，决定缓存有效期，可选'intraday'、'post_close'、'static'
+            market (str): 数据所属市场，'CN'或'US'
+            use_cache (bool): 为False时直接获取最新数据，用于盘中轮询
+            **kwargs: 传给akshare接口的参数
+        """
+        from schema import conform_result, memory_mb
+        
+        def fetch():
+            with metrics.span('fetch', func_name) as span:
+                data = self.provider.call(func_name, **kwargs)
+                span.rows = len(data) if hasattr(data, '__len__') else None
+                return data
+        
+        if not use_cache:
+            data = fetch()
+        else:
+            data = self.cache.get_or_fetch(func_name, fetch, kind=kind, market=market, kwargs=kwargs)
+        
+        # 统一列名、单位和紧凑类型，下游代码可以依赖固定的列名
+        normalized = conform_result(func_name, data)
+        if normalized is not data and normalized is not None and self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"{func_name} 数据内存: {memory_mb(data):.2f}MB -> {memory_mb(normalized):.2f}MB")
+        return normalized
+    
+    @property
+    def volume_engine(self):
+        """成交量异常评分引擎，首次使用时加载基线状态"""
+        if self._volume_engine is None:
+            from volume_anomaly import VolumeAnomalyEngine
+            self._volume_engine = VolumeAnomalyEngine(os.path.join(self.cache_dir, "volume_baseline.npz"))
+        return self._volume_engine
+    
+    @property
+    def trend_engine(self):
+        """行业资金流向趋势分析引擎，首次使用时加载趋势状态"""
+        if self._trend_engine is None:
+            from industry_trend import IndustryTrendEngine
+            self._trend_engine = IndustryTrendEngine(os.path.join(self.cache_dir, "industry_trend.npz"))
+        return self._trend_engine
+    
+    @property
+    def industry_index(self):
+        """个股到行业的映射，首次使用时加载
+        
+        距离上次检查超过一天时在后台线程中增量刷新，刷新期间继续使用原有的映射，不阻塞分析；
+        首次运行时映射为空，刷新完成前按映射不可用处理（行业资金流向使用同花顺行业接口，个股不标注行业）。
+        录制和回放时等待刷新完成，两次运行经过相同的调用；等待在锁外进行，不阻塞其他使用映射的线程。
+        """
+        from industry_index import IndustryIndex
+        with self._industry_index_lock:
+            if self._industry_index is None:
+                self._industry_index = IndustryIndex(os.path.join(self.cache_dir, "industry_index.npz"))
+            thread = self._industry_index_thread
+            if thread is None or not thread.is_alive():
+                if not self._industry_index.needs_refresh():
+                    return self._industry_index
+                if len(self._industry_index) == 0:
+                    self.logger.info("个股行业映射为空，在后台获取板块成分股，完成前个股暂不匹配所属行业")
+                thread = self._industry_index_thread = threading.Thread(
+                    target=self._refresh_industry_index_background, args=(self._industry_index,),
+                    name="industry-index-refresh", daemon=True)
+                thread.start()
+            if self.provider.mode == 'live':
+                return self._industry_index
+        thread.join()
+        return self._industry_index
+    
+    def wait_industry_index(self, timeout=None):
+        """等待后台的个股行业映射刷新完成，命令行运行结束前调用，刷新结果写入索引文件后再退出"""
+        thread = self._industry_index_thread
+        if thread is not None and thread.is_alive():
+            self.logger.info("等待个股行业映射刷新完成")
+            thread.join(timeout)
+    
+    def _refresh_industry_index_background(self, index):
+        """在新的索引对象上刷新，完成后替换正在使用的映射，使用中的映射不会被修改到一半"""
+        from industry_index import IndustryIndex
+        fresh = IndustryIndex(index.state_file)
+        self._refresh_industry_index(fresh)
+        with self._industry_index_lock:
+            if len(fresh):
+                self._industry_index = fresh
+            else:
+                # 重新加载索引文件失败时保留原有的映射，同样等待一段时间后再重试
+                index.failed_at = fresh.failed_at or datetime.now()
+    
+    def _refresh_industry_index(self, index):
+        """增量刷新个股到行业的映射，以行业资金流向中的公司家数判断哪些行业的成分股有变化"""
+        expected_counts = None
         try:
-            # 使用akshare获取申万一级行业列表
-            industry_df = ak.stock_board_industry_name_ths()
-            
-            # 检查返回的数据是否有效并包含行业名称信息
-            if industry_df is not None and not industry_df.empty:
-                # 根据akshare可能返回的不同列名进行处理
-                if 'industry_name' in industry_df.columns:
-                    return industry_df
-                elif '行业名称' in industry_df.columns:
-                    return industry_df.rename(columns={'行业名称': 'industry_name'})
-                elif '板块名称' in industry_df.columns:
-                    return industry_df.rename(columns={'板块名称': 'industry_name'})
-                elif len(industry_df.columns) > 0:
-                    first_col = industry_df.columns[0]
-                    self.logger.info(f"使用第一列 '{first_col}' 作为行业名称列")
-                    return industry_df.rename(columns={first_col: 'industry_name'})
+            # 与行业资金流向分析共用缓存，通常不需要再访问网络
+            flow = self._fetch('stock_fund_flow_industry', symbol=INDUSTRY_FLOW_SOURCES[0][1]['symbol'])
+            if flow is not None:
+                expected_counts = dict(zip(flow['行业名称'].astype(str), flow['公司家数']))
+        except Exception as e:
+            self.logger.warning(f"获取行业公司家数失败，只刷新新增和过久未更新的行业: {e}")
+        
+        # 已有概念板块时一并刷新
+        kinds = ('industry', 'concept') if (index.boards['类型'] == 'concept').any() else ('industry',)
+        try:
+            index.refresh(partial(self._fetch, use_cache=False), kinds=kinds, expected_counts=expected_counts)
+        except Exception as e:
+            self.logger.error(f"刷新个股行业映射失败，继续使用原有的映射: {e}")
+    
+    def _join_industry(self, df):
+        """把所属行业并入个股数据，映射不可用时原样返回"""
+        try:
+            index = self.industry_index
+            if len(index):
+                return index.join(df)
+        except Exception as e:
+            self.logger.warning(f"匹配个股所属行业失败: {e}")
+        return df
+    
+    def _save_dataset(self, dataset, df, csv_name=None, market='CN'):
+        """保存数据到历史数据存储，返回保存的文件路径列表
+        
+        Args:
+            dataset (str): 历史数据集名称
+            df (DataFrame): 要保存的数据
+            csv_name (str): CSV文件名前缀，开启export_csv或历史数据存储不可用时导出为按天的CSV文件
+            market (str): 数据所属市场，用于确定交易日
+        """
+        from data_cache import current_session
+        files = []
+        session, _ = current_session(market)
+        with metrics.span('save', dataset) as span:
+            span.rows = len(df)
+            try:
+                path = self.history.append(dataset, df, session)
+                if path:
+                    files.append(path)
+            except Exception as e:
+                self.logger.error(f"写入历史数据{dataset}失败: {e}")
             
-            self.logger.warning("返回的数据不符合预期，使用备用行业列表")
+            if csv_name and (self.export_csv or not files):
+                current_date = datetime.now().strftime('%Y%m%d')
+                csv_file = os.path.join(self.output_dir, f'{csv_name}_{current_date}.csv')
+                df.to_csv(csv_file, index=False, encoding='utf-8-sig')
+                self.logger.info(f"已保存数据到: {csv_file}")
+                files.append(csv_file)
+        return files
+    
+    def get_industry_list(self):
+        """获取同花顺行业列表（与行业资金流向数据的行业一致）"""
+        import pandas as pd
+        try:
+            industries = self.industry_index.industries
+            if len(industries):
+                return pd.DataFrame({"industry_name": industries['行业名称'], "industry_code": industries['行业代码']})
+            self.logger.warning("个股行业映射为空，使用备用行业列表")
         except Exception as e:
             self.logger.error(f"获取行业列表失败: {e}")
         
@@ -96,32 +324,144 @@ class StockAnalyzer:
         self.logger.info("开始行业资金流向分析")
         
         try:
-            # 尝试获取行业资金流向数据
-            try:
-                fund_flow_df = ak.stock_fund_flow_industry(symbol='即时')
-            except Exception as e:
-                # 如果即时数据失败，尝试获取5日数据
-                self.logger.warning(f"获取即时数据失败: {e}，尝试获取5日数据...")
-                try:
-                    fund_flow_df = ak.stock_fund_flow_industry(symbol='5日排行')
-                except Exception as e:
-                    self.logger.error(f"获取5日数据也失败: {e}")
-                    # 返回模拟数据用于演示
-                    self.logger.info("使用模拟数据进行演示")
-                    industries = ["医药生物", "食品饮料", "银行", "电子", "计算机", "化工", "有色金属", "房地产"]
-                    fund_flow_df = pd.DataFrame({
-                        '行业名称': industries,
-                        '净额': [20349116500, 18256267000, 9230667400, 7562184300, 6891453200, 5432871600, 4897562300, 4321987600]
-                    })
+            # 首选来源迟迟不返回时并行请求备用来源，取最先返回的有效数据
+            # 由个股资金流向汇总的数据作为行业接口的备用来源，stocks模式下优先使用
+            sources = list(INDUSTRY_FLOW_SOURCES)
+            sources.insert(0 if self.flow_mode == 'stocks' else 1, (STOCK_FLOW_SOURCE, self._aggregate_stock_flow))
+            source, fund_flow_df = self._hedged_fetch('stock_fund_flow_industry', sources,
+                                                      self._validate_industry_flow, self.hedge_delay)
+            if fund_flow_df is None:
+                # 返回模拟数据用于演示，报告中会标明
+                self.logger.error("所有行业资金流向数据来源均不可用，使用模拟数据进行演示")
+                import pandas as pd
+                source = MOCK_SOURCE
+                industries = ["医药生物", "食品饮料", "银行", "电子", "计算机", "化工", "有色金属", "房地产"]
+                fund_flow_df = pd.DataFrame({
+                    '行业名称': industries,
+                    '净额': [20349116500, 18256267000, 9230667400, 7562184300, 6891453200, 5432871600, 4897562300, 4321987600]
+                })
             
-            self.logger.info(f"成功获取{len(fund_flow_df)}个行业的资金流向数据")
-            return self._process_industry_flow_data(fund_flow_df)
+            self.logger.info(f"成功获取{len(fund_flow_df)}个行业的资金流向数据（来源: {source}）")
+            return self._process_industry_flow_data(fund_flow_df, source)
         except Exception as e:
             self.logger.error(f"行业资金流向分析过程中出错: {e}")
             return None
     
-    def _process_industry_flow_data(self, fund_flow_data):
-        """处理行业资金流向数据并生成分析结果"""
+    def _hedged_fetch(self, func_name, sources, validate, hedge_delay, timeout=None):
+        """按优先级对冲请求多个数据来源，返回最先得到的有效数据
+        
+        先请求首选来源，超过hedge_delay秒未返回或返回无效数据时请求下一个来源，已发出的请求继续等待。
+        取得有效数据后不再等待其余请求，未开始的请求被取消，已在运行的请求结果被忽略。
+        
+        Args:
+            func_name (str): akshare接口名
+            sources (list): [(来源名称, 接口参数或无参数的获取函数), ...]，按优先级排列
+            validate (callable): 校验并整理返回数据，无效时返回None
+            hedge_delay (float): 请求下一个来源前等待的秒数，为0时同时请求所有来源
+            timeout (float): 整体等待的最长时间（秒），为None时等到所有来源都返回
+        
+        Returns:
+            tuple: (来源名称, 数据)，所有来源都无效时返回(None, None)
+        """
+        executor = ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix="hedge")
+        priority = {name: i for i, (name, _) in enumerate(sources)}
+        futures = {}
+        launched = 0
+        deadline = time.time() + timeout if timeout else None
+        
+        def launch_next():
+            nonlocal launched
+            name, request = sources[launched]
+            fetch = request if callable(request) else partial(self._fetch, func_name, **request)
+            futures[executor.submit(fetch)] = name
+            launched += 1
+        
+        try:
+            launch_next()
+            while hedge_delay <= 0 and launched < len(sources):
+                launch_next()
+            
+            while futures:
+                wait_time = hedge_delay if launched < len(sources) else None
+                if deadline is not None:
+                    remaining = max(0, deadline - time.time())
+                    wait_time = remaining if wait_time is None else min(wait_time, remaining)
+                done, _ = wait(list(futures), timeout=wait_time, return_when=FIRST_COMPLETED)
+                
+                if not done:
+                    if deadline is not None and time.time() >= deadline:
+                        self.logger.error(f"{func_name} 所有数据来源在{timeout}秒内均未返回有效数据")
+                        break
+                    self.logger.warning(f"{func_name} {'、'.join(futures.values())}数据{hedge_delay}秒内未返回，"
+                                        f"并行请求{sources[launched][0]}数据")
+                    launch_next()
+                    continue
+                
+                # 同时完成时优先使用优先级高的来源
+                for future in sorted(done, key=lambda f: priority[futures[f]]):
+                    name = futures.pop(future)
+                    try:
+                        data = validate(future.result())
+                    except Exception as e:
+                        self.logger.warning(f"获取{name}数据失败: {e}")
+                        continue
+                    if data is not None:
+                        return name, data
+                    self.logger.warning(f"{name}数据未通过校验，已忽略")
+                
+                # 已返回的来源都无效时立即请求下一个来源
+                if launched < len(sources) and not futures:
+                    launch_next()
+            return None, None
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+    
+    def _aggregate_stock_flow(self):
+        """获取全市场个股资金流向，按行业汇总为行业资金流向（金额为亿元）"""
+        stock_flow = self._fetch('stock_individual_fund_flow_rank', indicator='今日')
+        if stock_flow is None or len(stock_flow) == 0:
+            return None
+        from stock_flow import aggregate_by_industry
+        index = self.industry_index
+        with metrics.span('process', 'industry_aggregate') as span:
+            span.rows = len(stock_flow)
+            return aggregate_by_industry(stock_flow, index)
+    
+    def _validate_industry_flow(self, fund_flow_data):
+        """校验行业资金流向数据，返回统一字段后的数据，没有可用的资金净额时返回None"""
+        import pandas as pd
+        if not isinstance(fund_flow_data, pd.DataFrame) or fund_flow_data.empty:
+            return None
+        fund_flow_data = self._normalize_industry_flow_columns(fund_flow_data)
+        if fund_flow_data is None or fund_flow_data['净额'].notna().sum() == 0:
+            return None
+        return fund_flow_data
+    
+    def _normalize_industry_flow_columns(self, fund_flow_data):
+        """把行业资金流向数据转换为统一字段（'行业名称'、'净额'等，金额单位为亿元），找不到资金流向列时返回None"""
+        import pandas as pd
+        from schema import conform
+        fund_flow_data = conform(fund_flow_data, 'industry_flow')
+        if fund_flow_data is None:
+            self.logger.error("找不到资金流向数据列")
+            return None
+        
+        if fund_flow_data['行业名称'].isna().all():
+            # 如果没有行业列，添加默认行业列
+            fund_flow_data['行业名称'] = pd.Categorical([f"行业{i}" for i in range(len(fund_flow_data))])
+        
+        return fund_flow_data
+    
+    def _process_industry_flow_data(self, fund_flow_data, source='即时'):
+        """处理行业资金流向数据并生成分析结果
+        
+        Args:
+            fund_flow_data (DataFrame): 行业资金流向数据
+            source (str): 数据来源，非即时数据会在推送消息中标明，模拟数据不写入历史数据存储
+        """
+        from screener import Screener
         if fund_flow_data is None or len(fund_flow_data) == 0:
             self.logger.error("没有可用的资金流向数据进行分析")
             return None
@@ -129,42 +469,41 @@ class StockAnalyzer:
         # 获取当前日期
         current_date = datetime.now().strftime('%Y%m%d')
         
-        # 确保有正确的列名
-        if '净额' not in fund_flow_data.columns:
-            # 尝试找到类似的列名
-            for col in fund_flow_data.columns:
-                if '净流入' in col or '净额' in col:
-                    fund_flow_data = fund_flow_data.rename(columns={col: '净额'})
-                    break
-            else:
-                self.logger.error("找不到资金流向数据列")
+        with metrics.span('process', 'industry_flow') as span:
+            span.rows = len(fund_flow_data)
+            # 确保有正确的列名
+            fund_flow_data = self._normalize_industry_flow_columns(fund_flow_data)
+            if fund_flow_data is None:
                 return None
-                
-        if '行业名称' not in fund_flow_data.columns:
-            # 尝试找到行业列
-            for col in fund_flow_data.columns:
-                if '行业' in col or '板块' in col:
-                    fund_flow_data = fund_flow_data.rename(columns={col: '行业名称'})
-                    break
-            else:
-                # 如果没有行业列，添加默认行业列
-                fund_flow_data['行业名称'] = [f"行业{i}" for i in range(len(fund_flow_data))]
-        
-        # 按资金净流入排序
-        df = fund_flow_data.sort_values(by='净额', ascending=False)
+            
+            df = fund_flow_data
+            df['数据来源'] = source
+            
+            # 只选择有数据的前10个行业
+            top_10 = Screener(df).top_k('净额', 10)
         
-      
+        # 保存数据到历史数据存储，模拟数据不保存
+        data_files = []
+        if source != MOCK_SOURCE:
+            data_files = self._save_dataset('industry_flow', df, 'industry_money_flow')
         
-        # 只选择有数据的前10个行业
-        top_10 = df.dropna(subset=['净额']).head(10)
+        # 多日趋势只使用每日净额，5日排行和模拟数据不参与
+        trend = None
+        if source == INDUSTRY_FLOW_SOURCES[0][0]:
+            with metrics.span('process', 'industry_trend') as span:
+                trend = self._update_industry_trend(df)
+                span.rows = len(trend) if trend is not None else 0
         
-        # 保存数据到CSV文件
-        csv_file = os.path.join(self.output_dir, f'industry_money_flow_{current_date}.csv')
-        df.to_csv(csv_file, index=False, encoding='utf-8-sig')
-        self.logger.info(f"已保存数据到: {csv_file}")
+        # 下钻到资金流入和流出最多的行业的成分股
+        drill = None
+        if self.drill_down > 0 and source != MOCK_SOURCE:
+            with metrics.span('process', 'drill_down') as span:
+                drill = self._drill_down_industries(df, self.drill_down)
+                span.rows = len(drill)
         
         # 创建推送消息
-        push_message = self._generate_industry_flow_message(df)
+        with metrics.span('message', 'industry_flow'):
+            push_message = self._generate_industry_flow_message(df, source, trend, drill)
         
         # 保存推送消息到文件
         push_file = os.path.join(self.output_dir, f'push_message_{current_date}.txt')
@@ -172,30 +511,175 @@ class StockAnalyzer:
             f.write(push_message)
         
         # 可视化
+        img_file = None
         try:
-            self._visualize_industry_flow(top_10, current_date)
+            img_file = self._visualize_industry_flow(top_10, current_date)
         except Exception as e:
             self.logger.error(f"生成可视化图表失败: {e}")
         
+        self._record_result('industry_flow', data=df, files=data_files + [push_file, img_file], source=source)
         return push_message
     
-    def _generate_industry_flow_message(self, df):
-        """生成行业资金流向的推送消息"""
+    def _update_industry_trend(self, df):
+        """把当日行业资金流向计入多日趋势，返回各行业的趋势和轮动指标，失败时返回None
+        
+        收盘后的数据滚入趋势矩阵并保存；盘中数据只作为临时的最后一天参与计算，不写入状态。
+        """
+        import pandas as pd
+        from data_cache import current_session
+        try:
+            session, is_open = current_session('CN')
+            engine = self.trend_engine
+            if engine.last_session is None and self.history.available:
+                # 趋势状态为空时，用历史数据存储中的每日净额初始化
+                end = (pd.Timestamp(session) - pd.Timedelta(days=1)) if is_open else None
+                history = self.history.read('industry_flow', end=end, columns=['行业名称', '净额', '数据来源'],
+                                            last_n=engine.window)
+                if len(history):
+                    # 只使用同花顺即时数据的净额，回填的东方财富主力净流入口径不同，不计入趋势
+                    history = history[history['数据来源'].isna()
+                                      | (history['数据来源'] == INDUSTRY_FLOW_SOURCES[0][0])]
+                days = engine.bootstrap(history)
+                if days:
+                    engine.save()
+                    self.logger.info(f"已用{days}个交易日的历史数据初始化行业资金流向趋势")
+            
+            if is_open:
+                return engine.compute(df, session)
+            if engine.update(df, session):
+                engine.save()
+            return engine.compute()
+        except Exception as e:
+            self.logger.error(f"计算行业资金流向趋势失败: {e}")
+            return None
+    
+    def _drill_down_industries(self, df, n, timeout=DRILL_DOWN_TIMEOUT):
+        """获取净流入最多和净流出最多的各n个行业的成分股和行情，找出各行业的主要贡献个股
+        
+        所有行业的成分股和全市场个股资金流向通过BoundedPool并发获取，每个站点的并发数受限，
+        总耗时约为最慢的一次请求，而不是逐个请求的耗时之和。超时或失败的行业不出现在结果中。
+        
+        Args:
+            df (DataFrame): 当日行业资金流向
+            n (int): 净流入和净流出方向各下钻的行业数
+            timeout (float): 等待所有请求的最长时间（秒）
+        
+        Returns:
+            dict: 行业名称 -> 主要贡献个股（'代码'、'名称'、'涨跌幅'、'主力净流入'），
+                净流入行业按主力净流入降序，净流出行业按升序
+        """
+        import pandas as pd
+        from screener import Screener
+        from volume_anomaly import normalize_codes
+        rankings = Screener(df).screen([('inflow', '净额', n), ('outflow', '净额', n, True)])
+        directions = {}
+        for direction, ranked in rankings.items():
+            for name in ranked['行业名称'].astype(str):
+                directions.setdefault(name, direction)
+        if not directions:
+            return {}
+        
+        drill = {}
+        with BoundedPool(thread_name_prefix="drill") as pool:
+            members = {name: pool.submit_call(self._fetch, 'stock_board_industry_cons_ths', symbol=name)
+                       for name in directions}
+            quotes = pool.submit_call(self._fetch, 'stock_individual_fund_flow_rank', indicator='今日')
+            done, not_done = wait(list(members.values()) + [quotes], timeout=timeout)
+            if not_done:
+                self.logger.warning(f"行业下钻有{len(not_done)}个请求超过{timeout}秒未返回，已跳过")
+            
+            stock_flow = None
+            if quotes in done and quotes.exception() is None and quotes.result() is not None:
+                stock_flow = quotes.result()
+                stock_flow = stock_flow.set_index(pd.Index(normalize_codes(stock_flow['代码'])))
+                stock_flow = stock_flow[~stock_flow.index.duplicated()]
+            elif quotes in done:
+                self.logger.warning(f"获取个股资金流向失败，行业下钻按成分股涨跌幅排序: {quotes.exception()}")
+            
+            for name, future in members.items():
+                if future not in done:
+                    continue
+                try:
+                    cons = future.result()
+                except Exception as e:
+                    self.logger.warning(f"获取行业{name}的成分股失败: {e}")
+                    continue
+                if cons is None or len(cons) == 0:
+                    continue
+                codes = pd.unique(normalize_codes(cons['代码']))
+                stocks = pd.DataFrame({'代码': codes})
+                if stock_flow is not None:
+                    matched = stock_flow.reindex(codes)
+                    stocks['名称'] = matched['名称'].to_numpy()
+                    stocks['涨跌幅'] = pd.to_numeric(matched['涨跌幅'], errors='coerce').to_numpy()
+                    stocks['主力净流入'] = pd.to_numeric(matched['主力净流入'], errors='coerce').to_numpy()
+                else:
+                    cons = cons.drop_duplicates('代码')
+                    stocks['名称'] = cons['名称'].to_numpy() if '名称' in cons.columns else None
+                    stocks['涨跌幅'] = (pd.to_numeric(cons['涨跌幅'], errors='coerce').to_numpy()
+                                       if '涨跌幅' in cons.columns else float('nan'))
+                    stocks['主力净流入'] = float('nan')
+                
+                key = '主力净流入' if stocks['主力净流入'].notna().any() else '涨跌幅'
+                contributors = Screener(stocks).top_k(key, DRILL_DOWN_CONTRIBUTORS,
+                                                      ascending=directions[name] == 'outflow')
+                if len(contributors):
+                    drill[name] = contributors.reset_index(drop=True)
+        return drill
+    
+    def _generate_industry_flow_message(self, df, source='即时', trend=None, drill=None):
+        """生成行业资金流向的推送消息，非即时数据在标题中标明来源
+        
+        Args:
+            df (DataFrame): 当日行业资金流向
+            source (str): 数据来源
+            trend (DataFrame): 各行业的多日趋势和轮动指标，见IndustryTrendEngine.compute，为None时不显示
+            drill (dict): 行业名称 -> 主要贡献个股，见_drill_down_industries，为None时不显示
+        """
+        from screener import Screener
+        from stock_flow import ORDER_SIZES
         current_date = datetime.now().strftime('%Y-%m-%d')
-        message = f"📊 {current_date} 行业资金流向分析\n\n"
+        source_label = ""
+        if source == MOCK_SOURCE:
+            source_label = f" ({MOCK_SOURCE})"
+        elif source != '即时':
+            source_label = f" ({source}数据)"
+        message = f"📊 {current_date} 行业资金流向分析{source_label}\n\n"
+        
+        # 一次选出净流入最多的5个和净流出最多的3个行业
+        rankings = Screener(df).screen([('inflow', '净额', 5), ('outflow', '净额', 3, True)])
+        
+        # 由个股资金流向汇总的数据附带按订单规模的拆分
+        has_sizes = '超大单净额' in df.columns and df['超大单净额'].notna().any()
+        
+        def flow_line(i, row):
+            line = f"{i}. {row.行业名称}: {row.净额:,.2f}亿元"
+            if has_sizes:
+                line += f" (超大单{row.超大单净额:+,.2f} 大单{row.大单净额:+,.2f})"
+            line += "\n"
+            contributors = drill.get(str(row.行业名称)) if drill else None
+            if contributors is not None:
+                line += "   ↳ " + "、".join(self._contributor_label(stock) for stock in contributors.itertuples()) + "\n"
+            return line
         
         # 添加前5个行业
         message += "🔥 资金流入最多的5个行业:\n"
-        for i, row in enumerate(df.head(5).itertuples(), 1):
-            message += f"{i}. {row.行业名称}: {row.净额:,.2f}亿元\n"
+        for i, row in enumerate(rankings['inflow'].itertuples(), 1):
+            message += flow_line(i, row)
         
         message += "\n📉 资金流出最多的3个行业:\n"
-        for i, row in enumerate(df.tail(3).itertuples(), 1):
-            message += f"{i}. {row.行业名称}: {row.净额:,.2f}亿元\n"
+        for i, row in enumerate(rankings['outflow'].itertuples(), 1):
+            message += flow_line(i, row)
         
         # 计算总资金流入
         total_flow = df['净额'].sum()
         message += f"\n📊 市场总资金流向: {total_flow:,.2f}亿元\n"
+        if has_sizes:
+            message += "💰 按订单规模: " + " | ".join(
+                f"{size} {df[f'{size}净额'].sum():+,.2f}亿元" for size in ORDER_SIZES) + "\n"
+        
+        if trend is not None and trend['历史天数'].max() > 1:
+            message += self._generate_industry_trend_message(trend)
         
         # 添加建议
         if total_flow > 0:
@@ -203,6 +687,56 @@ class StockAnalyzer:
         else:
             message += "\n💡 市场资金整体流出，空头力量占优"
         
+        if source == MOCK_SOURCE:
+            message += "\n💡 注意：当前为模拟数据，所有行业资金流向数据来源均不可用"
+        
+        return message
+    
+    @staticmethod
+    def _contributor_label(stock):
+        """行业下钻中一只贡献个股的显示文本：名称、涨跌幅和主力净流入（亿元）"""
+        import pandas as pd
+        label = str(stock.名称 if isinstance(stock.名称, str) else stock.代码)
+        if pd.notna(stock.涨跌幅):
+            label += f" {stock.涨跌幅:+.2f}%"
+        if pd.notna(stock.主力净流入):
+            label += f" 主力{stock.主力净流入 / 1e8:+,.2f}亿"
+        return label
+    
+    def _generate_industry_trend_message(self, trend):
+        """生成行业资金流向多日趋势和轮动部分的消息"""
+        from screener import Screener
+        from industry_trend import SHORT_WINDOW
+        short_column = f'{SHORT_WINDOW}日累计'
+        days = int(trend['历史天数'].max())
+        rankings = Screener(trend).screen([
+            ('inflow', short_column, 3),
+            ('outflow', short_column, 3, True),
+            ('rising', '排名动量', 3),
+            ('jump', '排名变化', 3),
+        ])
+        
+        message = f"\n🔄 行业轮动（近{days}个交易日）:\n"
+        message += f"{SHORT_WINDOW}日累计流入: " + "、".join(
+            f"{row.行业名称}({row[short_column]:+,.1f}亿)" for _, row in rankings['inflow'].iterrows()) + "\n"
+        message += f"{SHORT_WINDOW}日累计流出: " + "、".join(
+            f"{row.行业名称}({row[short_column]:+,.1f}亿)" for _, row in rankings['outflow'].iterrows()) + "\n"
+        
+        rising = rankings['rising'][rankings['rising']['排名动量'] > 0]
+        if len(rising):
+            message += f"{SHORT_WINDOW}日排名上升: " + "、".join(
+                f"{row.行业名称}(↑{row.排名动量:.0f}位至第{row[f'{SHORT_WINDOW}日累计排名']:.0f})"
+                for _, row in rising.iterrows()) + "\n"
+        jump = rankings['jump'][rankings['jump']['排名变化'] > 0]
+        if len(jump):
+            message += "较上一交易日排名上升: " + "、".join(
+                f"{row.行业名称}(↑{row.排名变化:.0f}位至第{row.排名:.0f})" for _, row in jump.iterrows()) + "\n"
+        
+        # 当日净额相对自身历史显著偏离的行业
+        unusual = Screener(trend.assign(偏离=trend['净额Z值'].abs())).top_k('偏离', 3, where="`偏离` >= 2")
+        if len(unusual):
+            message += "资金异动: " + "、".join(
+                f"{row.行业名称}({row.净额:+,.1f}亿, Z值{row.净额Z值:+.1f})" for _, row in unusual.iterrows()) + "\n"
         return message
     
     def _visualize_industry_flow(self, top_10, current_date):
@@ -232,46 +766,119 @@ class StockAnalyzer:
         # plt.savefig(img_file, dpi=300, bbox_inches='tight')
         # self.logger.info(f"已保存可视化图表: {img_file}")
         # plt.close()
+        # return img_file
+        return None
     
     def analyze_abnormal_volume(self):
         """个股异常成交量分析"""
         self.logger.info("开始个股异常成交量分析")
         
         try:
+            from data_cache import current_session
+            from screener import Screener
+            from volume_anomaly import trading_fraction
+            
             # 获取A股股票列表
-            stock_list = ak.stock_zh_a_spot()
+            stock_list = self._fetch('stock_zh_a_spot')
             self.logger.info(f"获取到{len(stock_list)}只A股股票数据")
             
-            # 筛选出成交量异常的股票（这里简单以成交量排名前20作为异常）
-            abnormal_stocks = stock_list.sort_values(by='成交量', ascending=False).head(20)
+            # 按个股自身历史基线评分，筛选出成交量异常放大的股票
+            with metrics.span('process', 'abnormal_volume') as span:
+                span.rows = len(stock_list)
+                session, is_open = current_session('CN')
+                self._ensure_volume_baseline(session, is_open)
+                abnormal_stocks = self.volume_engine.detect(stock_list, fraction=trading_fraction() if is_open else 1.0)
+                if abnormal_stocks is None:
+                    # 尚无足够的历史基线时，以成交量排名前20作为异常
+                    self.logger.warning("成交量基线不足，暂以成交量排名前20作为异常")
+                    abnormal_stocks = Screener(stock_list).top_k('成交量', 20)
+                abnormal_stocks = self._join_industry(abnormal_stocks)
+            
+            # 收盘后的全市场快照滚入成交量基线并写入历史数据存储
+            if not is_open:
+                self._roll_volume_baseline(stock_list, session)
             
             # 获取当前日期
             current_date = datetime.now().strftime('%Y%m%d')
             
-            # 保存数据到CSV文件
-            csv_file = os.path.join(self.output_dir, f'abnormal_volume_stocks_{current_date}.csv')
-            abnormal_stocks.to_csv(csv_file, index=False, encoding='utf-8-sig')
-            self.logger.info(f"已保存异常成交量股票数据到: {csv_file}")
+            # 保存异常成交量股票到历史数据存储
+            data_files = self._save_dataset('abnormal_volume', abnormal_stocks, 'abnormal_volume_stocks')
             
             # 创建推送消息
-            push_message = self._generate_abnormal_volume_message(abnormal_stocks)
-            
-            # 可视化
-            try:
-                self._visualize_abnormal_volume(abnormal_stocks, current_date)
-            except Exception as e:
-                self.logger.error(f"生成异常成交量可视化图表失败: {e}")
+            with metrics.span('message', 'abnormal_volume'):
+                push_message = self._generate_abnormal_volume_message(abnormal_stocks)
             
+            # 可视化在后台渲染，完成后图片路径计入结果
+            self._record_result('abnormal_volume', data=abnormal_stocks, files=data_files)
+            self._render_chart('abnormal_volume', 'abnormal_volume', abnormal_stocks,
+                               f'abnormal_volume_{current_date}.png', current_date)
             return push_message
         except Exception as e:
             self.logger.error(f"个股异常成交量分析过程中出错: {e}")
             return None
     
+    def _roll_volume_baseline(self, stock_list, session):
+        """把收盘后的全市场快照滚入成交量基线，并保存到历史数据存储
+        
+        盘中的快照成交量不完整，既不滚入基线也不写入历史数据存储，
+        否则用历史快照初始化基线时会混入不完整的交易日，量比偏高。
+        """
+        if self.volume_engine.update(stock_list, session):
+            self.volume_engine.save()
+            self.logger.info(f"已把{session}的收盘快照滚入成交量基线")
+        self._save_dataset('a_spot', stock_list)
+    
+    def update_volume_baseline(self):
+        """收盘后获取全市场快照并滚入成交量基线，不做异常分析和推送，供收盘后的定时任务调用
+        
+        Returns:
+            bool: 是否已更新，交易时间内或获取数据失败时返回False
+        """
+        from data_cache import current_session
+        session, is_open = current_session('CN')
+        if is_open:
+            self.logger.warning(f"{session}尚未收盘，快照不完整，不更新成交量基线")
+            return False
+        try:
+            stock_list = self._fetch('stock_zh_a_spot')
+            self._ensure_volume_baseline(session, is_open)
+            self._roll_volume_baseline(stock_list, session)
+            return True
+        except Exception as e:
+            self.logger.error(f"更新成交量基线失败: {e}")
+            return False
+    
+    def _ensure_volume_baseline(self, session, is_open):
+        """成交量基线为空时，用历史数据存储中的全市场快照初始化基线"""
+        import pandas as pd
+        if self.volume_engine.last_session is not None or not self.history.available:
+            return
+        # 盘中运行时当日快照尚不完整，不计入基线
+        end = (pd.Timestamp(session) - pd.Timedelta(days=1)) if is_open else None
+        history = self.history.read('a_spot', end=end, columns=['代码', '成交量', '成交额'],
+                                    last_n=self.volume_engine.window)
+        days = self.volume_engine.bootstrap(history)
+        if days:
+            self.volume_engine.save()
+            self.logger.info(f"已用{days}个交易日的历史快照初始化成交量基线")
+    
     def _generate_abnormal_volume_message(self, abnormal_stocks):
         """生成个股异常成交量的推送消息"""
         current_date = datetime.now().strftime('%Y-%m-%d')
         message = f"📊 {current_date} 个股异常成交量分析\n\n"
         
+        # 有历史基线时按量比列出异常放大的股票
+        if '量比' in abnormal_stocks.columns:
+            message += f"🔥 成交量相对自身{self.volume_engine.window}日均量异常放大的股票:\n"
+            if len(abnormal_stocks) == 0:
+                message += "今日没有成交量显著异常放大的股票\n"
+            for i, row in enumerate(abnormal_stocks.head(10).itertuples(), 1):
+                message += (f"{i}. {row.名称}{self._industry_label(row)}: 量比{row.量比:.2f}倍, "
+                            f"{row.成交量 / 1000000:,.2f}万手 (涨跌幅: {row.涨跌幅:.2f}%)\n")
+            message += self._industry_distribution(abnormal_stocks)
+            message += "\n💡 成交量异常放大通常意味着市场对该股票关注度提升，可能存在重要的基本面或技术面变化"
+            return message
+        
         # 添加成交量最大的10只股票
         message += "🔥 成交量最大的10只股票:\n"
         
@@ -281,10 +888,11 @@ class StockAnalyzer:
                 # 检查是否可以获取涨跌幅信息
                 pct_chg = getattr(row, '涨跌幅', 'N/A')
                 volume = row.成交量
-                message += f"{i}. {row.名称}: {volume / 1000000:,.2f}万手"
+                message += f"{i}. {row.名称}{self._industry_label(row)}: {volume / 1000000:,.2f}万手"
                 if pct_chg != 'N/A':
                     message += f" (涨跌幅: {pct_chg:.2f}%)"
                 message += "\n"
+            message += self._industry_distribution(abnormal_stocks)
         else:
             self.logger.warning("数据列不完整，无法生成详细的异常成交量消息")
             message += "数据列不完整，无法显示详细信息\n"
@@ -293,40 +901,22 @@ class StockAnalyzer:
         
         return message
     
-    def _visualize_abnormal_volume(self, abnormal_stocks, current_date):
-        """可视化个股异常成交量数据"""
-        plt.figure(figsize=(12, 8))
-        
-        # 确保数据有需要的列
-        if '名称' in abnormal_stocks.columns and '成交量' in abnormal_stocks.columns:
-            # 只取前15只股票进行可视化
-            top_stocks = abnormal_stocks.head(15)
-            
-            # 创建水平条形图
-            bars = plt.barh(top_stocks['名称'], top_stocks['成交量'])
-            
-            # 为条形图添加数值标签
-            for bar in bars:
-                width = bar.get_width()
-                plt.text(width + 0.5, bar.get_y() + bar.get_height()/2, f'{width:,.0f}', 
-                         ha='left', va='center', fontsize=10)
-            
-            # 设置图表标题和标签
-            plt.title(f'{current_date} 个股成交量排名（前15名）', fontsize=14)
-            plt.xlabel('成交量（万手）', fontsize=12)
-            plt.ylabel('股票名称', fontsize=12)
-            
-            # 美化图表
-            plt.grid(axis='x', linestyle='--', alpha=0.7)
-            plt.tight_layout()
-            
-            # 保存图表
-            img_file = os.path.join(self.output_dir, f'abnormal_volume_{current_date}.png')
-            plt.savefig(img_file, dpi=300, bbox_inches='tight')
-            self.logger.info(f"已保存异常成交量可视化图表: {img_file}")
-            plt.close()
-        else:
-            self.logger.error("数据列不完整，无法生成异常成交量可视化图表")
+    @staticmethod
+    def _industry_label(row):
+        """个股所属行业的标注，如'[半导体]'，行业未知时为空"""
+        industry = getattr(row, '行业名称', None)
+        return f"[{industry}]" if isinstance(industry, str) else ""
+    
+    @staticmethod
+    def _industry_distribution(stocks, top_n=5):
+        """异常股票集中的行业，如'板块分布: 半导体(3只)、银行(2只)'，没有行业信息时为空"""
+        if '行业名称' not in stocks.columns:
+            return ""
+        counts = stocks['行业名称'].value_counts()
+        counts = counts[counts > 0].head(top_n)
+        if len(counts) == 0:
+            return ""
+        return "\n🏭 板块分布: " + "、".join(f"{name}({count}只)" for name, count in counts.items()) + "\n"
     
     def analyze_us_stock_industry_flow(self):
         """美股行业资金分析"""
@@ -337,26 +927,23 @@ class StockAnalyzer:
             # 注意：AKShare可能没有直接的美股行业资金流向接口，这里使用变通方法
             
             # 获取道琼斯行业分类指数
-            dow_sectors = ak.stock_us_dji_spot()
+            dow_sectors = self._fetch('stock_us_dji_spot', market='US')
             self.logger.info(f"获取到{len(dow_sectors)}个道琼斯行业指数数据")
             
             # 获取当前日期
             current_date = datetime.now().strftime('%Y%m%d')
             
-            # 保存数据到CSV文件
-            csv_file = os.path.join(self.output_dir, f'us_stock_sectors_{current_date}.csv')
-            dow_sectors.to_csv(csv_file, index=False, encoding='utf-8-sig')
-            self.logger.info(f"已保存美股行业数据到: {csv_file}")
+            # 保存数据到历史数据存储
+            data_files = self._save_dataset('us_sectors', dow_sectors, 'us_stock_sectors', market='US')
             
             # 创建推送消息
-            push_message = self._generate_us_stock_message(dow_sectors)
-            
-            # 可视化
-            try:
-                self._visualize_us_stock_sectors(dow_sectors, current_date)
-            except Exception as e:
-                self.logger.error(f"生成美股行业可视化图表失败: {e}")
+            with metrics.span('message', 'us_stock'):
+                push_message = self._generate_us_stock_message(dow_sectors)
             
+            # 可视化在后台渲染，完成后图片路径计入结果
+            self._record_result('us_stock', data=dow_sectors, files=data_files)
+            self._render_chart('us_stock', 'us_sectors', dow_sectors,
+                               f'us_stock_sectors_{current_date}.png', current_date)
             return push_message
         except Exception as e:
             self.logger.error(f"美股行业资金分析过程中出错: {e}")
@@ -370,12 +957,13 @@ class StockAnalyzer:
         
         # 尝试获取涨跌幅数据
         if '涨跌幅' in dow_sectors.columns:
-            # 按涨跌幅排序
-            sorted_sectors = dow_sectors.sort_values(by='涨跌幅', ascending=False)
+            from screener import Screener
+            # 一次选出涨幅最大的5个和跌幅最大的3个行业
+            rankings = Screener(dow_sectors).screen([('gainers', '涨跌幅', 5), ('losers', '涨跌幅', 3, True)])
             
             # 添加涨幅最大的5个行业
             message += "🔥 涨幅最大的5个行业:\n"
-            for i, row in enumerate(sorted_sectors.head(5).itertuples(), 1):
+            for i, row in enumerate(rankings['gainers'].itertuples(), 1):
                 if hasattr(row, '名称'):
                     message += f"{i}. {row.名称}: {row.涨跌幅:.2f}%\n"
                 elif hasattr(row, '指数名称'):
@@ -383,7 +971,7 @@ class StockAnalyzer:
             
             # 添加跌幅最大的3个行业
             message += "\n📉 跌幅最大的3个行业:\n"
-            for i, row in enumerate(sorted_sectors.tail(3).itertuples(), 1):
+            for i, row in enumerate(rankings['losers'].itertuples(), 1):
                 if hasattr(row, '名称'):
                     message += f"{i}. {row.名称}: {row.涨跌幅:.2f}%\n"
                 elif hasattr(row, '指数名称'):
@@ -430,58 +1018,98 @@ class StockAnalyzer:
         
         return message
     
-    def _visualize_us_stock_sectors(self, dow_sectors, current_date):
-        """可视化美股行业数据"""
-        plt.figure(figsize=(12, 8))
+    def _render_chart(self, name, kind, data, img_file, current_date):
+        """提交后台渲染任务，图表生成后把图片路径计入提交时那次运行的结果"""
+        results = self._current_results()
         
-        # 尝试获取涨跌幅和行业名称数据
-        if '涨跌幅' in dow_sectors.columns:
-            # 按涨跌幅排序
-            sorted_sectors = dow_sectors.sort_values(by='涨跌幅', ascending=False)
-            
-            # 获取行业名称
-            if '名称' in sorted_sectors.columns:
-                names = sorted_sectors['名称']
-            elif '指数名称' in sorted_sectors.columns:
-                names = sorted_sectors['指数名称']
-            else:
-                names = [f"行业{i}" for i in range(len(sorted_sectors))]
-            
-            # 创建条形图
-            colors = ['green' if x > 0 else 'red' for x in sorted_sectors['涨跌幅']]
-            bars = plt.bar(names, sorted_sectors['涨跌幅'], color=colors)
-            
-            # 为条形图添加数值标签
-            for bar in bars:
-                height = bar.get_height()
-                plt.text(bar.get_x() + bar.get_width()/2., height, f'{height:.2f}%', 
-                         ha='center', va='bottom' if height > 0 else 'top', fontsize=9)
-            
-            # 设置图表标题和标签
-            plt.title(f'{current_date} 美股行业涨跌幅表现', fontsize=14)
-            plt.xlabel('行业', fontsize=12)
-            plt.ylabel('涨跌幅 (%)', fontsize=12)
-            
-            # 旋转x轴标签以避免重叠
-            plt.xticks(rotation=45, ha='right')
-            
-            # 添加水平线表示0值
-            plt.axhline(y=0, color='black', linestyle='-', alpha=0.3)
-            
-            # 美化图表
-            plt.grid(axis='y', linestyle='--', alpha=0.7)
-            plt.tight_layout()
-            
-            # 保存图表
-            img_file = os.path.join(self.output_dir, f'us_stock_sectors_{current_date}.png')
-            plt.savefig(img_file, dpi=300, bbox_inches='tight')
-            self.logger.info(f"已保存美股行业可视化图表: {img_file}")
-            plt.close()
-        else:
-            self.logger.error("数据列不完整，无法生成美股行业可视化图表")
+        def on_done(future):
+            if future.result():
+                self._record_result(name, files=[future.result()], results=results)
+        self.charts.submit(kind, data, img_file, current_date).add_done_callback(on_done)
+    
+    def _current_results(self):
+        """返回当前线程所属运行的结果字典，不在分析线程中时为最近一次运行的结果"""
+        results = getattr(self._run_local, 'results', None)
+        return self.results if results is None else results
     
-    def run_analysis(self, analysis_types=None):
-        """运行指定类型的分析
+    def _record_result(self, name, data=None, files=None, source=None, results=None):
+        """记录分析的结构化结果（数据、数据来源和输出文件），供进程内调用方直接使用
+        
+        Args:
+            results (dict): 写入的结果字典，为None时写入当前线程所属运行的结果
+        """
+        results = self._current_results() if results is None else results
+        result = results.setdefault(name, {'message': None, 'data': None, 'files': []})
+        if data is not None:
+            result['data'] = data
+        if source is not None:
+            result['source'] = source
+        if files:
+            result['files'].extend(f for f in files if f)
+    
+    def _run_single_analysis(self, name, method_name, results):
+        """运行单个分析并隔离其异常，返回推送消息，结果写入所属运行的results"""
+        start_time = time.time()
+        self._run_local.results = results
+        try:
+            with metrics.span('analysis', name) as span:
+                try:
+                    message = getattr(self, method_name)()
+                except Exception as e:
+                    self.logger.error(f"{name} 分析运行异常: {e}")
+                    message = None
+                if message is None:
+                    span.status = 'error'
+        finally:
+            self._run_local.results = None
+        elapsed = time.time() - start_time
+        self.logger.info(f"{name} 分析耗时: {elapsed:.2f}秒")
+        
+        result = results.setdefault(name, {'message': None, 'data': None, 'files': []})
+        result['message'] = message
+        result['elapsed'] = elapsed
+        return message
+    
+    def _run_analysis_tasks(self, tasks, results, workers=None, timeout=None):
+        """运行分析任务列表，按任务顺序返回各分析的消息，结构化结果写入results
+        
+        workers为1或只有一个任务时在当前线程顺序执行，否则使用有界线程池并发执行。
+        超时未完成的分析返回None，不会阻塞其他分析的结果。
+        """
+        if not tasks:
+            return []
+        
+        if workers is None:
+            workers = len(tasks)
+        workers = max(1, min(workers, len(tasks)))
+        
+        if workers == 1:
+            return [self._run_single_analysis(name, method_name, results) for name, method_name in tasks]
+        
+        self.logger.info(f"使用{workers}个线程并发运行{len(tasks)}个分析")
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analysis")
+        futures = [executor.submit(self._run_single_analysis, name, method_name, results)
+                   for name, method_name in tasks]
+        deadline = time.time() + timeout if timeout else None
+        
+        messages = []
+        try:
+            for (name, _), future in zip(tasks, futures):
+                remaining = None if deadline is None else max(0, deadline - time.time())
+                try:
+                    messages.append(future.result(timeout=remaining))
+                except FuturesTimeoutError:
+                    future.cancel()
+                    self.logger.error(f"{name} 分析超时（{timeout}秒），本次报告不包含该部分")
+                    messages.append(None)
+        finally:
+            # 不等待超时的分析线程结束，避免拖慢整体报告
+            executor.shutdown(wait=False)
+        
+        return messages
+    
+    def run_analysis_report(self, analysis_types=None, workers=None, timeout=None, notify=True):
+        """运行指定类型的分析并返回结构化结果
         
         Args:
             analysis_types (list): 要运行的分析类型列表，可选值包括：
@@ -489,53 +1117,65 @@ class StockAnalyzer:
                 'abnormal_volume': 个股异常成交量分析
                 'us_stock': 美股行业分析
                 如果为None，则运行所有分析
+            workers (int): 并发线程数，为None时使用初始化时的设置
+            timeout (float): 等待全部分析完成的最长时间（秒），超时的分析不计入报告
+            notify (bool): 是否发送通知，由调用方自行推送时设为False
+        
+        Returns:
+            dict: 包含title、message（合并后的报告，全部失败时为None）和results的字典，
+                results按分析类型记录message、data（DataFrame）、files（输出文件路径列表）和elapsed
         """
         if analysis_types is None:
             analysis_types = ['industry_flow', 'abnormal_volume', 'us_stock']
         
-        all_messages = []
-        
-        # 运行行业资金流向分析
-        if 'industry_flow' in analysis_types:
-            industry_message = self.analyze_industry_money_flow()
-            if industry_message:
-                all_messages.append(industry_message)
+        # 每次运行使用新的结果字典，上一次运行较晚完成的图表和超时的分析只写入上一次的结果
+        results = self.results = {}
+        tasks = [(name, method) for name, method in self.ANALYSIS_METHODS if name in analysis_types]
+        messages = self._run_analysis_tasks(tasks, results, workers or self.workers, timeout)
         
-        # 运行个股异常成交量分析
-        if 'abnormal_volume' in analysis_types:
-            volume_message = self.analyze_abnormal_volume()
-            if volume_message:
-                all_messages.append(volume_message)
-        
-        # 运行美股行业分析
-        if 'us_stock' in analysis_types:
-            us_stock_message = self.analyze_us_stock_industry_flow()
-            if us_stock_message:
-                all_messages.append(us_stock_message)
+        # 按固定顺序收集各分析的消息，失败的分析不影响其他分析
+        all_messages = [message for message in messages if message]
+        self.logger.info(f"数据缓存统计: {self.cache.stats()}")
+        report = {
+            'title': None,
+            'message': None,
+            'results': {name: results[name] for name, _ in tasks if name in results},
+        }
         
         # 合并所有消息并发送通知
         if all_messages:
             # 如果有多个消息，合并它们
             if len(all_messages) > 1:
-                combined_message = "\n\n".join(all_messages)
-                title = f"📊 股票市场综合分析报告 ({datetime.now().strftime('%Y-%m-%d')})"
+                report['message'] = "\n\n".join(all_messages)
+                report['title'] = f"📊 股票市场综合分析报告 ({datetime.now().strftime('%Y-%m-%d')})"
             else:
-                combined_message = all_messages[0]
-                title = f"📊 股票市场分析报告 ({datetime.now().strftime('%Y-%m-%d')})"
+                report['message'] = all_messages[0]
+                report['title'] = f"📊 股票市场分析报告 ({datetime.now().strftime('%Y-%m-%d')})"
+            
+            # 保存合并报告，供结果服务（result_service.py）提供查询
+            report_file = os.path.join(self.output_dir, f"report_{datetime.now().strftime('%Y%m%d')}.txt")
+            try:
+                with open(report_file, 'w', encoding='utf-8') as f:
+                    f.write(f"{report['title']}\n\n{report['message']}")
+            except Exception as e:
+                self.logger.error(f"保存合并报告失败: {e}")
             
-            # 发送通知
-            self.notification_sender.send_notification(title, combined_message)
-            return combined_message
+            # 发送通知，录制和回放的报告不推送给订阅者
+            if notify and self.provider.mode != 'live':
+                self.logger.info(f"{self.provider.mode}模式不发送通知")
+            elif notify:
+                self.notification_sender.send_notification(report['title'], report['message'])
         
-        return None
+        return report
+    
+    def run_analysis(self, analysis_types=None, workers=None, timeout=None, notify=True):
+        """运行指定类型的分析，返回合并后的报告文本，参数同run_analysis_report"""
+        return self.run_analysis_report(analysis_types, workers, timeout, notify)['message']
 
 # 主函数
 if __name__ == "__main__":
     print("===== 股票市场综合分析程序 ======")
     
-    # 创建分析器实例
-    analyzer = StockAnalyzer()
-    
     # 解析命令行参数
     import argparse
     parser = argparse.ArgumentParser(description='股票市场综合分析工具')
@@ -543,9 +1183,32 @@ if __name__ == "__main__":
     parser.add_argument('--industry', action='store_true', help='仅运行行业资金流向分析')
     parser.add_argument('--volume', action='store_true', help='仅运行个股异常成交量分析')
     parser.add_argument('--us', action='store_true', help='仅运行美股行业分析')
+    parser.add_argument('--workers', type=int, default=None, help='并发运行分析的线程数，1表示顺序执行（默认每个分析一个线程）')
+    parser.add_argument('--timeout', type=float, default=None, help='等待全部分析完成的最长时间（秒）')
+    parser.add_argument('--no-notify', action='store_true', help='不发送通知，仅输出报告')
+    parser.add_argument('--no-cache', action='store_true', help='不使用本地数据缓存，强制重新获取数据')
+    parser.add_argument('--csv', action='store_true', help='同时导出按天的CSV文件到output目录')
+    parser.add_argument('--hedge-delay', type=float, default=5.0,
+                        help='行业资金流向首选数据来源超过该秒数未返回时并行请求备用来源，0表示同时请求（默认5）')
+    parser.add_argument('--flow-mode', choices=FLOW_MODES, default='industry',
+                        help='行业资金流向的获取方式：industry优先使用行业接口，stocks优先由个股资金流向按行业汇总（默认industry）')
+    parser.add_argument('--drill-down', type=int, default=0, metavar='N',
+                        help='对净流入和净流出最多的各N个行业获取成分股，在报告中列出主要贡献个股（默认0不下钻）')
+    parser.add_argument('--startup-profile', action='store_true', help='统计启动及各按需导入模块的导入耗时后退出')
+    add_provider_arguments(parser)
     
     args = parser.parse_args()
     
+    if args.startup_profile:
+        from startup_profile import print_startup_profile, LAZY_MODULES
+        print_startup_profile("stock_analysis", LAZY_MODULES)
+        sys.exit(0)
+    
+    # 创建分析器实例
+    analyzer = StockAnalyzer(workers=args.workers, use_cache=not args.no_cache, export_csv=args.csv,
+                             provider=DataProvider(**provider_config(args)), hedge_delay=args.hedge_delay,
+                             flow_mode=args.flow_mode, drill_down=args.drill_down)
+    
     # 确定要运行的分析类型
     analysis_types = []
     if args.all or (not args.industry and not args.volume and not args.us):
@@ -561,7 +1224,7 @@ if __name__ == "__main__":
     
     # 运行分析
     print(f"开始运行分析: {analysis_types or '所有分析'}")
-    message = analyzer.run_analysis(analysis_types)
+    message = analyzer.run_analysis(analysis_types, timeout=args.timeout, notify=not args.no_notify)
     
     if message:
         print("\n分析报告:\n")
@@ -569,4 +1232,9 @@ if __name__ == "__main__":
     else:
         print("分析失败，未能生成报告")
     
-    print("\n===== 程序执行完毕 =====")
\ No newline at end of file
+    # 报告和通知已发出，等待后台图表渲染和个股行业映射刷新完成后退出
+    analyzer.charts.wait()
+    analyzer.wait_industry_index()
+    metrics.recorder.write_textfile()
+    
+    print("\n===== 程序执行完毕 =====")
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+# 个股资金流向的订单规模，主力为超大单与大单之和
+ORDER_SIZES = ['超大单', '大单', '中单', '小单']
+
+def aggregate_by_industry(stock_flow, index):
+    """把个股资金流向按行业汇总，并按订单规模拆分
+    
+    所有股票先转换为整数行业编号，每个指标只做一次np.bincount，全市场汇总为O(股票数)。
+    
+    Args:
+        stock_flow (DataFrame): 个股资金流向，统一字段见schema.SOURCE_SCHEMAS['stock_flow']（金额为元）
+        index (IndustryIndex): 个股到行业的映射
+    
+    Returns:
+        DataFrame: 每个行业一行，'净额'为主力净流入，'超大单净额'等为各类订单的净流入（亿元），
+            另有'公司家数'、'涨跌幅'（成分股平均）、'领涨股'和'领涨股涨跌幅'；没有可归属行业的股票时返回None
+    """
+    ids = index.lookup(stock_flow['代码'])
+    known = ids >= 0
+    if not known.any():
+        return None
+    ids = ids[known]
+    n_industries = len(index.industries)
+    
+    def total(column):
+        values = pd.to_numeric(stock_flow[column], errors='coerce').to_numpy(dtype=float)[known]
+        values = np.nan_to_num(values)
+        return np.bincount(ids, weights=values, minlength=n_industries)
+    
+    counts = np.bincount(ids, minlength=n_industries)
+    pct = pd.to_numeric(stock_flow['涨跌幅'], errors='coerce').to_numpy(dtype=float)[known]
+    pct_valid = ~np.isnan(pct)
+    pct_sum = np.bincount(ids[pct_valid], weights=pct[pct_valid], minlength=n_industries)
+    pct_count = np.bincount(ids[pct_valid], minlength=n_industries)
+    
+    # 各行业涨幅最大的股票：按(行业, 涨跌幅)排序后取每个行业的最后一行
+    leader_name = np.full(n_industries, None, dtype=object)
+    leader_pct = np.full(n_industries, np.nan)
+    if pct_valid.any():
+        candidates = np.flatnonzero(pct_valid)
+        order = candidates[np.lexsort((pct[candidates], ids[candidates]))]
+        last = np.r_[ids[order][1:] != ids[order][:-1], True]
+        names = stock_flow['名称'].astype(object).to_numpy()[known]
+        leader_name[ids[order][last]] = names[order][last]
+        leader_pct[ids[order][last]] = pct[order][last]
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = pd.DataFrame({
+            '行业名称': index.industry_names,
+            '涨跌幅': pct_sum / pct_count,
+            '净额': total('主力净流入') / 1e8,
+            '公司家数': counts,
+            '领涨股': leader_name,
+            '领涨股涨跌幅': leader_pct,
+        })
+    for size in ORDER_SIZES:
+        result[f'{size}净额'] = total(f'{size}净流入') / 1e8
+    # 没有成分股出现在快照中的行业不参与排名
+    return result[counts > 0].reset_index(drop=True)
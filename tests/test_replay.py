@@ -0,0 +1,117 @@
+import os
+import sys
+import tempfile
+import unittest
+from datetime import date, timedelta
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trading_calendar
+from data_provider import DataProvider
+from stock_analysis import StockAnalyzer, SANDBOX_DIR
+
+INDUSTRIES = [f"行业{i}" for i in range(6)]
+CODES = [f"{600000 + i:06d}" for i in range(60)]
+
+def _trade_dates():
+    today = pd.Timestamp(date.today())
+    return pd.DataFrame({'trade_date': pd.bdate_range(today - timedelta(days=400), today + timedelta(days=60)).date})
+
+def _industry_flow(symbol='即时'):
+    inflow = [120.5, 80.25, 64.0, 33.5, 20.0, 11.75]
+    outflow = [20.5, 90.25, 14.0, 53.5, 10.0, 1.75]
+    return pd.DataFrame({'序号': range(1, 7), '行业': INDUSTRIES, '行业指数': 1000.0, '行业-涨跌幅': 0.5,
+                         '流入资金': inflow, '流出资金': outflow, '净额': [a - b for a, b in zip(inflow, outflow)],
+                         '公司家数': 10, '领涨股': '股', '领涨股-涨跌幅': 1.0, '当前价': 10.0})
+
+def _a_spot():
+    volume = [float(1000 * (i + 1)) for i in range(len(CODES))]
+    return pd.DataFrame({'代码': ['sh' + code for code in CODES], '名称': [f"S{i}" for i in range(len(CODES))],
+                         '最新价': 10.0, '涨跌幅': [i / 10 for i in range(len(CODES))],
+                         '成交量': volume, '成交额': [v * 10 for v in volume]})
+
+def _us_spot():
+    return pd.DataFrame({'名称': [f"US{i}" for i in range(5)], '最新价': 100.0, '涨跌幅': [1.5, -0.5, 0.25, 2.0, -1.0]})
+
+def _board_names():
+    return pd.DataFrame({'name': INDUSTRIES, 'code': [f"881{i:03d}" for i in range(len(INDUSTRIES))]})
+
+def _board_members(symbol):
+    i = INDUSTRIES.index(symbol)
+    codes = [code for j, code in enumerate(CODES) if j % len(INDUSTRIES) == i]
+    return pd.DataFrame({'代码': codes, '名称': [f"S{CODES.index(code)}" for code in codes]})
+
+# 录制时代替akshare返回的数据，没有列出的接口按网络异常处理
+FIXTURES = {
+    'tool_trade_date_hist_sina': _trade_dates,
+    'stock_fund_flow_industry': _industry_flow,
+    'stock_zh_a_spot': _a_spot,
+    'stock_us_dji_spot': _us_spot,
+    'stock_board_industry_name_ths': _board_names,
+    'stock_board_industry_cons_ths': _board_members,
+}
+
+class FixtureProvider(DataProvider):
+    """录制模式下用固定数据代替akshare的数据源"""
+    
+    def _live(self, func_name, kwargs):
+        if func_name not in FIXTURES:
+            raise ConnectionError(f"{func_name} 不可用")
+        return FIXTURES[func_name](**kwargs)
+
+class RecordingSender:
+    """记录发送请求的通知发送器"""
+    
+    def __init__(self):
+        self.sent = []
+    
+    def send_notification(self, title, message, methods=None):
+        self.sent.append(title)
+        return {}
+
+class ReplayTest(unittest.TestCase):
+    """录制一次完整的分析后离线回放，回放的报告应与录制时一致，且不影响实际运行的状态"""
+    
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+        self.recordings_dir = os.path.join(self.tmp_dir.name, "recordings")
+        self.sandbox = os.path.join(self.recordings_dir, SANDBOX_DIR)
+    
+    def tearDown(self):
+        trading_calendar.configure()
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+    
+    def _run(self, provider):
+        analyzer = StockAnalyzer(workers=1, provider=provider)
+        analyzer.notification_sender = RecordingSender()
+        report = analyzer.run_analysis_report(notify=True)
+        analyzer.charts.wait()
+        
+        self.assertIsNotNone(report['message'])
+        self.assertEqual(analyzer.notification_sender.sent, [])
+        self.assertEqual(report['results']['industry_flow']['source'], '即时')
+        self.assertEqual(trading_calendar.get_calendar('CN').source, 'fetched')
+        reports = [name for name in os.listdir(os.path.join(self.sandbox, "output")) if name.startswith("report_")]
+        self.assertEqual(len(reports), 1)
+        self.assertTrue(os.path.isdir(os.path.join(self.sandbox, "history", "industry_flow")))
+        return report
+    
+    def test_replay_matches_recording(self):
+        recorded = self._run(FixtureProvider('record', self.recordings_dir))
+        replayed = self._run(DataProvider('replay', self.recordings_dir))
+        
+        self.assertEqual(replayed['message'], recorded['message'])
+        self.assertIn("行业0", replayed['message'])
+        for name in ('industry_flow', 'abnormal_volume', 'us_stock'):
+            pd.testing.assert_frame_equal(replayed['results'][name]['data'], recorded['results'][name]['data'])
+        # 实际运行的状态和输出目录不受影响
+        for name in ("history", "output", "cache"):
+            self.assertFalse(os.path.exists(os.path.join(self.tmp_dir.name, name)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import Job, Scheduler
+
+class OverlappingRunTest(unittest.TestCase):
+    """上一次运行尚未结束时到期的运行应被跳过，且调度循环不能空转"""
+    
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.state_file = os.path.join(self.tmp_dir.name, "scheduler_state.json")
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def test_skipped_run_advances_next_run(self):
+        scheduler = Scheduler(state_file=self.state_file)
+        job = Job("minutely", "* * * * *", lambda job: None, grace=3600)
+        scheduler.set_jobs([job])
+        now = datetime.now().replace(second=30, microsecond=0)
+        due = now.replace(second=0)
+        
+        # 模拟上一次运行尚未结束
+        job.running.acquire()
+        try:
+            scheduler._start(job, due)
+        finally:
+            job.running.release()
+        
+        self.assertEqual(scheduler.state[job.name], due)
+        self.assertGreater(scheduler.next_run(job, now), now)
+        self.assertEqual(Scheduler(state_file=self.state_file).state[job.name], due)
+    
+    def test_run_loop_does_not_spin_while_job_running(self):
+        scheduler = Scheduler(state_file=self.state_file)
+        job = Job("minutely", "* * * * *", lambda job: None, grace=3600)
+        scheduler.set_jobs([job])
+        scheduler.state[job.name] = datetime.now() - timedelta(minutes=2)
+        
+        calls = []
+        next_run = scheduler.next_run
+        
+        def counting_next_run(job, now=None):
+            calls.append(now)
+            return next_run(job, now)
+        
+        scheduler.next_run = counting_next_run
+        job.running.acquire()
+        thread = threading.Thread(target=scheduler.run, daemon=True)
+        try:
+            thread.start()
+            time.sleep(0.5)
+        finally:
+            scheduler.stop(timeout=1)
+            thread.join(1)
+            job.running.release()
+        
+        self.assertFalse(thread.is_alive())
+        # 跳过到期的运行后应一直等待到下一分钟，而不是反复检查同一个到期时间
+        self.assertLess(len(calls), 20)
+        self.assertGreater(scheduler.next_run(job), datetime.now())
+
+if __name__ == "__main__":
+    unittest.main()
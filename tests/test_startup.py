@@ -0,0 +1,26 @@
+import os
+import sys
+import subprocess
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 命令行入口导入时不应加载的重量级模块
+HEAVY_MODULES = ["pandas", "numpy", "pyarrow", "matplotlib", "notification_utils"]
+
+class StartupImportTest(unittest.TestCase):
+    """导入命令行入口模块时不加载pandas、numpy、pyarrow等依赖，--help和--startup-profile启动很快"""
+    
+    def _loaded_modules(self, module):
+        code = f"import sys, {module}; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+        result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+        return result.stdout.split()
+    
+    def test_stock_analysis_import_is_light(self):
+        self.assertEqual(self._loaded_modules("stock_analysis"), [])
+    
+    def test_auto_analyzer_import_is_light(self):
+        self.assertEqual(self._loaded_modules("auto_analyzer"), [])
+
+if __name__ == "__main__":
+    unittest.main()
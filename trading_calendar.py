@@ -0,0 +1,260 @@
+import os
+import json
+import logging
+import threading
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+# 交易日历缓存超过该天数后重新获取
+REFRESH_DAYS = 30
+
+# 交易日历至少应覆盖到今天之后的天数，不足时提前刷新（A股次年的休市安排通常在12月公布）
+MIN_LOOKAHEAD_DAYS = 7
+
+# 常驻进程中的日历需要重新加载但未能更新时（如获取失败），至少间隔该分钟数再尝试
+RELOAD_RETRY_MINUTES = 60
+
+# 计算美股交易日历的起始年份
+US_START_YEAR = 1990
+
+def _weekday_sessions(start, end):
+    """返回start到end之间的所有工作日，无法获取交易日历时使用"""
+    days = np.arange(start.toordinal(), end.toordinal() + 1)
+    # 公元1年1月1日是周一，ordinal为1
+    return days[(days - 1) % 7 < 5]
+
+_calendars = {}
+_calendars_lock = threading.Lock()
+
+# 获取A股交易日历使用的数据源和缓存目录，见configure()
+_provider = None
+_cache_dir = "./cache"
+
+def configure(provider=None, cache_dir="./cache"):
+    """设置获取A股交易日历使用的数据源和日历缓存目录，已加载的日历在下次使用时按新的设置重新加载
+    
+    录制和回放时交易日历也经过同一个数据源，离线回放时不需要访问网络。
+    
+    Args:
+        provider (DataProvider): 数据源，为None时直接获取
+        cache_dir (str): 交易日历缓存目录
+    """
+    global _provider, _cache_dir
+    with _calendars_lock:
+        _provider = provider
+        _cache_dir = cache_dir
+        _calendars.clear()
+
+def _fetch_cn_sessions(provider=None):
+    """通过数据源获取A股历史及本年度的交易日
+    
+    Args:
+        provider (DataProvider): 数据源，为None时创建直接获取的数据源
+    """
+    if provider is None:
+        # 只有交易日历缓存过期时才导入数据源和akshare
+        from data_provider import DataProvider
+        provider = DataProvider()
+    df = provider.call('tool_trade_date_hist_sina')
+    days = sorted({day.toordinal() for day in (d if isinstance(d, date) else datetime.strptime(str(d)[:10], '%Y-%m-%d').date()
+                                               for d in df['trade_date'])})
+    return np.array(days, dtype=np.int64)
+
+def _compute_us_sessions():
+    """按纽约证券交易所的休市规则计算美股交易日"""
+    from pandas.tseries.holiday import (AbstractHolidayCalendar, Holiday, GoodFriday, USLaborDay,
+                                        USMartinLutherKingJr, USMemorialDay, USPresidentsDay, USThanksgivingDay,
+                                        nearest_workday, sunday_to_monday)
+    
+    class NYSEHolidayCalendar(AbstractHolidayCalendar):
+        rules = [
+            # 元旦逢周六时不在前一个周五补休
+            Holiday('NewYearsDay', month=1, day=1, observance=sunday_to_monday),
+            USMartinLutherKingJr,
+            USPresidentsDay,
+            GoodFriday,
+            USMemorialDay,
+            Holiday('Juneteenth', month=6, day=19, start_date='2022-01-01', observance=nearest_workday),
+            Holiday('IndependenceDay', month=7, day=4, observance=nearest_workday),
+            USLaborDay,
+            USThanksgivingDay,
+            Holiday('Christmas', month=12, day=25, observance=nearest_workday),
+        ]
+    
+    start = date(US_START_YEAR, 1, 1)
+    end = date(date.today().year + 1, 12, 31)
+    holidays = {day.date().toordinal() for day in NYSEHolidayCalendar().holidays(start, end)}
+    days = _weekday_sessions(start, end)
+    return days[~np.isin(days, list(holidays))]
+
+class TradingCalendar:
+    """交易日历，加载一次后用数组下标以O(1)回答某天是否为交易日、上一个/下一个交易日
+    
+    A股交易日历通过akshare获取，美股按休市规则计算，都缓存到本地文件，超过REFRESH_DAYS天或
+    未覆盖到今天之后MIN_LOOKAHEAD_DAYS天时才重新获取；获取失败时沿用旧的缓存，
+    没有缓存时按工作日处理。日历范围之外的日期也按工作日处理。
+    """
+    
+    def __init__(self, market='CN', cache_dir="./cache", provider=None):
+        """初始化交易日历
+        
+        Args:
+            market (str): 市场代码，'CN'或'US'
+            cache_dir (str): 交易日历缓存目录
+            provider (DataProvider): 获取A股交易日历的数据源，为None时直接获取
+        """
+        self.market = market
+        self.provider = provider
+        self.cache_file = os.path.join(cache_dir, f"trade_calendar_{market}.json")
+        self.logger = logging.getLogger("stock_analyzer")
+        self.source = None
+        self.loaded_at = datetime.now()
+        self._build_index(self._load())
+    
+    def _load(self):
+        """读取缓存的交易日，过期或覆盖范围不足时重新获取"""
+        cached, fetched_at = None, None
+        if os.path.exists(self.cache_file):
+            try:
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    payload = json.load(f)
+                cached = np.array(payload['sessions'], dtype=np.int64)
+                fetched_at = datetime.fromisoformat(payload['fetched_at'])
+            except Exception as e:
+                self.logger.warning(f"读取{self.market}交易日历缓存失败: {e}")
+        
+        today = date.today().toordinal()
+        if (cached is not None and len(cached) and datetime.now() - fetched_at < timedelta(days=REFRESH_DAYS)
+                and cached[-1] >= today + MIN_LOOKAHEAD_DAYS):
+            self.source = 'cache'
+            return cached
+        
+        try:
+            sessions = _fetch_cn_sessions(self.provider) if self.market == 'CN' else _compute_us_sessions()
+            self._save(sessions)
+            self.source = 'fetched'
+            self.logger.info(f"已更新{self.market}交易日历，共{len(sessions)}个交易日，"
+                             f"截至{date.fromordinal(int(sessions[-1]))}")
+            return sessions
+        except Exception as e:
+            if cached is not None and len(cached):
+                self.logger.warning(f"更新{self.market}交易日历失败，继续使用缓存的日历: {e}")
+                self.source = 'cache'
+                return cached
+            self.logger.warning(f"获取{self.market}交易日历失败，暂按工作日判断交易日: {e}")
+            self.source = 'weekday'
+            return None
+    
+    def _save(self, sessions):
+        """保存交易日到缓存文件"""
+        cache_dir = os.path.dirname(self.cache_file)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_file = self.cache_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'fetched_at': datetime.now().isoformat(timespec='seconds'),
+                       'sessions': [int(day) for day in sessions]}, f)
+        os.replace(tmp_file, self.cache_file)
+    
+    def needs_reload(self, now=None):
+        """常驻进程中的日历是否需要重新加载：加载超过REFRESH_DAYS天，或未覆盖到今天之后MIN_LOOKAHEAD_DAYS天
+        
+        距离上次加载不足RELOAD_RETRY_MINUTES分钟时返回False，获取失败时不会每次调用都重新请求。
+        """
+        now = now or datetime.now()
+        if now - self.loaded_at < timedelta(minutes=RELOAD_RETRY_MINUTES):
+            return False
+        return (self._last is None or self._last < now.date().toordinal() + MIN_LOOKAHEAD_DAYS
+                or now - self.loaded_at >= timedelta(days=REFRESH_DAYS))
+    
+    def _build_index(self, sessions):
+        """按日期序号建立查找数组：是否为交易日，以及不晚于该日的最近交易日在sessions中的位置"""
+        if sessions is None or len(sessions) == 0:
+            self._first = self._last = None
+            return
+        self._sessions = np.asarray(sessions, dtype=np.int64)
+        self._first = int(self._sessions[0])
+        self._last = int(self._sessions[-1])
+        span = self._last - self._first + 1
+        self._is_session = np.zeros(span, dtype=bool)
+        self._is_session[self._sessions - self._first] = True
+        # 不晚于该日的交易日个数减1，即最近交易日的位置
+        self._prev_index = np.cumsum(self._is_session) - 1
+    
+    def _in_range(self, ordinal):
+        return self._first is not None and self._first <= ordinal <= self._last
+    
+    def is_session(self, day):
+        """判断某天是否为交易日"""
+        ordinal = day.toordinal()
+        if not self._in_range(ordinal):
+            return day.weekday() < 5
+        return bool(self._is_session[ordinal - self._first])
+    
+    def previous_session(self, day, inclusive=True):
+        """返回不晚于day（inclusive为False时早于day）的最近一个交易日"""
+        if not inclusive:
+            day -= timedelta(days=1)
+        ordinal = day.toordinal()
+        if self._in_range(ordinal):
+            return date.fromordinal(int(self._sessions[self._prev_index[ordinal - self._first]]))
+        # 日历范围之外按工作日处理
+        while day.weekday() >= 5:
+            day -= timedelta(days=1)
+        if self._first is not None and self._last < ordinal and day.toordinal() <= self._last:
+            return date.fromordinal(self._last)
+        return day
+    
+    def next_session(self, day, inclusive=False):
+        """返回晚于day（inclusive为True时不早于day）的下一个交易日"""
+        if not inclusive:
+            day += timedelta(days=1)
+        ordinal = day.toordinal()
+        if self._in_range(ordinal):
+            position = self._prev_index[ordinal - self._first]
+            if self._is_session[ordinal - self._first]:
+                return day
+            if position + 1 < len(self._sessions):
+                return date.fromordinal(int(self._sessions[position + 1]))
+            day = date.fromordinal(self._last + 1)
+        while day.weekday() >= 5:
+            day += timedelta(days=1)
+        return day
+    
+    def sessions_between(self, start, end):
+        """返回start到end（含）之间的交易日列表"""
+        days = []
+        day = self.next_session(start, inclusive=True)
+        while day <= end:
+            days.append(day)
+            day = self.next_session(day)
+        return days
+
+def get_calendar(market='CN', cache_dir=None):
+    """返回市场的交易日历，进程内共用，过期或覆盖范围不足时重新加载（见TradingCalendar.needs_reload）
+    
+    Args:
+        market (str): 市场代码，'CN'或'US'
+        cache_dir (str): 交易日历缓存目录，为None时使用configure()设置的目录
+    """
+    with _calendars_lock:
+        calendar = _calendars.get(market)
+        if calendar is None or calendar.needs_reload():
+            calendar = _calendars[market] = TradingCalendar(market, cache_dir or _cache_dir, _provider)
+        return calendar
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='交易日历查询工具')
+    parser.add_argument('--market', choices=['CN', 'US'], default='CN', help='市场')
+    parser.add_argument('--date', default=None, help='查询的日期 YYYY-MM-DD，默认为今天')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    calendar = get_calendar(args.market)
+    day = datetime.strptime(args.date, '%Y-%m-%d').date() if args.date else date.today()
+    print(f"{args.market}交易日历（来源: {calendar.source}）")
+    print(f"{day} 是否为交易日: {'是' if calendar.is_session(day) else '否'}")
+    print(f"上一个交易日: {calendar.previous_session(day, inclusive=False)}")
+    print(f"下一个交易日: {calendar.next_session(day)}")
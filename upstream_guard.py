@@ -0,0 +1,269 @@
+import os
+import time
+import random
+import sqlite3
+import logging
+import threading
+import contextlib
+import http.client
+import urllib.error
+
+import metrics
+from fetch_pool import function_host
+
+# 各站点的令牌桶参数：(每秒补充的令牌数, 桶容量)，未列出的站点使用DEFAULT_RATE_LIMIT
+RATE_LIMITS = {
+    'ths': (2.0, 5),
+    'eastmoney': (5.0, 10),
+    'sina': (2.0, 5),
+}
+DEFAULT_RATE_LIMIT = (1.0, 3)
+
+# 熔断器：连续FAILURE_THRESHOLD次请求（每次请求的重试合计为一次）因连接或HTTP错误失败后，
+# 在COOLDOWN秒内直接失败，冷却结束后放行一次试探请求
+FAILURE_THRESHOLD = 5
+COOLDOWN = 60
+
+# 重试次数和退避时间（秒），第n次重试前等待0到min(MAX_BACKOFF, BACKOFF * 2**n)之间的随机时间
+RETRIES = 2
+BACKOFF = 1.0
+MAX_BACKOFF = 10.0
+
+# 等待令牌超过该秒数时记录日志
+LOG_WAIT_SECONDS = 1.0
+
+# 熔断器状态在breaker_state指标中的取值
+BREAKER_STATE_VALUES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+def _upstream_error_types():
+    """计入熔断器的异常类型：连接、超时和HTTP错误；解析数据出错（如KeyError）说明站点有响应，不计入"""
+    types = [ConnectionError, TimeoutError, urllib.error.URLError, http.client.HTTPException]
+    try:
+        import requests
+        types += [requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                  requests.exceptions.HTTPError, requests.exceptions.ChunkedEncodingError]
+    except ImportError:
+        pass
+    return tuple(types)
+
+UPSTREAM_ERRORS = _upstream_error_types()
+
+class CircuitOpenError(RuntimeError):
+    """站点的熔断器处于打开状态，请求未发出即失败"""
+
+class UpstreamGuard:
+    """所有上游数据请求共用的限流、熔断和重试
+    
+    令牌桶和熔断器状态保存在SQLite文件中，每次读写都在BEGIN IMMEDIATE事务内完成，
+    同一台机器上的多个线程和进程（自动分析器、盘中监控、子进程分析、历史数据回填）共享同一个限额。
+    取令牌时先预留再等待，令牌数可以为负，并发的请求按到达顺序依次等待，不会同时醒来抢令牌。
+    """
+    
+    def __init__(self, state_file="./cache/upstream_guard.db", rate_limits=None, failure_threshold=FAILURE_THRESHOLD,
+                 cooldown=COOLDOWN, retries=RETRIES, backoff=BACKOFF, max_backoff=MAX_BACKOFF):
+        """初始化上游请求保护
+        
+        Args:
+            state_file (str): 共享状态的SQLite文件路径
+            rate_limits (dict): 站点 -> (每秒令牌数, 桶容量)，覆盖RATE_LIMITS
+            failure_threshold (int): 打开熔断器的连续失败次数
+            cooldown (float): 熔断器打开后直接失败的时间（秒）
+            retries (int): 请求失败后的重试次数
+            backoff (float): 第一次重试前的最长等待时间（秒），之后每次翻倍
+            max_backoff (float): 重试前的最长等待时间（秒）
+        """
+        self.state_file = state_file
+        self.rate_limits = dict(RATE_LIMITS, **(rate_limits or {}))
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.logger = logging.getLogger("stock_analyzer")
+        self._init_db()
+    
+    def _init_db(self):
+        """创建状态表"""
+        state_dir = os.path.dirname(self.state_file)
+        if state_dir and not os.path.exists(state_dir):
+            os.makedirs(state_dir, exist_ok=True)
+        with self._transaction() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS buckets (host TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+            db.execute("CREATE TABLE IF NOT EXISTS breakers (host TEXT PRIMARY KEY, state TEXT, failures INTEGER, "
+                       "opened_until REAL, updated REAL)")
+    
+    @contextlib.contextmanager
+    def _transaction(self):
+        """打开一个写事务，事务期间其他进程的读写会等待"""
+        db = sqlite3.connect(self.state_file, timeout=30, isolation_level=None)
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        finally:
+            db.close()
+    
+    def acquire(self, host):
+        """从站点的令牌桶取一个令牌，没有令牌时等待，返回等待的秒数"""
+        rate, burst = self.rate_limits.get(host, DEFAULT_RATE_LIMIT)
+        with self._transaction() as db:
+            now = time.time()
+            row = db.execute("SELECT tokens, updated FROM buckets WHERE host = ?", (host,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+            tokens -= 1
+            db.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)", (host, tokens, now))
+        
+        wait = -tokens / rate if tokens < 0 else 0.0
+        if wait > 0:
+            with metrics.span('throttle', host):
+                time.sleep(wait)
+            if wait >= LOG_WAIT_SECONDS:
+                self.logger.info(f"站点{host}请求限流，等待{wait:.1f}秒")
+        return wait
+    
+    def _before_call(self, host):
+        """检查熔断器，打开时抛出CircuitOpenError；冷却结束后只放行一次试探请求
+        
+        Returns:
+            bool: 本次请求是否为试探请求
+        """
+        with self._transaction() as db:
+            now = time.time()
+            row = db.execute("SELECT state, opened_until FROM breakers WHERE host = ?", (host,)).fetchone()
+            if row is None or row[0] == 'closed':
+                return False
+            state, opened_until = row
+            if now < opened_until:
+                remaining = opened_until - now
+                raise CircuitOpenError(f"站点{host}的熔断器已打开，{remaining:.0f}秒后重试")
+            # 冷却结束：第一个请求作为试探，试探期间其他请求直接失败，试探超过冷却时间未结束则再放行一个
+            db.execute("UPDATE breakers SET state = 'half_open', opened_until = ?, updated = ? WHERE host = ?",
+                       (now + self.cooldown, now, host))
+        if state == 'open':
+            self.logger.info(f"站点{host}的熔断器冷却结束，放行试探请求")
+        return True
+    
+    def _record(self, host, ok):
+        """记录一次请求（含重试）的结果，更新熔断器状态，返回熔断器的新状态"""
+        with self._transaction() as db:
+            now = time.time()
+            row = db.execute("SELECT state, failures FROM breakers WHERE host = ?", (host,)).fetchone()
+            state, failures = row if row is not None else ('closed', 0)
+            if ok:
+                if state == 'closed' and failures == 0:
+                    return state
+                db.execute("INSERT OR REPLACE INTO breakers VALUES (?, 'closed', 0, 0, ?)", (host, now))
+                new_state = 'closed'
+            else:
+                failures += 1
+                new_state = 'open' if state == 'half_open' or failures >= self.failure_threshold else state
+                opened_until = now + self.cooldown if new_state == 'open' else 0
+                db.execute("INSERT OR REPLACE INTO breakers VALUES (?, ?, ?, ?, ?)",
+                           (host, new_state, failures, opened_until, now))
+        if new_state != state:
+            if new_state == 'open':
+                self.logger.warning(f"站点{host}连续失败{failures}次，熔断器打开，{self.cooldown:.0f}秒内直接失败")
+            else:
+                self.logger.info(f"站点{host}的请求恢复正常，熔断器关闭")
+        return new_state
+    
+    def call(self, host, fn, *args, **kwargs):
+        """在限流、熔断和重试的保护下调用fn(*args, **kwargs)
+        
+        Args:
+            host (str): 请求的站点，见fetch_pool.FUNCTION_HOSTS
+            fn (callable): 实际发出请求的函数
+        
+        Raises:
+            CircuitOpenError: 熔断器打开时不发出请求直接失败
+        
+        一次调用不论重试几次，只向熔断器记录一次结果；只有连接、超时和HTTP错误（UPSTREAM_ERRORS）记为失败，
+        解析数据出错说明站点有响应，记为成功。试探请求不重试。
+        """
+        with metrics.span('breaker', host):
+            probe = self._before_call(host)
+        retries = 0 if probe else self.retries
+        for attempt in range(retries + 1):
+            self.acquire(host)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if attempt >= retries:
+                    self._record(host, not isinstance(e, UPSTREAM_ERRORS))
+                    raise
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                self.logger.warning(f"站点{host}请求失败，{delay:.1f}秒后第{attempt + 1}次重试: {e}")
+                time.sleep(delay)
+                continue
+            self._record(host, True)
+            return result
+    
+    def call_function(self, func_name, fn, **kwargs):
+        """调用akshare接口func_name，按接口所属的站点限流和熔断"""
+        return self.call(function_host(func_name), fn, **kwargs)
+    
+    def status(self):
+        """返回各站点的令牌数（负数表示有请求正在排队等待）和熔断器状态：站点 -> dict"""
+        hosts = {}
+        with self._transaction() as db:
+            now = time.time()
+            for host, tokens, updated in db.execute("SELECT host, tokens, updated FROM buckets"):
+                rate, burst = self.rate_limits.get(host, DEFAULT_RATE_LIMIT)
+                hosts.setdefault(host, {})['tokens'] = min(burst, tokens + (now - updated) * rate)
+            for host, state, failures, opened_until, _ in db.execute("SELECT * FROM breakers"):
+                hosts.setdefault(host, {}).update(state=state, failures=failures,
+                                                  cooldown_left=max(0.0, opened_until - now))
+        return hosts
+    
+    def breaker_samples(self):
+        """各站点熔断器状态的指标样本，供metrics.register_gauge使用"""
+        return [({'host': host}, BREAKER_STATE_VALUES.get(state['state'], 0))
+                for host, state in sorted(self.status().items()) if 'state' in state]
+    
+    def reset(self, host=None):
+        """清除站点（为None时清除所有站点）的令牌桶和熔断器状态"""
+        with self._transaction() as db:
+            for table in ('buckets', 'breakers'):
+                if host is None:
+                    db.execute(f"DELETE FROM {table}")
+                else:
+                    db.execute(f"DELETE FROM {table} WHERE host = ?", (host,))
+
+_guard = None
+_guard_lock = threading.Lock()
+
+def get_guard():
+    """返回进程共享的上游请求保护，首次使用时创建"""
+    global _guard
+    with _guard_lock:
+        if _guard is None:
+            _guard = UpstreamGuard()
+            metrics.register_gauge('upstream_breaker_state', '上游站点熔断器状态：0关闭，1半开，2打开',
+                                   _guard.breaker_samples)
+        return _guard
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='上游请求限流和熔断状态查看工具')
+    parser.add_argument('--reset', nargs='?', const='', default=None, metavar='HOST',
+                        help='清除指定站点（不指定时清除所有站点）的限流和熔断状态')
+    args = parser.parse_args()
+    
+    guard = get_guard()
+    if args.reset is not None:
+        guard.reset(args.reset or None)
+        print("已清除" + (f"站点{args.reset}" if args.reset else "所有站点") + "的限流和熔断状态")
+    hosts = guard.status()
+    if not hosts:
+        print("还没有上游请求记录")
+    for host, state in sorted(hosts.items()):
+        line = f"{host}: 令牌{state.get('tokens', 0):.1f}"
+        if 'state' in state:
+            line += f"，熔断器{state['state']}，连续失败{state['failures']}次"
+            if state['cooldown_left'] > 0 and state['state'] != 'closed':
+                line += f"，剩余冷却{state['cooldown_left']:.0f}秒"
+        print(line)
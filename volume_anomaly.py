@@ -0,0 +1,279 @@
+import os
+import logging
+import threading
+import warnings
+from datetime import time as dt_time
+
+import numpy as np
+import pandas as pd
+from data_cache import market_now
+from trading_calendar import get_calendar
+from screener import Screener
+
+# A股连续竞价时段（当地时间），共240分钟
+TRADING_PERIODS = [
+    (dt_time(9, 30), dt_time(11, 30)),
+    (dt_time(13, 0), dt_time(15, 0)),
+]
+TRADING_MINUTES = 240
+
+def trading_fraction(now=None):
+    """返回当前时刻已经过的连续竞价时间占全天的比例，开盘前为0，收盘后为1"""
+    now = now or market_now('CN')
+    if not get_calendar('CN').is_session(now.date()):
+        return 1.0
+    elapsed = 0.0
+    current = now.hour * 60 + now.minute + now.second / 60
+    for start, end in TRADING_PERIODS:
+        start_min = start.hour * 60 + start.minute
+        end_min = end.hour * 60 + end.minute
+        elapsed += min(max(current - start_min, 0), end_min - start_min)
+    return elapsed / TRADING_MINUTES
+
+def normalize_codes(codes):
+    """把'sz000981'、'000981.SZ'等形式的股票代码统一为6位数字代码"""
+    codes = pd.Series(codes).astype(str)
+    return codes.str.extract(r"(\d{6})", expand=False).fillna(codes).to_numpy(dtype=object)
+
+class VolumeAnomalyEngine:
+    """基于个股自身历史基线的成交量异常评分引擎
+    
+    为每只股票维护最近window个交易日的成交量和成交额环形缓冲区，以及成交量的滚动和与平方和。
+    每个交易日收盘后调用update()把当日数据滚入基线（只更新一列，不重新计算全部历史），
+    score()用向量化运算对整个快照计算量比、成交量Z值和成交额相对滚动中位数的倍数。
+    """
+    
+    def __init__(self, state_file="./cache/volume_baseline.npz", window=20, min_periods=5):
+        """初始化评分引擎
+        
+        Args:
+            state_file (str): 基线状态文件路径
+            window (int): 基线交易日数
+            min_periods (int): 参与评分所需的最少历史交易日数
+        """
+        self.state_file = state_file
+        self.window = window
+        self.min_periods = min_periods
+        self.logger = logging.getLogger("stock_analyzer")
+        self._lock = threading.Lock()
+        self._reset()
+        self.load()
+    
+    def _reset(self):
+        """清空基线状态"""
+        self.codes = np.array([], dtype='U12')
+        self.volumes = np.full((0, self.window), np.nan)
+        self.amounts = np.full((0, self.window), np.nan)
+        self.vol_sum = np.zeros(0)
+        self.vol_sumsq = np.zeros(0)
+        self.counts = np.zeros(0, dtype=np.int32)
+        self.pos = 0
+        self.sessions = []
+        self._code_index = pd.Index(self.codes)
+    
+    @property
+    def last_session(self):
+        """最近一次滚入基线的交易日"""
+        return self.sessions[-1] if self.sessions else None
+    
+    def load(self):
+        """从状态文件加载基线，窗口长度不一致时丢弃旧状态"""
+        if not os.path.exists(self.state_file):
+            return False
+        try:
+            with np.load(self.state_file, allow_pickle=False) as state:
+                if state['volumes'].shape[1] != self.window:
+                    self.logger.warning("成交量基线窗口长度已变化，丢弃旧的基线状态")
+                    return False
+                self.codes = state['codes']
+                self.volumes = state['volumes']
+                self.amounts = state['amounts']
+                self.pos = int(state['pos'])
+                self.sessions = [str(s) for s in state['sessions']]
+            self._code_index = pd.Index(self.codes)
+            self._recompute_sums()
+            return True
+        except Exception as e:
+            self.logger.error(f"加载成交量基线状态失败: {e}")
+            self._reset()
+            return False
+    
+    def save(self):
+        """保存基线状态"""
+        state_dir = os.path.dirname(self.state_file)
+        if state_dir and not os.path.exists(state_dir):
+            os.makedirs(state_dir)
+        tmp_file = self.state_file + ".tmp.npz"
+        np.savez_compressed(
+            tmp_file,
+            codes=self.codes,
+            volumes=self.volumes,
+            amounts=self.amounts,
+            pos=self.pos,
+            sessions=np.array(self.sessions, dtype='U8'),
+        )
+        os.replace(tmp_file, self.state_file)
+    
+    def _recompute_sums(self):
+        """根据环形缓冲区重新计算滚动和，消除增量更新的浮点误差累积"""
+        valid = ~np.isnan(self.volumes)
+        filled = np.where(valid, self.volumes, 0.0)
+        self.vol_sum = filled.sum(axis=1)
+        self.vol_sumsq = (filled * filled).sum(axis=1)
+        self.counts = valid.sum(axis=1).astype(np.int32)
+    
+    def _align(self, codes):
+        """返回快照股票在基线中的行号，新出现的股票追加到基线末尾"""
+        indexer = self._code_index.get_indexer(codes)
+        new_codes = pd.unique(codes[indexer < 0])
+        if len(new_codes):
+            n_new = len(new_codes)
+            self.codes = np.concatenate([self.codes, new_codes.astype('U12')])
+            self.volumes = np.vstack([self.volumes, np.full((n_new, self.window), np.nan)])
+            self.amounts = np.vstack([self.amounts, np.full((n_new, self.window), np.nan)])
+            self.vol_sum = np.concatenate([self.vol_sum, np.zeros(n_new)])
+            self.vol_sumsq = np.concatenate([self.vol_sumsq, np.zeros(n_new)])
+            self.counts = np.concatenate([self.counts, np.zeros(n_new, dtype=np.int32)])
+            self._code_index = pd.Index(self.codes)
+            indexer = self._code_index.get_indexer(codes)
+        return indexer
+    
+    def update(self, snapshot, session):
+        """把一个交易日收盘后的全市场快照滚入基线
+        
+        同一交易日重复调用时替换该日的数据，而不是重复计入。
+        
+        Args:
+            snapshot (DataFrame): 包含'代码'、'成交量'、'成交额'列的全市场快照
+            session (str): 交易日 'YYYYMMDD'
+        """
+        session = str(session)
+        with self._lock:
+            if self.sessions and session < self.sessions[-1]:
+                self.logger.warning(f"交易日{session}早于基线中最近的交易日{self.sessions[-1]}，跳过更新")
+                return False
+            
+            codes = normalize_codes(snapshot['代码'])
+            volumes = pd.to_numeric(snapshot['成交量'], errors='coerce').to_numpy(dtype=float, copy=True)
+            amounts = pd.to_numeric(snapshot['成交额'], errors='coerce').to_numpy(dtype=float, copy=True)
+            # 停牌股票成交量为0，不计入基线
+            volumes[volumes <= 0] = np.nan
+            amounts[np.isnan(volumes)] = np.nan
+            rows = self._align(codes)
+            
+            if self.sessions and session == self.sessions[-1]:
+                slot = (self.pos - 1) % self.window
+            else:
+                slot = self.pos
+                self.pos = (self.pos + 1) % self.window
+                self.sessions = (self.sessions + [session])[-self.window:]
+            
+            # 先移出该列旧数据，再计入新数据
+            old = self.volumes[:, slot]
+            old_valid = ~np.isnan(old)
+            self.vol_sum[old_valid] -= old[old_valid]
+            self.vol_sumsq[old_valid] -= old[old_valid] ** 2
+            self.counts[old_valid] -= 1
+            
+            self.volumes[:, slot] = np.nan
+            self.amounts[:, slot] = np.nan
+            self.volumes[rows, slot] = volumes
+            self.amounts[rows, slot] = amounts
+            
+            new = self.volumes[:, slot]
+            new_valid = ~np.isnan(new)
+            self.vol_sum[new_valid] += new[new_valid]
+            self.vol_sumsq[new_valid] += new[new_valid] ** 2
+            self.counts[new_valid] += 1
+            
+            # 环形缓冲区转满一圈时重算滚动和
+            if self.pos == 0:
+                self._recompute_sums()
+        
+        self.logger.debug(f"成交量基线已更新至{session}，共{len(self.codes)}只股票")
+        return True
+    
+    def bootstrap(self, history):
+        """用历史全市场快照初始化基线
+        
+        Args:
+            history (DataFrame): 包含'date'、'代码'、'成交量'、'成交额'列的多日快照
+        """
+        with self._lock:
+            self._reset()
+        if history is None or len(history) == 0:
+            return 0
+        sessions = sorted(pd.to_datetime(history['date']).dt.strftime('%Y%m%d').unique())[-self.window:]
+        history = history.assign(session=pd.to_datetime(history['date']).dt.strftime('%Y%m%d'))
+        for session, day in history[history['session'].isin(sessions)].groupby('session', sort=True):
+            self.update(day, session)
+        return len(sessions)
+    
+    def score(self, snapshot, fraction=1.0):
+        """对全市场快照计算成交量异常指标
+        
+        Args:
+            snapshot (DataFrame): 包含'代码'、'成交量'、'成交额'列的全市场快照
+            fraction (float): 当日已交易时间占全天的比例，盘中评分时用来折算基线
+        
+        Returns:
+            DataFrame: 快照副本，追加'量比'、'成交量Z值'、'成交额倍数'、'异常评分'和'基线天数'列，
+                基线不足min_periods天的股票各指标为NaN
+        """
+        fraction = min(max(fraction, 1.0 / TRADING_MINUTES), 1.0)
+        codes = normalize_codes(snapshot['代码'])
+        volumes = pd.to_numeric(snapshot['成交量'], errors='coerce').to_numpy(dtype=float)
+        amounts = pd.to_numeric(snapshot['成交额'], errors='coerce').to_numpy(dtype=float)
+        
+        with self._lock:
+            if len(self.codes) == 0:
+                # 基线为空时所有股票都没有历史数据
+                known = np.zeros(len(codes), dtype=bool)
+                counts = np.zeros(len(codes), dtype=np.int32)
+                vol_sum = vol_sumsq = np.zeros(len(codes))
+                amount_window = np.full((len(codes), self.window), np.nan)
+            else:
+                rows = self._code_index.get_indexer(codes)
+                known = rows >= 0
+                safe_rows = np.where(known, rows, 0)
+                counts = np.where(known, self.counts[safe_rows], 0)
+                vol_sum = self.vol_sum[safe_rows]
+                vol_sumsq = self.vol_sumsq[safe_rows]
+                amount_window = self.amounts[safe_rows]
+        
+        valid = known & (counts >= self.min_periods) & (volumes > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = vol_sum / counts
+            std = np.sqrt(np.maximum(vol_sumsq / counts - mean ** 2, 0))
+            expected = mean * fraction
+            volume_ratio = volumes / expected
+            zscore = (volumes - expected) / (std * fraction)
+            zscore[std == 0] = np.nan
+            with warnings.catch_warnings():
+                # 没有基线的股票整行为NaN，忽略All-NaN警告
+                warnings.simplefilter('ignore', RuntimeWarning)
+                amount_median = np.nanmedian(np.where(valid[:, None], amount_window, np.nan), axis=1)
+            amount_ratio = amounts / (amount_median * fraction)
+            # 综合评分：量比与成交额倍数取对数，与截断后的Z值相加
+            score = np.log2(volume_ratio) + np.log2(amount_ratio) + np.clip(zscore, -5, 10) / 2
+        
+        result = snapshot.copy()
+        result['量比'] = np.where(valid, volume_ratio, np.nan)
+        result['成交量Z值'] = np.where(valid, zscore, np.nan)
+        result['成交额倍数'] = np.where(valid, amount_ratio, np.nan)
+        result['异常评分'] = np.where(valid, score, np.nan)
+        result['基线天数'] = counts
+        return result
+    
+    def detect(self, snapshot, fraction=1.0, top_n=20, min_ratio=2.0, min_zscore=2.0):
+        """找出成交量相对自身基线异常放大的股票
+        
+        Returns:
+            DataFrame: 量比不低于min_ratio且Z值不低于min_zscore的股票，按异常评分降序，最多top_n只；
+                没有可用基线时返回None
+        """
+        scored = self.score(snapshot, fraction)
+        if scored['异常评分'].notna().sum() == 0:
+            return None
+        where = (scored['量比'] >= min_ratio) & (scored['成交量Z值'] >= min_zscore)
+        return Screener(scored).top_k('异常评分', top_n, where=where.to_numpy())